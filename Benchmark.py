@@ -0,0 +1,567 @@
+import os
+import sys
+import json
+import random
+import time
+import argparse
+import platform
+import tempfile
+import configparser
+import numpy as np
+from copy import deepcopy
+import learn_capacity_reliability
+import Metrics
+import Network
+import optimize
+import ParseFile
+import ResultCache
+import Simulation
+import SourceNode
+import Strategies
+import VectorSimulation
+
+# Benchmarks of the simulation at different scales.
+#
+# Synthetic configurations with any number of nodes and networks are made by
+# generateConfig. For every combination of numbers of nodes and networks and
+# packet means, runBenchmarks times the hot functions of a time step:
+#
+#   getTraffic           SourceNode.getTraffic, per node
+#   testMetric           Metrics.testMetric, per network
+#   _returnTraffic       Metrics._returnTraffic, per network
+#   final_update_info    Strategies.final_update_info, per node, including
+#                        its learn_prior call every keep_packets calls
+#   learn_prior          learn_capacity_reliability.learn_prior, per node
+#                        and network
+#   solve_opt            optimize.solve_opt, per node
+#
+# and the batch functions the numpy engine runs instead, each timed for one
+# call on all nodes at once:
+#
+#   getTrafficBatch          SourceNode.getTrafficBatch
+#   final_update_info_batch  Strategies.final_update_info_batch, including
+#                            its learn_prior calls every keep_packets calls
+#   solve_opt_batch          optimize.solve_opt_batch
+#
+# on the state reached after a short warm up run, and executeSimulation end
+# to end (writing its output) with every engine for every number of time
+# steps, both seeded and unseeded. Seeded runs give every node and network
+# its own generator, which the numpy engine draws packets from one node at a
+# time, so only unseeded runs time its fully vectorized traffic path.
+#
+# Every timing is the time of one call, the minimum over a number of repeats
+# (the median is kept too). Results are saved as JSON, and a run can be
+# compared against a saved baseline:
+#
+#   python Benchmark.py baseline.json
+#   python Benchmark.py new.json --compare baseline.json
+#
+# which lists the ratio of every timing to the baseline and exits with status
+# 1 if any is slower by more than the threshold.
+
+ENGINES = {'python': Simulation.executeSimulation,
+           'numpy': VectorSimulation.executeSimulation}
+
+DEFAULT_NODES = [2, 10, 50]
+DEFAULT_NETWORKS = [2, 4]
+DEFAULT_PACKET_MEANS = [75.0]
+DEFAULT_STEPS = [50]
+DEFAULT_SEEDED = [True, False]
+
+# each repeat of a hot function benchmark runs for at least this long
+MIN_SECONDS = 0.05
+
+# time steps run before timing the hot functions, so that every node has
+# learned its priors
+WARM_STEPS = 25
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+def _timeCalls(function,
+               makeCalls,
+               repeat):
+
+  # makeCalls returns the argument tuples of one pass over the inputs. It is
+  # called outside of the timing, for every pass, so that functions changing
+  # their arguments start from the same state every time.
+  calls = makeCalls()
+  start = time.perf_counter()
+  for arguments in calls:
+    function(*arguments)
+  passSeconds = max(time.perf_counter() - start, 1e-9)
+  loops = max(1, min(10000, int(MIN_SECONDS / passSeconds)))
+
+  times = []
+  for repetition in range(repeat):
+    passes = [makeCalls() for loop in range(loops)]
+    start = time.perf_counter()
+    for calls in passes:
+      for arguments in calls:
+        function(*arguments)
+    times.append((time.perf_counter() - start) / (loops * len(calls)))
+
+  return {'seconds': min(times),
+          'median': float(np.median(times)),
+          'calls': loops * len(calls)}
+
+
+
+def _warmState(config,
+               seed):
+
+  # the nodes after WARM_STEPS time steps, and one more step of traffic and
+  # network responses for them
+  nodes, networks = ParseFile.parseConfig(config, seed=seed)
+
+  # the fast update leaves the updated nodes in nodes
+  Simulation.executeSimulation(WARM_STEPS, nodes, networks, None,
+                               nodeUpdate='fast')
+
+  allTraffic = [SourceNode.getTraffic(node) for node in nodes]
+  networkTraffic = Simulation._transposeList(allTraffic)
+  networkResponses = [Network.generateNetworkResponse(network, traffic)[0]
+                      for network, traffic in zip(networks, networkTraffic)]
+
+  return (nodes,
+          networks,
+          allTraffic,
+          networkTraffic,
+          Simulation._transposeList(networkResponses))
+
+
+
+def _benchmarkHotFunctions(config,
+                           seed,
+                           repeat):
+
+  nodes, networks, allTraffic, networkTraffic, allResponses = \
+      _warmState(config, seed)
+
+  benchmarks = {}
+
+  getTrafficCalls = [(node,) for node in nodes]
+  benchmarks['getTraffic'] = \
+      _timeCalls(SourceNode.getTraffic, lambda: getTrafficCalls, repeat)
+
+  testMetricCalls = [(traffic, network[Network.PARAMS])
+                     for network, traffic in zip(networks, networkTraffic)]
+  benchmarks['testMetric'] = \
+      _timeCalls(Metrics.testMetric, lambda: testMetricCalls, repeat)
+
+  returnTrafficCalls = [(traffic,
+                         network[Network.PARAMS]['capacity'][0],
+                         min(network[Network.PARAMS]['reliability'][0], 1))
+                        for network, traffic in zip(networks, networkTraffic)]
+  benchmarks['_returnTraffic'] = \
+      _timeCalls(Metrics._returnTraffic, lambda: returnTrafficCalls, repeat)
+
+  finalNodes = [(nodeNum, node) for nodeNum, node in enumerate(nodes)
+                if node[SourceNode.STRATEGY] == 'final']
+
+  def updateInfoCalls():
+    calls = []
+    for nodeNum, node in finalNodes:
+      strategyInfo = deepcopy(node[SourceNode.STRATEGY_INFO])
+      for call in range(strategyInfo['keep_packets']):
+        calls.append((strategyInfo,
+                      allTraffic[nodeNum],
+                      allResponses[nodeNum],
+                      node[SourceNode.WEIGHTS],
+                      node[SourceNode.DISTRIBUTION_PARAMETERS]))
+    return calls
+
+  learnPriorCalls = []
+  solveOptCalls = []
+  for nodeNum, node in finalNodes:
+    strategyInfo = node[SourceNode.STRATEGY_INFO]
+    mu, std = node[SourceNode.DISTRIBUTION_PARAMETERS]
+    for packetRecord in strategyInfo['packet_record']:
+      learnPriorCalls.append((packetRecord.tolist(), mu, std))
+    capacityMeans, capacityStdDevs, coefficients = \
+        Strategies._optimizationInputs(strategyInfo[Strategies.PRIOR_VALUES],
+                                       node[SourceNode.WEIGHTS])
+    solveOptCalls.append((capacityMeans.tolist(),
+                          capacityStdDevs.tolist(),
+                          coefficients.tolist(),
+                          mu + std))
+
+  if len(finalNodes) > 0:
+    benchmarks['final_update_info'] = \
+        _timeCalls(Strategies.final_update_info, updateInfoCalls, repeat)
+    benchmarks['learn_prior'] = \
+        _timeCalls(learn_capacity_reliability.learn_prior,
+                   lambda: learnPriorCalls, repeat)
+    benchmarks['solve_opt'] = \
+        _timeCalls(optimize.solve_opt, lambda: solveOptCalls, repeat)
+
+  benchmarks.update(_benchmarkBatchFunctions(nodes,
+                                             finalNodes,
+                                             allTraffic,
+                                             allResponses,
+                                             solveOptCalls,
+                                             seed,
+                                             repeat))
+
+  return benchmarks
+
+
+
+def _benchmarkBatchFunctions(nodes,
+                             finalNodes,
+                             allTraffic,
+                             allResponses,
+                             solveOptCalls,
+                             seed,
+                             repeat):
+
+  # the inputs of the single node benchmarks, stacked as the numpy engine
+  # stacks them
+  benchmarks = {}
+
+  rng = np.random.default_rng(seed)
+  loadBalances = np.array([node[SourceNode.CURRENT_LOAD_BALANCE]
+                           for node in nodes], dtype=float)
+  numPackets = np.array([sum(traffic) for traffic in allTraffic], dtype=np.int64)
+  getTrafficCalls = [(loadBalances, numPackets, rng)]
+  benchmarks['getTrafficBatch'] = \
+      _timeCalls(SourceNode.getTrafficBatch, lambda: getTrafficCalls, repeat)
+
+  if len(finalNodes) == 0:
+    return benchmarks
+
+  nodeNums = [nodeNum for nodeNum, node in finalNodes]
+  finalTraffic = np.array([allTraffic[nodeNum] for nodeNum in nodeNums],
+                          dtype=np.int64)
+  responseArrays = {name: np.array([[response[name]
+                                     for response in allResponses[nodeNum]]
+                                    for nodeNum in nodeNums], dtype=float)
+                    for name in allResponses[nodeNums[0]][0]}
+  weights = {name: np.array([node[SourceNode.WEIGHTS][name]
+                             for nodeNum, node in finalNodes], dtype=float)
+             for name in finalNodes[0][1][SourceNode.WEIGHTS]}
+  parameters = np.array([node[SourceNode.DISTRIBUTION_PARAMETERS]
+                         for nodeNum, node in finalNodes], dtype=float)
+  stackedInfo = Strategies.final_stack_info([node[SourceNode.STRATEGY_INFO]
+                                             for nodeNum, node in finalNodes])
+
+  def updateInfoBatchCalls():
+    info = deepcopy(stackedInfo)
+    return [(info, finalTraffic, responseArrays, weights, parameters)
+            for call in range(stackedInfo['keep_packets'])]
+
+  benchmarks['final_update_info_batch'] = \
+      _timeCalls(Strategies.final_update_info_batch, updateInfoBatchCalls, repeat)
+
+  solveOptBatchCalls = [tuple(np.array([call[argument] for call in solveOptCalls])
+                              for argument in range(4))]
+  benchmarks['solve_opt_batch'] = \
+      _timeCalls(optimize.solve_opt_batch, lambda: solveOptBatchCalls, repeat)
+
+  return benchmarks
+
+
+
+def _benchmarkSimulation(config,
+                         seed,
+                         seeded,
+                         engine,
+                         timeSteps,
+                         repeat,
+                         outFile):
+
+  # unseeded runs draw from the global random state and the numpy engine's
+  # Generator, both seeded here so that every run is the same
+  times = []
+  for repetition in range(repeat):
+    if seeded:
+      nodes, networks = ParseFile.parseConfig(config, seed=seed)
+      engineOptions = {}
+    else:
+      random.seed(seed)
+      np.random.seed(seed)
+      nodes, networks = ParseFile.parseConfig(config)
+      engineOptions = {'rng': np.random.default_rng(seed)} \
+                      if engine == 'numpy' else {}
+    start = time.perf_counter()
+    ENGINES[engine](timeSteps, nodes, networks, outFile, nodeUpdate='fast',
+                    **engineOptions)
+    times.append(time.perf_counter() - start)
+
+  return {'seconds': min(times),
+          'median': float(np.median(times)),
+          'calls': 1}
+
+
+
+def _resultKey(result):
+
+  return result['benchmark'], json.dumps(result['parameters'], sort_keys=True)
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def generateConfig(numNodes,
+                   numNetworks,
+                   packetMean=75,
+                   packetStd=None,
+                   strategy='final',
+                   seed=0):
+  """
+    Returns a synthetic configuration, in the form returned by
+    ParseFile.readConfig, with numNodes nodes sending gaussian traffic and
+    numNetworks networks using testMetric.
+
+    Input:
+
+      packetStd:
+        The standard deviation of the nodes' packets per time step, by
+        default a fifteenth of packetMean (as in example.conf)
+
+      seed:
+        Seeds the draws of the network parameters. The networks share the
+        nodes' total traffic, with capacities from 80% to 140% of their
+        share, so that some of them are congested.
+  """
+
+  if packetStd is None:
+    packetStd = packetMean / 15
+
+  rng = np.random.default_rng(seed)
+
+  config = {'parameters': {'netParameters': "['capacity', 'reliability', 'cost', 'speed']",
+                           'nodeParameters': "['cost', 'speed']"}}
+
+  for nodeNum in range(1, numNodes + 1):
+    config['node_{}'.format(nodeNum)] = \
+        {'strategy': strategy,
+         'parameters': '{} {}'.format(packetMean, packetStd),
+         'weights': '[1, 1, 1]'}
+
+  share = numNodes * packetMean / numNetworks
+  for netNum in range(1, numNetworks + 1):
+    capacity = round(share * float(rng.uniform(0.8, 1.4)), 1)
+    parameters = [(capacity, round(capacity * 0.13, 1)),
+                  (round(float(rng.uniform(0.85, 0.97)), 2), 0.0)]
+    # cost and speed
+    for metric in range(2):
+      parameters.append((round(float(rng.uniform(1, 3)), 2),
+                         round(float(rng.uniform(0.01, 0.07)), 2)))
+    config['network_{}'.format(netNum)] = {'metricParameters': str(parameters),
+                                           'metrics': 'testMetric'}
+
+  return config
+
+
+
+def writeConfig(config,
+                fileName):
+  """
+    Writes a configuration (as returned by generateConfig or
+    ParseFile.readConfig) to a configuration file.
+  """
+
+  configFile = configparser.ConfigParser()
+  # keep the option names as they are
+  configFile.optionxform = str
+  configFile.read_dict(config)
+
+  with open(fileName, 'w') as f:
+    configFile.write(f)
+
+
+
+def runBenchmarks(nodes=DEFAULT_NODES,
+                  networks=DEFAULT_NETWORKS,
+                  packetMeans=DEFAULT_PACKET_MEANS,
+                  steps=DEFAULT_STEPS,
+                  engines=sorted(ENGINES),
+                  repeat=3,
+                  seed=0,
+                  seeded=DEFAULT_SEEDED):
+  """
+    Runs the benchmarks over the grid of numbers of nodes and networks,
+    packet means and (for executeSimulation) numbers of time steps, engines
+    and seeded or unseeded runs, and returns a list of results.
+
+    Output:
+
+      A list of dictionaries, each with:
+        'benchmark': the benchmark name, e.g. 'solve_opt' or
+          'executeSimulation'
+        'parameters': a dictionary of the grid point ('nodes', 'networks',
+          'packet_mean', and 'steps', 'engine' and 'seeded' for
+          executeSimulation)
+        'seconds': the minimum time of a call over the repeats
+        'median': the median time of a call over the repeats
+        'calls': the number of calls timed in every repeat
+  """
+
+  results = []
+
+  with tempfile.TemporaryDirectory() as directory:
+    outFile = os.path.join(directory, 'benchmark.out')
+
+    for numNodes in nodes:
+      for numNetworks in networks:
+        for packetMean in packetMeans:
+          config = generateConfig(numNodes, numNetworks, packetMean, seed=seed)
+          parameters = {'nodes': numNodes,
+                        'networks': numNetworks,
+                        'packet_mean': packetMean}
+
+          for benchmark, timing in \
+              _benchmarkHotFunctions(config, seed, repeat).items():
+            results.append(dict(benchmark=benchmark,
+                                parameters=parameters,
+                                **timing))
+
+          for timeSteps in steps:
+            for engine in engines:
+              for seededRun in seeded:
+                timing = _benchmarkSimulation(config, seed, seededRun, engine,
+                                              timeSteps, repeat, outFile)
+                results.append(dict(benchmark='executeSimulation',
+                                    parameters=dict(parameters,
+                                                    steps=timeSteps,
+                                                    engine=engine,
+                                                    seeded=seededRun),
+                                    **timing))
+
+  return results
+
+
+
+def saveResults(results,
+                fileName):
+  """
+    Saves benchmark results as JSON, along with the versions of Python,
+    NumPy and the simulator code they were measured with.
+  """
+
+  with open(fileName, 'w') as f:
+    json.dump({'machine': {'python': platform.python_version(),
+                           'numpy': np.__version__,
+                           'platform': platform.platform(),
+                           'processor': platform.processor()},
+               'code': ResultCache.codeVersion(),
+               'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'results': results},
+              f, indent=1)
+
+
+
+def loadResults(fileName):
+  """
+    Returns the results saved by saveResults.
+  """
+
+  with open(fileName) as f:
+    return json.load(f)['results']
+
+
+
+def compareResults(baseline,
+                   results,
+                   threshold=0.2):
+  """
+    Compares results with baseline results, matching them by benchmark and
+    parameters. Returns a list of (result, baseline seconds, ratio of the
+    result's time to the baseline's, whether it is a regression) for every
+    result with a baseline, where a regression is a ratio above
+    1 + threshold.
+  """
+
+  baselineSeconds = {_resultKey(result): result['seconds'] for result in baseline}
+
+  comparison = []
+  for result in results:
+    key = _resultKey(result)
+    if key in baselineSeconds:
+      ratio = result['seconds'] / baselineSeconds[key]
+      comparison.append((result, baselineSeconds[key], ratio, ratio > 1 + threshold))
+
+  return comparison
+
+
+
+def formatResult(result):
+  """
+    Returns a one line description of a result's benchmark and parameters.
+  """
+
+  return '{} {}'.format(result['benchmark'],
+                        ' '.join('{}={}'.format(name, value)
+                                 for name, value in result['parameters'].items()))
+
+###############################################################################
+###############################################################################
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Time the simulation and its hot functions on synthetic '
+                  'configurations, and save the timings as JSON')
+  parser.add_argument('outFile')
+  parser.add_argument('--nodes', type=int, nargs='+', default=DEFAULT_NODES)
+  parser.add_argument('--networks', type=int, nargs='+', default=DEFAULT_NETWORKS)
+  parser.add_argument('--packet-means', type=float, nargs='+',
+                      default=DEFAULT_PACKET_MEANS)
+  parser.add_argument('--steps', type=int, nargs='+', default=DEFAULT_STEPS)
+  parser.add_argument('--engines', choices=sorted(ENGINES), nargs='+',
+                      default=sorted(ENGINES))
+  parser.add_argument('--seeded', choices=['yes', 'no'], nargs='+',
+                      default=['yes', 'no'],
+                      help='run executeSimulation seeded, unseeded or both '
+                           '(default: both)')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--compare', default=None, metavar='BASELINE',
+                      help='compare with the results saved in BASELINE')
+  parser.add_argument('--threshold', type=float, default=0.2,
+                      help='slowdown over the baseline counted as a '
+                           'regression (default: 0.2, 20%%)')
+  args = parser.parse_args()
+
+  results = runBenchmarks(args.nodes,
+                          args.networks,
+                          args.packet_means,
+                          args.steps,
+                          args.engines,
+                          args.repeat,
+                          args.seed,
+                          [answer == 'yes' for answer in args.seeded])
+  saveResults(results, args.outFile)
+
+  if args.compare is None:
+    for result in results:
+      print('{:>12.6f} ms  {}'.format(result['seconds'] * 1000,
+                                       formatResult(result)))
+  else:
+    comparison = compareResults(loadResults(args.compare),
+                                results,
+                                args.threshold)
+    for result, baselineSeconds, ratio, regression in comparison:
+      print('{:>12.6f} ms {:>12.6f} ms {:>7.2f}x {} {}'.format(
+          baselineSeconds * 1000,
+          result['seconds'] * 1000,
+          ratio,
+          'REGRESSION' if regression else '          ',
+          formatResult(result)))
+    if any(regression for result, baselineSeconds, ratio, regression in comparison):
+      sys.exit(1)
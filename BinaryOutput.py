@@ -0,0 +1,297 @@
+import os
+import json
+import numpy as np
+import Network
+import SourceNode
+
+# A binary output format for simulation results, as an alternative to the
+# text format written by Simulation._formatStep.
+#
+# The output is a directory holding one NumPy .npy file per column, each an
+# array indexed by time step first:
+#
+#   traffic.npy             int64   (timeSteps, numNodes, numNetworks)
+#   traffic_response.npy    int64   (timeSteps, numNodes, numNetworks)
+#   load_balance.npy        float64 (timeSteps, numNodes, numNetworks)
+#   network_parameters.npy  float64 (timeSteps, numNetworks, numParameters)
+#
+# and a meta.json file with the node, network and network parameter names,
+# and the number of time steps written so far. Strategy information and
+# weights are not written.
+#
+# The writer keeps up to chunkSteps time steps in memory and appends them to
+# the column files together. Every time it does, it rewrites the header of
+# each .npy file with the number of time steps written so far, so the files
+# of a run that stopped early load with np.load as just the time steps it
+# ran. The header is padded to the length it had for the full run, so the
+# data never moves. readOutput memory maps the columns, so that any
+# node, network or range of time steps is read as a view on the file, without
+# loading or copying the rest. The files of an unfinished run can be read
+# too, up to the last time step written.
+
+TRAFFIC = 'traffic'
+RESPONSE = 'traffic_response'
+LOAD_BALANCE = 'load_balance'
+NETWORK_PARAMETERS = 'network_parameters'
+
+COLUMN_TYPES = {TRAFFIC: np.dtype('<i8'),
+                RESPONSE: np.dtype('<i8'),
+                LOAD_BALANCE: np.dtype('<f8'),
+                NETWORK_PARAMETERS: np.dtype('<f8')}
+
+META_FILE = 'meta.json'
+
+DEFAULT_CHUNK_STEPS = 1000
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+def _columnPath(directory,
+                column):
+
+  return os.path.join(directory, column + '.npy')
+
+
+
+def _writeMeta(output):
+
+  # written next to meta.json and moved in place, so that readers never see
+  # a partial file
+  metaPath = os.path.join(output['directory'], META_FILE)
+  with open(metaPath + '.tmp', 'w') as f:
+    json.dump(output['meta'], f)
+  os.replace(metaPath + '.tmp', metaPath)
+
+
+
+def _writeHeader(f,
+                 column,
+                 shape,
+                 headerLength):
+
+  # a version 1.0 .npy header of exactly headerLength bytes, for the array
+  # at the start of f
+  header = repr({'descr': COLUMN_TYPES[column].str,
+                 'fortran_order': False,
+                 'shape': tuple(shape)})
+  header = header.ljust(headerLength - 1).encode('latin1') + b'\n'
+
+  position = f.tell()
+  f.seek(0)
+  f.write(np.lib.format.magic(1, 0))
+  f.write(np.uint16(headerLength).astype('<u2').tobytes())
+  f.write(header)
+  f.seek(position)
+
+
+
+def _parameterValues(selectedParams,
+                     parameterNames):
+
+  return [[params.get(name, np.nan) for name in parameterNames]
+          for params in selectedParams]
+
+
+
+def _flush(output):
+
+  if len(output['buffer'][TRAFFIC]) == 0:
+    return
+
+  for column, f in output['files'].items():
+    rows = np.array(output['buffer'][column], dtype=COLUMN_TYPES[column])
+    f.write(rows.tobytes())
+    output['buffer'][column] = []
+
+  output['meta']['steps'] += len(rows)
+  for column, f in output['files'].items():
+    _writeHeader(f,
+                 column,
+                 (output['meta']['steps'],) + output['shapes'][column][1:],
+                 output['header_length'])
+    f.flush()
+  _writeMeta(output)
+
+
+
+def _openColumn(path,
+                steps):
+
+  # a view of the first steps time steps of the .npy file at path
+  with open(path, 'rb') as f:
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+      shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+      shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(f)
+    offset = f.tell()
+
+  if steps == 0:
+    return np.zeros((0,) + shape[1:], dtype=dtype)
+
+  return np.memmap(path,
+                   dtype=dtype,
+                   mode='r',
+                   offset=offset,
+                   shape=(steps,) + shape[1:])
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def openOutput(directory,
+               timeSteps,
+               nodes,
+               networks,
+               chunkSteps=DEFAULT_CHUNK_STEPS):
+  """
+    Creates (or empties) the output directory for a run of timeSteps time
+    steps of the given nodes and networks, and returns the output to pass to
+    writeStep and closeOutput.
+  """
+
+  os.makedirs(directory, exist_ok=True)
+
+  parameterNames = list(networks[0][Network.PARAMS]) if len(networks) > 0 else []
+
+  shapes = {TRAFFIC: (timeSteps, len(nodes), len(networks)),
+            RESPONSE: (timeSteps, len(nodes), len(networks)),
+            LOAD_BALANCE: (timeSteps, len(nodes), len(networks)),
+            NETWORK_PARAMETERS: (timeSteps, len(networks), len(parameterNames))}
+
+  # every header is given room for the longest shape of any column, and
+  # written with the steps written so far
+  headerLength = max(len(repr({'descr': COLUMN_TYPES[column].str,
+                               'fortran_order': False,
+                               'shape': shape}))
+                     for column, shape in shapes.items()) + 1
+  headerLength += -(10 + headerLength) % 64
+
+  files = {}
+  for column, shape in shapes.items():
+    f = open(_columnPath(directory, column), 'wb')
+    _writeHeader(f, column, (0,) + shape[1:], headerLength)
+    f.seek(0, os.SEEK_END)
+    files[column] = f
+
+  output = {'directory': directory,
+            'chunk_steps': chunkSteps,
+            'files': files,
+            'shapes': shapes,
+            'header_length': headerLength,
+            'buffer': {column: [] for column in files},
+            'meta': {'nodes': [node[SourceNode.NAME] for node in nodes],
+                     'networks': [network[Network.NAME] for network in networks],
+                     'parameters': parameterNames,
+                     'steps': 0}}
+  _writeMeta(output)
+
+  return output
+
+
+
+def writeStep(output,
+              allTraffic,
+              trafficResponses,
+              loadBalances,
+              selectedParams):
+  """
+    Adds a time step to the output. allTraffic, trafficResponses and
+    loadBalances are (nodes x networks) nested lists or arrays, and
+    selectedParams holds the parameters chosen for every network.
+  """
+
+  # copied, as the engines may change their arrays in place
+  values = {TRAFFIC: allTraffic,
+            RESPONSE: trafficResponses,
+            LOAD_BALANCE: loadBalances,
+            NETWORK_PARAMETERS: _parameterValues(selectedParams,
+                                                 output['meta']['parameters'])}
+  for column, value in values.items():
+    output['buffer'][column].append(np.array(value, dtype=COLUMN_TYPES[column]))
+
+  if len(output['buffer'][TRAFFIC]) >= output['chunk_steps']:
+    _flush(output)
+
+
+
+def closeOutput(output):
+  """
+    Writes the buffered time steps and closes the output files.
+  """
+
+  _flush(output)
+  for f in output['files'].values():
+    f.close()
+
+
+
+def readOutput(directory):
+  """
+    Memory maps the output written to directory.
+
+    Output:
+
+      A dictionary with:
+        'nodes', 'networks', 'parameters': the node, network and network
+          parameter names
+        'steps': the number of time steps written
+        'traffic', 'traffic_response', 'load_balance': read only arrays
+          (steps, numberOfNodes, numberOfNetworks) mapped from the files
+        'network_parameters': a read only array
+          (steps, numberOfNetworks, numberOfParameters) mapped from the file
+  """
+
+  with open(os.path.join(directory, META_FILE)) as f:
+    output = json.load(f)
+
+  for column in COLUMN_TYPES:
+    output[column] = _openColumn(_columnPath(directory, column), output['steps'])
+
+  return output
+
+
+
+def nodeValues(output,
+               column,
+               nodeName):
+  """
+    Returns a view of a node column ('traffic', 'traffic_response' or
+    'load_balance') of output (from readOutput) for one node, indexed by
+    [timeStep, network].
+  """
+
+  return output[column][:, output['nodes'].index(nodeName), :]
+
+
+
+def networkValues(output,
+                  column,
+                  networkName):
+  """
+    Returns a view of a column of output (from readOutput) for one network:
+    indexed by [timeStep, node] for node columns, and by
+    [timeStep, parameter] for 'network_parameters'.
+  """
+
+  netNum = output['networks'].index(networkName)
+
+  if column == NETWORK_PARAMETERS:
+    return output[column][:, netNum, :]
+  return output[column][:, :, netNum]
+
+###############################################################################
+###############################################################################
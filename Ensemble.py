@@ -0,0 +1,346 @@
+import random
+import argparse
+import multiprocessing
+import numpy as np
+import ParseFile
+import Network
+import ResultCache
+import SourceNode
+import Simulation
+import VectorSimulation
+
+# Runs many replications of a configuration and summarizes them.
+#
+# Every replication runs in a worker process from a fresh parse of the
+# configuration, with its own seed. The seeds are spawned from one
+# master seed with numpy's SeedSequence, so replication r always gets the
+# same seed, whatever the number of processes or the order they finish in.
+# The replication's seed gives every node and network its own generator
+# (ParseFile.parseInput), and also seeds the global random and numpy.random
+# state and the numpy engine's Generator, for anything that has no generator
+# of its own. Seeded, the two engines make the same draws, so a python and a
+# numpy ensemble with the same seed give the same results.
+#
+# The traffic response and load balance of every node on every network are
+# recorded at every time step, from the arrays both engines pass to their
+# step callback, and summarized across replications as arrays
+# indexed by [timeStep, node, network]. The mean and standard deviation are
+# updated as each replication finishes, in replication order, so only one
+# replication's arrays are held at a time. Quantiles need every
+# replication's arrays, and so are only computed, and the arrays kept, when
+# they are asked for.
+
+ENGINES = {'python': Simulation.executeSimulation,
+           'numpy': VectorSimulation.executeSimulation}
+
+RECORDED = ['traffic_response', 'load_balance']
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+def _seedReplication(seedSequence):
+
+  # children 0 and 1 of the sequence are used by ParseFile.parseInput, 2 seeds
+  # random and numpy.random and 3 the engine's Generator
+  globalSequence, engineSequence = \
+      [np.random.SeedSequence(seedSequence.entropy,
+                              spawn_key=seedSequence.spawn_key + (childNum,),
+                              pool_size=seedSequence.pool_size)
+       for childNum in (2, 3)]
+
+  randomSeed, numpySeed = globalSequence.generate_state(2)
+  random.seed(int(randomSeed))
+  np.random.seed(int(numpySeed))
+
+  return np.random.default_rng(engineSequence)
+
+
+
+def _runReplication(replication):
+
+  configNum, replicationNum, seedSequence, timeSteps, config, engine, nodeUpdate = \
+      replication
+
+  rng = _seedReplication(seedSequence)
+  nodes, networks = ParseFile.parseConfig(config, seed=seedSequence)
+
+  recorded = {name: np.zeros((timeSteps, len(nodes), len(networks)),
+                             dtype=np.float32)
+              for name in RECORDED}
+
+  def recordStep(timeStep, loadBalances, allTraffic, trafficResponses):
+    recorded['traffic_response'][timeStep] = trafficResponses
+    recorded['load_balance'][timeStep] = loadBalances
+
+  # the python engine has no generator of its own
+  engineOptions = {'rng': rng} if engine == 'numpy' else {}
+
+  ENGINES[engine](timeSteps, nodes, networks, None,
+                  nodeUpdate=nodeUpdate,
+                  stepCallback=recordStep,
+                  **engineOptions)
+
+  return configNum, replicationNum, recorded
+
+
+
+def _newMoments(replications,
+                shape,
+                quantiles):
+
+  # 'values' is indexed by [replication, timeStep, node, network]
+  return {'count': 0,
+          'mean': np.zeros(shape),
+          'm2': np.zeros(shape),
+          'values': np.zeros((replications,) + shape, dtype=np.float32)
+                    if len(quantiles) > 0 else None}
+
+
+
+def _addReplication(moments,
+                    replicationNum,
+                    recorded):
+
+  # Welford's update of the mean and the sum of squared deviations
+  moments['count'] += 1
+  delta = recorded - moments['mean']
+  moments['mean'] += delta / moments['count']
+  moments['m2'] += delta * (recorded - moments['mean'])
+
+  if moments['values'] is not None:
+    moments['values'][replicationNum] = recorded
+
+
+
+def _summarize(moments,
+               quantiles):
+
+  summary = {'mean': moments['mean'],
+             'std': np.sqrt(moments['m2'] / max(moments['count'], 1))}
+  if len(quantiles) > 0:
+    for q, quantile in zip(quantiles,
+                           np.quantile(moments['values'], quantiles, axis=0)):
+      summary['q{}'.format(q)] = quantile
+
+  return summary
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def runEnsembles(timeSteps,
+                 configs,
+                 replications,
+                 seed=None,
+                 processes=None,
+                 engine='numpy',
+                 nodeUpdate='fast',
+                 quantiles=(),
+                 cacheDirectory=None,
+                 cacheBytes=ResultCache.DEFAULT_MAX_BYTES):
+  """
+    Runs replications of each configuration in configs, all in one process
+    pool, and returns a list with the result of runEnsemble for each.
+    configs holds configurations in the form returned by
+    ParseFile.readConfig. Every configuration gets the same replication
+    seeds, so differences between them are not down to different random
+    draws.
+
+    With a seed and a cacheDirectory, results are looked up in and added to
+    the ResultCache there (holding at most cacheBytes), and only the
+    configurations without a cached result are run.
+  """
+
+  seedSequence = np.random.SeedSequence(seed)
+  replicationSequences = seedSequence.spawn(replications)
+
+  results = [None] * len(configs)
+  cacheKeys = [None] * len(configs)
+  if cacheDirectory is not None and seed is not None:
+    for configNum, config in enumerate(configs):
+      cacheKeys[configNum] = \
+          ResultCache.runKey(config,
+                             timeSteps=timeSteps,
+                             replications=replications,
+                             seed=seedSequence.entropy,
+                             engine=engine,
+                             nodeUpdate=nodeUpdate,
+                             quantiles=list(quantiles))
+      results[configNum] = ResultCache.fetchResult(cacheKeys[configNum],
+                                                   cacheDirectory)
+
+  values = {}
+  for configNum, config in enumerate(configs):
+    if results[configNum] is None:
+      nodes, networks = ParseFile.parseConfig(config)
+      results[configNum] = \
+          {'seed': seedSequence.entropy,
+           'replications': replications,
+           'nodes': [node[SourceNode.NAME] for node in nodes],
+           'networks': [network[Network.NAME] for network in networks]}
+      values[configNum] = \
+          {name: _newMoments(replications,
+                             (timeSteps, len(nodes), len(networks)),
+                             quantiles)
+           for name in RECORDED}
+
+  work = [(configNum, replicationNum, replicationSequence, timeSteps,
+           configs[configNum], engine, nodeUpdate)
+          for configNum in values
+          for replicationNum, replicationSequence in enumerate(replicationSequences)]
+
+  # in order, so that the running mean and standard deviation add up the
+  # replications in the same order in every run
+  if len(work) > 0:
+    with multiprocessing.Pool(processes) as pool:
+      for configNum, replicationNum, recorded in pool.imap(_runReplication, work):
+        for name in RECORDED:
+          _addReplication(values[configNum][name], replicationNum, recorded[name])
+
+  for configNum, configValues in values.items():
+    for name in RECORDED:
+      results[configNum][name] = _summarize(configValues[name], quantiles)
+    if cacheKeys[configNum] is not None:
+      ResultCache.storeResult(cacheKeys[configNum],
+                              results[configNum],
+                              cacheDirectory,
+                              cacheBytes)
+
+  return results
+
+
+
+def runEnsemble(timeSteps,
+                configFile,
+                replications,
+                seed=None,
+                processes=None,
+                engine='numpy',
+                nodeUpdate='fast',
+                quantiles=(),
+                cacheDirectory=None,
+                cacheBytes=ResultCache.DEFAULT_MAX_BYTES):
+  """
+    Runs replications of the simulation in configFile across a process pool
+    and returns the per time step statistics across replications.
+
+    Input:
+
+      seed:
+        The master seed (an integer), or None for a fresh one. The seed that
+        was used is returned, so that any run can be repeated.
+
+      processes:
+        The number of worker processes, defaults to the number of CPUs
+
+      engine:
+        'numpy' (VectorSimulation) or 'python' (Simulation). Both give the
+        same results for the same seed.
+
+      nodeUpdate:
+        Passed to the engine. Every replication parses its own nodes, so
+        updating them in place is safe.
+
+      quantiles:
+        The quantiles to compute across replications, e.g. (0.05, 0.5, 0.95).
+        Computing them keeps every replication's arrays in memory until the
+        end, so none are computed by default.
+
+      cacheDirectory, cacheBytes:
+        A ResultCache directory and size limit, see runEnsembles
+
+    Output:
+
+      A dictionary with:
+        'seed': the master seed
+        'replications': the number of replications
+        'nodes', 'networks': the node and network names
+        'traffic_response', 'load_balance': dictionaries mapping 'mean',
+          'std' and 'q<quantile>' for every quantile (e.g. 'q0.5') to float
+          arrays
+          (timeSteps, numberOfNodes, numberOfNetworks)
+  """
+
+  return runEnsembles(timeSteps,
+                      [ParseFile.readConfig(configFile)],
+                      replications,
+                      seed=seed,
+                      processes=processes,
+                      engine=engine,
+                      nodeUpdate=nodeUpdate,
+                      quantiles=quantiles,
+                      cacheDirectory=cacheDirectory,
+                      cacheBytes=cacheBytes)[0]
+
+
+
+def saveEnsemble(result,
+                 outFile):
+  """
+    Saves the result of runEnsemble to a NumPy .npz file, with the arrays
+    under names such as 'traffic_response-mean' and 'load_balance-q0.5'.
+  """
+
+  arrays = {'seed': np.array(str(result['seed'])),
+            'replications': np.array(result['replications']),
+            'nodes': np.array(result['nodes']),
+            'networks': np.array(result['networks'])}
+  for name in RECORDED:
+    for statistic in result[name]:
+      arrays['{}-{}'.format(name, statistic)] = result[name][statistic]
+
+  np.savez(outFile, **arrays)
+
+###############################################################################
+###############################################################################
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Run replications of a simulation and save per time step '
+                  'statistics across them to a .npz file')
+  parser.add_argument('timeSteps', type=int)
+  parser.add_argument('configFile')
+  parser.add_argument('outFile')
+  parser.add_argument('--replications', type=int, default=100)
+  parser.add_argument('--seed', type=int, default=None,
+                      help='master seed (default: a fresh one, printed)')
+  parser.add_argument('--processes', type=int, default=None,
+                      help='worker processes (default: number of CPUs)')
+  parser.add_argument('--engine', choices=sorted(ENGINES), default='numpy')
+  parser.add_argument('--quantiles', type=float, nargs='+', default=[],
+                      help='also save these quantiles across replications, '
+                           'which keeps every replication in memory '
+                           '(default: none)')
+  parser.add_argument('--cache-dir', default=None,
+                      help='reuse results of seeded runs stored in this '
+                           'directory (default: no cache)')
+  parser.add_argument('--cache-size', type=int, default=1024, metavar='MB',
+                      help='size limit of the cache (default: 1024)')
+  args = parser.parse_args()
+
+  result = runEnsemble(args.timeSteps,
+                       args.configFile,
+                       args.replications,
+                       seed=args.seed,
+                       processes=args.processes,
+                       engine=args.engine,
+                       quantiles=args.quantiles,
+                       cacheDirectory=args.cache_dir,
+                       cacheBytes=args.cache_size * 2**20)
+  saveEnsemble(result, args.outFile)
+  print('seed: {}'.format(result['seed']))
@@ -1,5 +1,7 @@
 import math
 import random
+import numpy as np
+import Profile
 from copy import deepcopy
 
 
@@ -40,6 +42,11 @@ from copy import deepcopy
 # Metrics functions may use the internal function _returnTraffic to generate
 # the returned packets, rather than implementing a specific return function
 # to calculate this.
+#
+# A network may own a numpy Generator (see ParseFile.parseInput). Its metric
+# function is then called with the extra keyword argument rng, and should take
+# all of its random draws from it, so that the network's responses do not
+# depend on anything else drawn in the simulation.
 
 
 
@@ -73,10 +80,68 @@ def _compressRepeatedPacketList(repeatedPacketList,
 
 
 
+def _survivingPackets_sample(trafficRecieved,
+                             carriedThrough,
+                             rng=None):
+  
+  if rng is None:
+    survivors = random.sample(_repeatedPacketList(trafficRecieved),
+                              carriedThrough)
+  else:
+    survivors = rng.choice(_repeatedPacketList(trafficRecieved),
+                           carriedThrough,
+                           replace=False).tolist()
+  
+  return _compressRepeatedPacketList(survivors,
+                                     len(trafficRecieved))
+
+
+
+def _survivingPackets_hypergeometric(trafficRecieved,
+                                     carriedThrough,
+                                     rng=None):
+  # Sampling packets without replacement and counting them per node is a
+  # multivariate hypergeometric draw. It is taken one node at a time: given
+  # what the previous nodes got, a node's count is a univariate
+  # hypergeometric draw between its packets and those of the nodes left.
+  # A Generator does the same in one call, which is also the call the
+  # vectorized engine makes, so both draw the same packets.
+  if rng is not None:
+    return rng.multivariate_hypergeometric(trafficRecieved,
+                                           carriedThrough,
+                                           method='marginals').tolist()
+  
+  returnedTraffic = []
+  packetsLeft = sum(trafficRecieved)
+  
+  for packets in trafficRecieved:
+    packetsLeft -= packets
+    if carriedThrough == 0 or packets == 0:
+      returned = 0
+    elif packetsLeft == 0:
+      returned = carriedThrough
+    else:
+      returned = int(np.random.hypergeometric(packets,
+                                              packetsLeft,
+                                              carriedThrough))
+    returnedTraffic.append(returned)
+    carriedThrough -= returned
+  
+  return returnedTraffic
+
+
+
+_SAMPLES = {'sample': _survivingPackets_sample,
+            'hypergeometric': _survivingPackets_hypergeometric}
+
+
+
 def _returnTraffic(trafficRecieved,
                    networkCapacity,
                    networkReliability,
-                   rounding=round):
+                   rounding=round,
+                   sampling='hypergeometric',
+                   rng=None):
   """
     Takes traffic and network information and returns traffic sent back
     
@@ -93,6 +158,14 @@ def _returnTraffic(trafficRecieved,
       networkReliability:
         A float <= 1, which represents the percentage of packets that are 
         returned in total (i.e. 0.8 means that 20% of packets are lost)
+      
+      sampling:
+        'hypergeometric' draws the returned packets of each node directly from
+        the per node counts, 'sample' picks them from a list with one entry
+        per packet. Both give the same distribution.
+      
+      rng:
+        A numpy Generator to draw from instead of the global state
   """
   
   totalPackets = sum(trafficRecieved)
@@ -110,36 +183,42 @@ def _returnTraffic(trafficRecieved,
       returnedTraffic.append(0)
     return returnedTraffic
   
-  returnedTraffic = \
-      _compressRepeatedPacketList(
-          random.sample(
-              _repeatedPacketList(trafficRecieved),
-              carriedThrough),
-      len(trafficRecieved))
-  
-  return returnedTraffic
+  return _SAMPLES[sampling](trafficRecieved,
+                            carriedThrough,
+                            rng)
 
 
 
 
 def testMetric(trafficRecieved,
-               networkParameters):
+               networkParameters,
+               rng=None):
   
   chosenParams = {}
   returnedParams = {}
   
-  for param in networkParameters:
-    paramVal = max(random.gauss(networkParameters[param][0],
-                                networkParameters[param][1]),0)
+  with Profile.phase('metric_sampling'):
+    if rng is None:
+      paramDraws = [random.gauss(networkParameters[param][0],
+                                 networkParameters[param][1])
+                    for param in networkParameters]
+    else:
+      paramDraws = rng.normal([networkParameters[param][0] for param in networkParameters],
+                              [networkParameters[param][1] for param in networkParameters]).tolist()
+  
+  for param, paramDraw in zip(networkParameters, paramDraws):
+    paramVal = max(paramDraw,0)
     chosenParams[param] = paramVal
     if param != 'capacity' or param != 'reliability':
       returnedParams[param] = paramVal
   
   chosenParams['reliability'] = min(chosenParams['reliability'], 1)
   
-  packetsReturned = _returnTraffic(trafficRecieved,
-                                   chosenParams['capacity'],
-                                   chosenParams['reliability'])
+  with Profile.phase('return_traffic'):
+    packetsReturned = _returnTraffic(trafficRecieved,
+                                     chosenParams['capacity'],
+                                     chosenParams['reliability'],
+                                     rng=rng)
   
   response = []
   for packets in packetsReturned:
@@ -3,11 +3,18 @@ import Metrics
 NAME = 'net_name'
 PARAMS = 'net_params'
 MET_FUNC = 'met_func'
+RNG = 'rng'
 
 
 def generateNetworkResponse(network,
                             traffic):
   
+  # a network with its own generator hands it to the metric function
+  if RNG in network:
+    return network[MET_FUNC](traffic,
+                             network[PARAMS],
+                             rng=network[RNG])
+  
   return network[MET_FUNC](traffic,
                            network[PARAMS])
 
@@ -15,7 +22,8 @@ def generateNetworkResponse(network,
 
 def createNetwork(netName,
                   parameters,
-                  metricsFunction):
+                  metricsFunction,
+                  rng=None):
   
   """
     Takes network parameters and returns a network object (dictionary)
@@ -31,10 +39,19 @@ def createNetwork(netName,
       
       metricsFunction:
         A string naming the function for generating the networks parameters
+      
+      rng:
+        A numpy Generator owned by the network, which all of its random
+        draws come from. Without one, the network draws from the global
+        random and numpy.random state.
         
   """
   
+  network = {NAME: netName,
+             PARAMS: parameters,
+             MET_FUNC: getattr(Metrics, metricsFunction)}
+  
+  if rng is not None:
+    network[RNG] = rng
   
-  return {NAME: netName,
-          PARAMS: parameters,
-          MET_FUNC: getattr(Metrics, metricsFunction)}
\ No newline at end of file
+  return network
\ No newline at end of file
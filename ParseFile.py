@@ -1,4 +1,5 @@
 import configparser
+import numpy as np
 import SourceNode
 import Network
 
@@ -42,12 +43,37 @@ import Network
 # (defaults to gaussian):
 #   distribution = distribution name (string naming a distribution function
 #                                     in the SourceNode file)
+#
+# Given a seed, parseInput gives every node and network its own numpy
+# Generator. Their seeds are spawned from the seed with numpy's SeedSequence:
+# child 0 for the nodes and child 1 for the networks, each with one child per
+# node or network in configuration file order. Each node and network then
+# draws the same numbers whatever order the simulation updates them in.
+
+def _streams(seedSequence,
+             childNum,
+             number):
+  
+  # generators for the children of child childNum of seedSequence. The
+  # children are built from their spawn keys rather than with spawn, which
+  # would change seedSequence.
+  if seedSequence is None:
+    return [None] * number
+  
+  return [np.random.default_rng(
+              np.random.SeedSequence(seedSequence.entropy,
+                                     spawn_key=seedSequence.spawn_key + (childNum, entityNum),
+                                     pool_size=seedSequence.pool_size))
+          for entityNum in range(number)]
+
+
 
 def _parseNodeInfo(nodes,
                    nodeName,
                    nodeInfo,
                    numNetworks,
-                   paramNames):
+                   paramNames,
+                   rng=None):
   
   weights = {}
   for parameter, weight in zip(paramNames, eval(nodeInfo['weights'])):
@@ -59,7 +85,8 @@ def _parseNodeInfo(nodes,
                                   numNetworks,
                                   tuple([float(x) for x in nodeInfo['parameters'].split()]),
                                   nodeInfo['strategy'],
-                                  weights)
+                                  weights,
+                                  rng=rng)
   else:
     newNode = \
       SourceNode.createSourceNode(nodeName,
@@ -67,7 +94,8 @@ def _parseNodeInfo(nodes,
                                   tuple([float(x) for x in nodeInfo['parameters'].split()]),
                                   nodeInfo['strategy'],
                                   weights,
-                                  nodeInfo['distribution'])
+                                  nodeInfo['distribution'],
+                                  rng)
   
   nodes.append(newNode)
   
@@ -78,7 +106,8 @@ def _parseNodeInfo(nodes,
 def _parseNetworkInfo(networks,
                       netName,
                       networkInfo,
-                      paramNames):
+                      paramNames,
+                      rng=None):
   
   metricFunction = networkInfo['metrics']
   parameterValues = eval(networkInfo['metricParameters'])
@@ -89,17 +118,63 @@ def _parseNetworkInfo(networks,
   
   networks.append(Network.createNetwork(netName,
                                         parameters,
-                                        metricFunction))
+                                        metricFunction,
+                                        rng))
   
   return networks
 
 
 
-def parseInput(fileName):
+def readConfig(fileName):
+  """
+    Reads the configuration file into a dictionary mapping section names to
+    dictionaries of their (lower case) option names and string values, which
+    can be changed and passed to parseConfig.
+  """
   
   config = configparser.ConfigParser()
   config.read(fileName)
   
+  return {section: dict(config[section]) for section in config.sections()}
+
+
+
+def parseInput(fileName,
+               seed=None):
+  """
+    Reads the configuration file and returns (nodes, networks)
+    
+    Input:
+      
+      seed:
+        An integer or a numpy SeedSequence. If given, every node and network
+        gets its own numpy Generator derived from it, otherwise they draw
+        from the global random and numpy.random state.
+  """
+  
+  config = configparser.ConfigParser()
+  config.read(fileName)
+  
+  return _parseConfig(config, seed)
+
+
+
+def parseConfig(configDict,
+                seed=None):
+  """
+    Same as parseInput, for a configuration given as a dictionary of
+    sections, as returned by readConfig.
+  """
+  
+  config = configparser.ConfigParser()
+  config.read_dict(configDict)
+  
+  return _parseConfig(config, seed)
+
+
+
+def _parseConfig(config,
+                 seed):
   
   networks = []
   nodes = []
@@ -108,20 +183,26 @@ def parseInput(fileName):
   nodeParams = eval(config['parameters']['nodeParameters'])
   nodeParams.append('traffic_response')
   
-  for entry in config:
-    if 'network' in entry:
-      networks = _parseNetworkInfo(networks,
-                                   entry,
-                                   config[entry],
-                                   netParams)
-  
-  for entry in config:
-    if 'node' in entry:
-      nodes = _parseNodeInfo(nodes,
-                             entry,
-                             config[entry],
-                             len(networks),
-                             nodeParams)
+  networkEntries = [entry for entry in config if 'network' in entry]
+  nodeEntries = [entry for entry in config if 'node' in entry]
+  
+  if seed is not None and not isinstance(seed, np.random.SeedSequence):
+    seed = np.random.SeedSequence(seed)
+  
+  for entry, rng in zip(networkEntries, _streams(seed, 1, len(networkEntries))):
+    networks = _parseNetworkInfo(networks,
+                                 entry,
+                                 config[entry],
+                                 netParams,
+                                 rng)
+  
+  for entry, rng in zip(nodeEntries, _streams(seed, 0, len(nodeEntries))):
+    nodes = _parseNodeInfo(nodes,
+                           entry,
+                           config[entry],
+                           len(networks),
+                           nodeParams,
+                           rng)
   
   return (nodes, networks)
 
@@ -1,26 +1,325 @@
-import configparser
-from copy import deepcopy
+import io
+import os
+import ast
+import json
+import numpy as np
 
+# Reads the text output written by Simulation._formatStep.
+#
+# The output holds one section per time step, '[timeStep]', with a line
+# 'node-field = value' for every node and field (see NODE_FIELDS) and a line
+# 'network = value' for every network, where every value is a Python
+# literal. Like configparser, names are read in lower case.
+#
+# iterateOutput reads the file one time step at a time, and parses only the
+# values it is asked for, so that long outputs can be processed in constant
+# memory and from the first time step on. Values are parsed as literals
+# (with nan and inf allowed), never evaluated as code. Most values print as
+# JSON once their quotes are swapped, and are read with the much faster json
+# module, the rest with ast.literal_eval. Quotes are only swapped in values
+# without double quotes, where every single quote starts or ends a string.
+#
+# An index file (indexPath) holds the byte offset of every time step in the
+# output, as little endian int64 (timeStep, offset) pairs in file order. It
+# is written by executeSimulation with writeIndex, or built afterwards by
+# buildIndex, and lets readSteps and readStep seek straight to any time step.
+# An index whose last time step, or the time step sought, is not where it
+# says in the output (e.g. one left by an earlier run) is built again.
 
+NODE_FIELDS = ['traffic_sent',
+               'traffic_response',
+               'load_balance',
+               'strategy_info',
+               'weights']
+
+_CONSTANTS = {'nan': float('nan'),
+              'inf': float('inf')}
+
+INDEX_SUFFIX = '.index'
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+class _Constants(ast.NodeTransformer):
+
+  # replaces the names nan and inf (as printed by str) with their values
+  def visit_Name(self, node):
+    if node.id in _CONSTANTS:
+      return ast.copy_location(ast.Constant(_CONSTANTS[node.id]), node)
+    return node
+
+
+
+def _literal(text):
+
+  # str prints a string holding a single quote in double quotes, and one
+  # holding both with escapes, so those are left to literal_eval. Tuples,
+  # True, False, None, nan, inf and non-string keys are not valid JSON, and
+  # fall through to it too.
+  if '"' not in text:
+    try:
+      return json.loads(text.replace("'", '"'),
+                        parse_constant=_rejectConstant)
+    except ValueError:
+      pass
+
+  try:
+    return ast.literal_eval(text)
+  except ValueError:
+    return ast.literal_eval(_Constants().visit(ast.parse(text, mode='eval')))
+
+
+
+def _rejectConstant(name):
+
+  # json accepts NaN and Infinity, which str never prints
+  raise ValueError(name)
+
+
+
+def _splitKey(key):
+
+  # (node, field) for node values, (network, None) for network values
+  name, separator, field = key.rpartition('-')
+  if separator and field in NODE_FIELDS:
+    return name, field
+  return key, None
+
+
+
+def _keep(key,
+          nodes,
+          networks,
+          fields):
+
+  name, field = _splitKey(key)
+
+  if field is None:
+    return networks is None or name in networks
+
+  return (nodes is None or name in nodes) and \
+         (fields is None or field in fields)
+
+
+
+def _lowerNames(names):
+
+  if names is None:
+    return None
+  return set(name.lower() for name in names)
+
+
+
+def _readSections(lines,
+                  nodes,
+                  networks,
+                  fields,
+                  last=None):
+
+  # stops at the first time step after last, without parsing it
+  nodes = _lowerNames(nodes)
+  networks = _lowerNames(networks)
+  fields = _lowerNames(fields)
+
+  timeStep = None
+  values = {}
+
+  for line in lines:
+    line = line.strip()
+
+    if line.startswith('['):
+      if timeStep is not None:
+        yield timeStep, values
+      timeStep = int(line[1:-1])
+      values = {}
+      if last is not None and timeStep > last:
+        return
+
+    elif line and timeStep is not None:
+      key, separator, value = line.partition('=')
+      key = key.strip().lower()
+      if _keep(key, nodes, networks, fields):
+        values[key] = _literal(value.strip())
+
+  if timeStep is not None:
+    yield timeStep, values
+
+
+
+
+def _stepAt(fileName,
+            timeStep,
+            offset):
+
+  # whether the line at offset in the output is the header of timeStep
+  with open(fileName, 'rb') as f:
+    f.seek(offset)
+    return f.readline().strip() == '[{}]'.format(timeStep).encode()
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def iterateOutput(fileName,
+                  nodes=None,
+                  networks=None,
+                  fields=None):
+  """
+    Reads the output file one time step at a time, yielding
+    (timeStep, values) where values maps 'node-field' and network names to
+    their values, like processOutput.
+
+    Input:
+
+      nodes, networks:
+        The names of the nodes and networks to read, or None for all
+
+      fields:
+        The node fields to read (from NODE_FIELDS), or None for all.
+        Values that are not read are not parsed.
+  """
+
+  with open(fileName) as f:
+    yield from _readSections(f, nodes, networks, fields)
 
-def _processSegment(segment):
-  segmentCopy = {}
-  
-  for entry in segment:
-    segmentCopy[entry] = eval(segment[entry])
-  
-  return segmentCopy
 
 
 def processOutput(fileName):
-  
-  config = configparser.ConfigParser()
-  config.read(fileName)
-  
+  """
+    Reads the whole output file into a dictionary mapping every time step to
+    its values (see iterateOutput).
+  """
+
   processedOutput = {}
-  
-  for entry in config:
-    if entry != 'DEFAULT':
-      processedOutput[eval(entry)] = _processSegment(config[entry])
-  
-  return processedOutput
\ No newline at end of file
+
+  for timeStep, values in iterateOutput(fileName):
+    processedOutput[timeStep] = values
+
+  return processedOutput
+
+
+
+def indexPath(fileName):
+  """
+    Returns the name of the index file of the output file fileName.
+  """
+
+  return fileName + INDEX_SUFFIX
+
+
+
+def appendIndex(indexFile,
+                offsets):
+  """
+    Adds (timeStep, offset) pairs to the end of indexFile.
+  """
+
+  with open(indexFile, 'ab') as f:
+    f.write(np.array(offsets, dtype='<i8').reshape(-1, 2).tobytes())
+
+
+
+def buildIndex(fileName):
+  """
+    Scans the output file fileName for its time steps and writes their
+    offsets to its index file. Returns the index, as readIndex does.
+  """
+
+  offsets = []
+  offset = 0
+
+  with open(fileName, 'rb') as f:
+    for line in f:
+      if line.startswith(b'['):
+        offsets.append((int(line.strip()[1:-1]), offset))
+      offset += len(line)
+
+  index = np.array(offsets, dtype='<i8').reshape(-1, 2)
+  with open(indexPath(fileName), 'wb') as f:
+    f.write(index.tobytes())
+
+  return index
+
+
+
+def readIndex(fileName):
+  """
+    Returns the index of the output file fileName as an int64 array
+    (numberOfTimeSteps, 2) of time steps and their offsets, building the
+    index first if there is none, or if it does not match the output.
+  """
+
+  indexFile = indexPath(fileName)
+
+  if not os.path.exists(indexFile):
+    return buildIndex(fileName)
+
+  index = np.fromfile(indexFile, dtype='<i8').reshape(-1, 2)
+  if len(index) == 0 or not _stepAt(fileName, index[-1, 0], index[-1, 1]):
+    return buildIndex(fileName)
+
+  return index
+
+
+
+def readSteps(fileName,
+              first,
+              last=None,
+              nodes=None,
+              networks=None,
+              fields=None):
+  """
+    Yields (timeStep, values) like iterateOutput, for the time steps from
+    first to last (inclusive, or to the end of the output if last is None),
+    seeking straight to the first of them with the output's index.
+  """
+
+  index = readIndex(fileName)
+
+  start = np.searchsorted(index[:, 0], first)
+  if start < len(index) and \
+     not _stepAt(fileName, index[start, 0], index[start, 1]):
+    index = buildIndex(fileName)
+    start = np.searchsorted(index[:, 0], first)
+  if start == len(index):
+    return
+
+  with open(fileName, 'rb') as f:
+    f.seek(int(index[start, 1]))
+    yield from _readSections(io.TextIOWrapper(f),
+                             nodes,
+                             networks,
+                             fields,
+                             last)
+
+
+
+def readStep(fileName,
+             timeStep,
+             nodes=None,
+             networks=None,
+             fields=None):
+  """
+    Returns the values of one time step (see readSteps), or None if the
+    output does not have it.
+  """
+
+  for step, values in readSteps(fileName, timeStep, timeStep,
+                                nodes, networks, fields):
+    if step == timeStep:
+      return values
+
+  return None
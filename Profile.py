@@ -0,0 +1,275 @@
+import time
+import threading
+import numpy as np
+
+# Timings of the phases of a simulation run.
+#
+# Code marks a phase with
+#
+#   with Profile.phase('solve_opt'):
+#     ...
+#
+# and the engines mark every time step with startStep and endStep. While
+# profiling is enabled, the time spent in and the number of calls of every
+# phase are recorded, both in total and per time step. While it is disabled
+# (the default) phase returns a shared object that does nothing, so the marks
+# can stay in the hot paths.
+#
+# The phases are:
+#
+#   traffic           nodes generating and splitting their traffic
+#   network_response  networks responding to the traffic, made of
+#     metric_sampling   drawing the network parameters
+#     return_traffic    drawing the returned packets (_returnTraffic)
+#   strategy_update   nodes updating their strategies, made of
+#     strategy_info     updating the strategy information, including
+#       learn_prior       learning the capacity and reliability priors
+#     load_balance      updating the load balance, including
+#       solve_opt         solving for the optimal load balance
+#   callback          the engine's stepCallback
+#   write_data        handing the time step to the output writer
+#   write_build       building the output strings
+#   write_flush       writing the buffered strings to the output file
+#
+# Phases are timed inclusively, so a phase's time also counts towards the
+# phases it is part of. With the text output, write_build and write_flush
+# run on the writer thread (see Simulation.py), alongside the time steps,
+# and only the time spent waiting for the writer counts in write_data.
+# Phases timed on any thread other than the one marking the time steps are
+# not part of a time step, and only count towards the totals.
+
+_enabled = False
+
+# phase -> [seconds, calls], over the run and in the current time step
+_totals = {}
+_stepPhases = {}
+
+_stepStart = None
+_stepThread = None
+_stepTimes = []
+_stepRecords = []
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+class _Phase:
+
+  __slots__ = ['name', 'start']
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+
+  def __exit__(self, *exception):
+    elapsed = time.perf_counter() - self.start
+    if threading.current_thread() is _stepThread:
+      records = (_totals, _stepPhases)
+    else:
+      records = (_totals,)
+    for record in records:
+      entry = record.get(self.name)
+      if entry is None:
+        record[self.name] = [elapsed, 1]
+      else:
+        entry[0] += elapsed
+        entry[1] += 1
+    return False
+
+
+
+class _NoPhase:
+
+  __slots__ = []
+
+  def __enter__(self):
+    pass
+
+  def __exit__(self, *exception):
+    return False
+
+_NO_PHASE = _NoPhase()
+
+
+
+def _milliseconds(seconds):
+
+  return '{:.3f}'.format(seconds * 1000)
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def enable():
+  """
+    Starts recording, discarding anything recorded before.
+  """
+
+  global _enabled
+
+  reset()
+  _enabled = True
+
+
+
+def disable():
+  """
+    Stops recording. What was recorded is kept for report.
+  """
+
+  global _enabled
+
+  _enabled = False
+
+
+
+def reset():
+  """
+    Discards everything recorded.
+  """
+
+  global _stepStart, _stepThread
+
+  _totals.clear()
+  _stepPhases.clear()
+  _stepTimes.clear()
+  _stepRecords.clear()
+  _stepStart = None
+  _stepThread = None
+
+
+
+def enabled():
+
+  return _enabled
+
+
+
+def phase(name):
+  """
+    Returns a context manager timing the phase name.
+  """
+
+  if _enabled:
+    return _Phase(name)
+  return _NO_PHASE
+
+
+
+def startStep():
+  """
+    Marks the start of a time step.
+  """
+
+  global _stepStart, _stepThread
+
+  if _enabled:
+    _stepPhases.clear()
+    _stepThread = threading.current_thread()
+    _stepStart = time.perf_counter()
+
+
+
+def endStep():
+  """
+    Marks the end of the time step started by the last startStep.
+  """
+
+  global _stepStart
+
+  if _enabled and _stepStart is not None:
+    _stepTimes.append(time.perf_counter() - _stepStart)
+    _stepRecords.append({name: entry[0] for name, entry in _stepPhases.items()})
+    _stepStart = None
+
+
+
+def stepTimings():
+  """
+    Returns a dictionary mapping 'step' and every phase to an array with the
+    seconds spent in it in every recorded time step.
+  """
+
+  timings = {'step': np.array(_stepTimes)}
+  for name in _totals:
+    timings[name] = np.array([record.get(name, 0.0) for record in _stepRecords])
+  return timings
+
+
+
+def report(percentiles=(50, 90, 99)):
+  """
+    Returns a text report of the recorded timings: the latency percentiles
+    of a time step, and for every phase its calls, total time, share of the
+    time steps' time and per step time.
+  """
+
+  timings = stepTimings()
+  stepTimes = timings['step']
+  stepTotal = float(np.sum(stepTimes))
+
+  lines = ['{} time steps, {:.3f} s'.format(len(stepTimes), stepTotal), '']
+
+  if len(stepTimes) > 0:
+    stepPercentiles = np.percentile(stepTimes, percentiles)
+    lines.append('step latency (ms): mean {}  {}  max {}'.format(
+        _milliseconds(np.mean(stepTimes)),
+        '  '.join('p{} {}'.format(p, _milliseconds(value))
+                  for p, value in zip(percentiles, stepPercentiles)),
+        _milliseconds(np.max(stepTimes))))
+    lines.append('')
+
+  header = ['phase', 'calls', 'total (s)', '% of steps', 'per step (ms)'] + \
+           ['p{} (ms)'.format(p) for p in percentiles]
+  rows = []
+  for name, (seconds, calls) in sorted(_totals.items(),
+                                       key=lambda item: -item[1][0]):
+    row = [name,
+           str(calls),
+           '{:.3f}'.format(seconds),
+           '{:.1f}'.format(100 * seconds / stepTotal) if stepTotal > 0 else '-']
+    # phases of other threads have no per step times
+    if any(name in record for record in _stepRecords):
+      row.append(_milliseconds(np.mean(timings[name])))
+      row.extend(_milliseconds(value)
+                 for value in np.percentile(timings[name], percentiles))
+    else:
+      row.extend('-' for p in range(len(percentiles) + 1))
+    rows.append(row)
+
+  widths = [max(len(row[column]) for row in [header] + rows)
+            for column in range(len(header))]
+  for row in [header] + rows:
+    lines.append('  '.join([row[0].ljust(widths[0])] +
+                           [value.rjust(width)
+                            for value, width in zip(row[1:], widths[1:])]))
+
+  return '\n'.join(lines) + '\n'
+
+
+
+def writeReport(fileName,
+                percentiles=(50, 90, 99)):
+  """
+    Writes report() to fileName.
+  """
+
+  with open(fileName, 'w') as f:
+    f.write(report(percentiles))
+
+###############################################################################
+###############################################################################
@@ -0,0 +1,249 @@
+import os
+import glob
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+import numbers
+import numpy as np
+import ParseFile
+
+# An on-disk cache of simulation results.
+#
+# A result is stored under a key that hashes everything it depends on: the
+# configuration as ParseFile.parseConfig builds the nodes and networks from
+# it (so formatting, comments and how numbers are written in the file do not
+# matter), the run parameters (time steps, seed, engine...)
+# and the source of the simulator itself, so that changing the code
+# invalidates earlier results. Only seeded runs can be cached, as unseeded
+# runs cannot be repeated.
+#
+# Each entry is a single file in the cache directory. Reading an entry marks
+# it as used, and when the directory grows over its size limit the least
+# recently used entries are removed.
+
+DEFAULT_DIRECTORY = '.simcache'
+DEFAULT_MAX_BYTES = 2**30
+
+_SUFFIXES = ['.out', '.pickle']
+
+_codeVersion = None
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+def _entryPath(key,
+               directory,
+               suffix):
+
+  return os.path.join(directory, key + suffix)
+
+
+
+def _use(path):
+
+  # the modification time of an entry is the last time it was used
+  try:
+    os.utime(path)
+  except FileNotFoundError:
+    # evicted since it was read
+    pass
+
+
+
+def _evict(directory,
+           maxBytes):
+
+  # files being written have other suffixes, and are left alone
+  paths = []
+  for suffix in _SUFFIXES:
+    paths.extend(glob.glob(os.path.join(directory, '*' + suffix)))
+
+  entries = []
+  for path in paths:
+    try:
+      status = os.stat(path)
+    except FileNotFoundError:
+      continue
+    entries.append((status.st_mtime, status.st_size, path))
+
+  totalBytes = sum(size for mtime, size, path in entries)
+
+  for mtime, size, path in sorted(entries):
+    if totalBytes <= maxBytes:
+      break
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+    totalBytes -= size
+
+
+
+def _store(key,
+           directory,
+           suffix,
+           maxBytes,
+           write):
+
+  os.makedirs(directory, exist_ok=True)
+
+  # write next to the entry and move it in place, so that no one ever reads
+  # a partial entry
+  descriptor, tempPath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+  try:
+    with os.fdopen(descriptor, 'wb') as f:
+      write(f)
+    os.replace(tempPath, _entryPath(key, directory, suffix))
+  except BaseException:
+    os.remove(tempPath)
+    raise
+
+  _evict(directory, maxBytes)
+
+
+
+def _canonical(value):
+
+  # the parsed nodes and networks as plain JSON values: every number as a
+  # float, so that 1 and 1.0 hash alike, and functions by name
+  if isinstance(value, dict):
+    return {str(key): _canonical(item) for key, item in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [_canonical(item) for item in value]
+  if isinstance(value, np.ndarray):
+    return _canonical(value.tolist())
+  if value is None or isinstance(value, (str, bool)):
+    return value
+  if isinstance(value, np.bool_):
+    return bool(value)
+  if isinstance(value, numbers.Real):
+    return float(value)
+  if callable(value):
+    return '{}.{}'.format(value.__module__, value.__qualname__)
+  raise TypeError('cannot make a cache key from {!r}'.format(value))
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def codeVersion():
+  """
+    Returns a hash of the source of every module of the simulator.
+  """
+
+  global _codeVersion
+
+  if _codeVersion is None:
+    digest = hashlib.sha256()
+    sourceDirectory = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(sourceDirectory, '*.py'))):
+      digest.update(os.path.basename(path).encode())
+      with open(path, 'rb') as f:
+        digest.update(f.read())
+    _codeVersion = digest.hexdigest()
+
+  return _codeVersion
+
+
+
+def runKey(config,
+           **runParameters):
+  """
+    Returns the cache key of a run of config (as returned by
+    ParseFile.readConfig) with the given run parameters, which must be
+    JSON serializable. Configurations that parse to the same nodes and
+    networks get the same key.
+  """
+
+  nodes, networks = ParseFile.parseConfig(config)
+  description = {'config': _canonical({'nodes': nodes, 'networks': networks}),
+                 'run': runParameters,
+                 'code': codeVersion()}
+
+  return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+
+def fetchFile(key,
+              outFile,
+              directory=DEFAULT_DIRECTORY):
+  """
+    Copies the file stored under key to outFile. Returns whether there was
+    one.
+  """
+
+  path = _entryPath(key, directory, '.out')
+
+  try:
+    shutil.copyfile(path, outFile)
+  except FileNotFoundError:
+    return False
+
+  _use(path)
+  return True
+
+
+
+def storeFile(key,
+              sourceFile,
+              directory=DEFAULT_DIRECTORY,
+              maxBytes=DEFAULT_MAX_BYTES):
+  """
+    Stores a copy of sourceFile under key.
+  """
+
+  def write(f):
+    with open(sourceFile, 'rb') as source:
+      shutil.copyfileobj(source, f)
+
+  _store(key, directory, '.out', maxBytes, write)
+
+
+
+def fetchResult(key,
+                directory=DEFAULT_DIRECTORY):
+  """
+    Returns the result object stored under key, or None.
+  """
+
+  path = _entryPath(key, directory, '.pickle')
+
+  try:
+    with open(path, 'rb') as f:
+      result = pickle.load(f)
+  except FileNotFoundError:
+    return None
+
+  _use(path)
+  return result
+
+
+
+def storeResult(key,
+                result,
+                directory=DEFAULT_DIRECTORY,
+                maxBytes=DEFAULT_MAX_BYTES):
+  """
+    Stores the (picklable) result object under key.
+  """
+
+  _store(key, directory, '.pickle', maxBytes,
+         lambda f: pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+###############################################################################
+###############################################################################
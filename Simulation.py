@@ -1,5 +1,20 @@
+import os
+import queue
+import threading
 import SourceNode
 import Network
+import Profile
+import BinaryOutput
+import ProcessOutput
+
+OUTPUT_FORMATS = ['text', 'binary']
+
+# time steps written at once by the text output writer
+DEFAULT_WRITE_BUFFER = 1000
+
+# seconds between checks that the writer is still running, while waiting for
+# room in its queue
+_WRITER_POLL = 0.1
 
 def _transposeList(inputMatrix):
   transposed = []
@@ -46,9 +61,12 @@ def _writeEntry(entry,
 
 
 def _getLoadBalance(nodes):
+  # as floats, whatever the strategy gave, so that both engines write the
+  # same text
   loadBalance = []
   for node in nodes:
-    loadBalance.append(node[SourceNode.CURRENT_LOAD_BALANCE][:])
+    loadBalance.append([float(load)
+                        for load in node[SourceNode.CURRENT_LOAD_BALANCE]])
   return loadBalance
 
 
@@ -61,70 +79,255 @@ def _getNames(nodes):
 
 
 
-def _getNodeString(nodes,
+def _getNodeString(nodeNames,
                    values,
                    appendString):
   
   nodeString = []
   
-  for node, value in zip(nodes, values):
-    nodeString.append(node[SourceNode.NAME] + appendString + " = " + str(value))
+  for nodeName, value in zip(nodeNames, values):
+    nodeString.append(nodeName + appendString + " = " + str(value))
   
   return '\n'.join(nodeString)
 
 
 
-def _getNetworkString(networks,
+def _getNetworkString(networkNames,
                       values):
   
   networkString = []
   
-  for network, value in zip(networks, values):
-    networkString.append(network[Network.NAME] + " = " + str(value))
+  for networkName, value in zip(networkNames, values):
+    networkString.append(networkName + " = " + str(value))
   
   return '\n'.join(networkString)
 
 
 
-def _writeData(oldData,
-               allTraffic,
-               trafficResponses,
-               selectedParams,
-               outputFile,
-               nodes,
-               networks,
-               timeStep,
-               buffer):
+####################################
+#
+# Text output
+#
+####################################
+
+# Time steps are written by a background thread. The simulation thread only
+# takes a snapshot of what is written for each time step and puts it on a
+# queue, and the writer thread turns the snapshots into text and writes
+# them, bufferSteps time steps at a time, through a single open file. While
+# the writer writes one buffer, the simulation fills the queue for the next.
+# The queue holds up to bufferSteps time steps: when the writer falls that
+# far behind, the simulation waits for it.
+#
+# Formatting still holds the GIL, but writing to disk does not, and the
+# simulation no longer stops every bufferSteps time steps to write.
+#
+# A record may give the strategy information as a function returning it, for
+# the writer thread to call, so that the simulation thread only has to take a
+# copy of the state it is built from.
+#
+# The engines stop the writer however the run ends, so that it writes every
+# time step it was given and its thread exits. If the writer fails, its
+# thread exits at once, and the error is raised in the simulation thread by
+# the next _writeStep or by _stopWriter.
+
+def _stepRecord(timeStep,
+                allTraffic,
+                trafficResponses,
+                selectedParams,
+                nodes):
   
+  # everything written for a time step. The nodes may be updated in place
+  # after this, so nothing in the record may refer to their state.
+  return (timeStep,
+          allTraffic,
+          trafficResponses,
+          _getLoadBalance(nodes),
+          [SourceNode.getStrategyInfo(node) for node in nodes],
+          [node[SourceNode.WEIGHTS] for node in nodes],
+          selectedParams)
+
+
+
+def _formatStep(record,
+                nodeNames,
+                networkNames):
+  
+  timeStep, \
+  allTraffic, \
+  trafficResponses, \
+  loadBalances, \
+  strategyInfos, \
+  weights, \
+  selectedParams = record
   
   timeStepString = '[{}]\n'.format(timeStep)
-  timeStepString += _getNodeString(nodes,
+  timeStepString += _getNodeString(nodeNames,
                                    allTraffic,
                                    '-traffic_sent') + '\n'
-  timeStepString += _getNodeString(nodes,
+  timeStepString += _getNodeString(nodeNames,
                                    trafficResponses,
                                    '-traffic_response') + '\n'
-  timeStepString += _getNodeString(nodes,
-                                   [node[SourceNode.CURRENT_LOAD_BALANCE] for node in nodes],
+  timeStepString += _getNodeString(nodeNames,
+                                   loadBalances,
                                    '-load_balance') + '\n'
-  timeStepString += _getNodeString(nodes,
-                                   [node[SourceNode.STRATEGY_INFO] for node in nodes],
+  if callable(strategyInfos):
+    strategyInfos = strategyInfos()
+  
+  timeStepString += _getNodeString(nodeNames,
+                                   strategyInfos,
                                    '-strategy_info') + '\n'
-  timeStepString += _getNodeString(nodes,
-                                   [node[SourceNode.WEIGHTS] for node in nodes],
+  timeStepString += _getNodeString(nodeNames,
+                                   weights,
                                    '-weights') + '\n'
-  timeStepString += _getNetworkString(networks,
+  timeStepString += _getNetworkString(networkNames,
                                       selectedParams) + '\n\n'
   
-  if len(oldData) >= buffer:
-    with open(outputFile, 'a') as f:
-      for entry in oldData:
-        f.write(entry)
-    oldData = []
+  return timeStepString
+
+
+
+def _writeRecords(writer):
+  
+  # the writer thread. The offset of every time step is added to the index
+  # file (if any) once the time step is written.
+  records = writer['queue']
+  
+  try:
+    # written as bytes, so that the offsets are exact
+    with open(writer['file'], 'wb') as f:
+      buffer = []
+      offsets = []
+      offset = 0
+      
+      while True:
+        record = records.get()
+        
+        if record is not None:
+          with Profile.phase('write_build'):
+            entry = _formatStep(record,
+                                writer['node_names'],
+                                writer['network_names']).encode()
+          buffer.append(entry)
+          offsets.append((record[0], offset))
+          offset += len(entry)
+        
+        if len(buffer) >= writer['buffer_steps'] or \
+           (record is None and len(buffer) > 0):
+          with Profile.phase('write_flush'):
+            f.write(b''.join(buffer))
+            f.flush()
+          if writer['index'] is not None:
+            ProcessOutput.appendIndex(writer['index'], offsets)
+          buffer = []
+          offsets = []
+        
+        if record is None:
+          return
+  
+  except BaseException as error:
+    writer['error'] = error
+
+
+
+def _putRecord(writer,
+               record):
   
-  oldData.append(timeStepString)
+  # Puts record on the writer's queue, waiting while it is full. Returns
+  # False, without waiting any longer, if the writer has stopped.
+  while writer['thread'].is_alive():
+    try:
+      writer['queue'].put(record, timeout=_WRITER_POLL)
+      return True
+    except queue.Full:
+      pass
   
-  return oldData
+  return False
+
+
+
+def _startWriter(outputFile,
+                 nodes,
+                 networks,
+                 bufferSteps,
+                 indexFile):
+  
+  # Empties outputFile and starts a writer thread for it. Returns the
+  # writer, for _writeStep and _stopWriter.
+  writer = {'file': outputFile,
+            'index': indexFile,
+            'node_names': _getNames(nodes),
+            'network_names': [network[Network.NAME] for network in networks],
+            'buffer_steps': bufferSteps,
+            'queue': queue.Queue(maxsize=bufferSteps),
+            'error': None}
+  
+  writer['thread'] = threading.Thread(target=_writeRecords,
+                                      args=(writer,),
+                                      daemon=True)
+  writer['thread'].start()
+  
+  return writer
+
+
+
+def _writeStep(writer,
+               record):
+  
+  # Hands the record of a time step (see _stepRecord) to the writer, waiting
+  # while its queue is full
+  if writer['error'] is not None:
+    raise writer['error']
+  
+  if not _putRecord(writer, record):
+    raise writer['error']
+
+
+
+def _stopWriter(writer,
+                raiseError=True):
+  
+  # Waits for the writer to write everything it was given and exit. The
+  # writer's error, if any, is raised unless raiseError is False, as when the
+  # simulation is already raising one of its own.
+  _putRecord(writer, None)
+  writer['thread'].join()
+  
+  if raiseError and writer['error'] is not None:
+    raise writer['error']
+
+
+
+def _closeOutput(output,
+                 outFormat,
+                 completed):
+  
+  # Closes the output of executeSimulation, however the run ended
+  if output is None:
+    return
+  
+  with Profile.phase('write_data'):
+    if outFormat == 'binary':
+      BinaryOutput.closeOutput(output)
+    else:
+      _stopWriter(output, raiseError=completed)
+
+
+
+def _clearIndex(outFile,
+                writeIndex):
+  
+  # Returns the index file to write for outFile, or None. An index left by
+  # an earlier run would not match the new output, and is removed.
+  indexFile = ProcessOutput.indexPath(outFile)
+  
+  if writeIndex:
+    f = open(indexFile, 'wb')
+    f.close()
+    return indexFile
+  
+  if os.path.exists(indexFile):
+    os.remove(indexFile)
+  return None
 
 
 
@@ -132,61 +335,139 @@ def _writeData(oldData,
 def executeSimulation(timeSteps,
                       nodes,
                       networks,
-                      outFile):
+                      outFile,
+                      nodeUpdate='safe',
+                      stepCallback=None,
+                      outFormat='text',
+                      writeIndex=False,
+                      writeBuffer=DEFAULT_WRITE_BUFFER,
+                      split='sequential'):
+  """
+    Runs the simulation for the given number of time steps and writes the
+    results to outFile.
+    
+    Input:
+      
+      outFile:
+        The output file name, or None to write no output
+      
+      outFormat:
+        'text' writes every time step as a configuration file section (see
+        _formatStep), 'binary' writes numeric columns to the directory
+        outFile (see BinaryOutput)
+      
+      writeIndex:
+        With the text format, also write the offset of every time step in
+        outFile to the index file ProcessOutput.indexPath(outFile), for
+        ProcessOutput.readSteps
+      
+      writeBuffer:
+        With the text format, the number of time steps written at once by
+        the background writer, and queued for it at most
+      
+      nodeUpdate:
+        Passed to SourceNode.updateNodeStrategy. With 'fast' the given nodes
+        are updated in place instead of being copied on every time step.
+      
+      split:
+        How the nodes split their traffic across the networks, passed to
+        SourceNode.getTraffic ('sequential' or 'multinomial')
+      
+      stepCallback:
+        If given, called after every time step as
+        stepCallback(timeStep, loadBalances, allTraffic, trafficResponses),
+        with the updated load balances and the traffic sent and returned by
+        every node on every network (nested lists, nodes x networks)
+    
+    The time steps and their phases are timed by Profile, when it is
+    enabled.
+  """
   
-  # Clear the output file contents, if the file exists
-  f = open(outFile, 'w')
-  f.close()
+  if outFormat not in OUTPUT_FORMATS:
+    raise ValueError("unknown output format '{}'".format(outFormat))
+  
+  if split not in SourceNode._SPLITS:
+    raise ValueError("unknown traffic split '{}'".format(split))
+  
+  output = None
+  if outFile is not None and outFormat == 'text':
+    output = _startWriter(outFile,
+                          nodes,
+                          networks,
+                          writeBuffer,
+                          _clearIndex(outFile, writeIndex))
+  elif outFile is not None:
+    output = BinaryOutput.openOutput(outFile, timeSteps, nodes, networks)
   
   numNetworks = len(networks)
-  data = []
   
-  for step in range(timeSteps):
-    
-    allTraffic = []
-    for node in nodes:
-      allTraffic.append(SourceNode.getTraffic(node))
-    transposedTraffic = _transposeList(allTraffic)
-    
-    allResponses = []
-    allSelectedParams = []
-    
-    for network, netTraffic in zip(networks, transposedTraffic):
-      response, selectedParam = \
-          Network.generateNetworkResponse(network, netTraffic)
-      allResponses.append(response)
-      allSelectedParams.append(selectedParam)
-    allResponses = _transposeList(allResponses)
-    
-    
-    newNodes = []
-    for node, responseSet, trafficSent in zip(nodes, allResponses, allTraffic):
-      newNodes.append(SourceNode.updateNodeStrategy(node,
-                                                    numNetworks,
-                                                    trafficSent,
-                                                    responseSet))
+  # the output is closed however the run ends, see _closeOutput
+  completed = False
+  try:
+    for step in range(timeSteps):
+      
+      Profile.startStep()
+      
+      with Profile.phase('traffic'):
+        allTraffic = []
+        for node in nodes:
+          allTraffic.append(SourceNode.getTraffic(node, split))
+        transposedTraffic = _transposeList(allTraffic)
+      
+      allResponses = []
+      allSelectedParams = []
+      
+      with Profile.phase('network_response'):
+        for network, netTraffic in zip(networks, transposedTraffic):
+          response, selectedParam = \
+              Network.generateNetworkResponse(network, netTraffic)
+          allResponses.append(response)
+          allSelectedParams.append(selectedParam)
+        allResponses = _transposeList(allResponses)
+      
+      
+      with Profile.phase('strategy_update'):
+        newNodes = []
+        for node, responseSet, trafficSent in zip(nodes, allResponses, allTraffic):
+          newNodes.append(SourceNode.updateNodeStrategy(node,
+                                                        numNetworks,
+                                                        trafficSent,
+                                                        responseSet,
+                                                        nodeUpdate))
+      
+      trafficResponses = [[nodeResponse['traffic_response'] for nodeResponse in response] for response in allResponses]
+      
+      if stepCallback is not None:
+        with Profile.phase('callback'):
+          stepCallback(step,
+                       _getLoadBalance(newNodes),
+                       allTraffic,
+                       trafficResponses)
+      
+      if outFile is not None:
+        with Profile.phase('write_data'):
+          if outFormat == 'binary':
+            BinaryOutput.writeStep(output,
+                                   allTraffic,
+                                   trafficResponses,
+                                   _getLoadBalance(newNodes),
+                                   allSelectedParams)
+          else:
+            _writeStep(output,
+                       _stepRecord(step,
+                                   allTraffic,
+                                   trafficResponses,
+                                   allSelectedParams,
+                                   newNodes))
+      
+      nodes = newNodes
+      
+      Profile.endStep()
     
-    data = _writeData(data,
-                      allTraffic,
-                      [[nodeResponse['traffic_response'] for nodeResponse in response] for response in allResponses],
-                      allSelectedParams,
-                      outFile,
-                      newNodes,
-                      networks,
-                      step,
-                      1000) # buffer size.
-    
-    nodes = newNodes
-  
-  data = _writeData(data,
-                    allTraffic,
-                    [[nodeResponse['traffic_response'] for nodeResponse in response] for response in allResponses],
-                    allSelectedParams,
-                    outFile,
-                    nodes,
-                    networks,
-                    step,
-                    0)
+    completed = True
+  
+  finally:
+    _closeOutput(output, outFormat, completed)
     
     
     
@@ -1,9 +1,12 @@
 import Strategies
+import Profile
 import random
 import math
+import numpy as np
 from copy import deepcopy
 
 NAME = 'name'
+STRATEGY = 'strategy'
 STRATEGY_UPDATE = 'strategy_update'
 STRATEGY_INFO = 'strategy_info'
 CURRENT_LOAD_BALANCE = 'current_load_balance'
@@ -11,6 +14,12 @@ LOAD_BALANCE_UPDATE = 'load_balance_update'
 DISTRIBUTION = 'distribution'
 WEIGHTS = 'weights'
 DISTRIBUTION_PARAMETERS = 'distribution_parameters'
+INFO_VIEW = 'info_view'
+RNG = 'rng'
+
+# A node may own a numpy Generator under RNG (see ParseFile.parseInput).
+# All of its random draws (packets, traffic split and strategy) then come
+# from that generator instead of the global random and numpy.random state.
 
 
 
@@ -29,7 +38,8 @@ DISTRIBUTION_PARAMETERS = 'distribution_parameters'
 ####################################
 
 def _gaussian(nodeName,
-              distributionParameters):
+              distributionParameters,
+              rng=None):
   
 #  if "dist_mean" not in distributionParameters or \
 #     "dist_variance" not in distributionParameters:
@@ -49,6 +59,11 @@ def _gaussian(nodeName,
     print("For node: {} expected 2 parameters, got {}".format(nodeName,
                                                               len(distributionParameters)))
   
+  if rng is not None:
+    return (rng.normal,
+            (distributionParameters[0],
+             distributionParameters[1]))
+  
   return (random.gauss,
             (distributionParameters[0],
              distributionParameters[1]))
@@ -60,6 +75,12 @@ def _gaussian(nodeName,
 #
 ####################################
   
+def _infoAsIs(strategyInfo):
+  # a copy, as the output is written after the node may have changed
+  return deepcopy(strategyInfo)
+
+
+
 def _normalizeWeights(priorityWeights):
   
   total = 0
@@ -73,6 +94,15 @@ def _normalizeWeights(priorityWeights):
 
 
 
+def _randomOptions(node):
+  
+  # keyword arguments handing the node's own generator to its strategy
+  if RNG in node:
+    return {'rng': node[RNG]}
+  return {}
+
+
+
 def _updateNodeStrategyInfo_safe(node,
                                  trafficSent,
                                  networkResponse):
@@ -110,11 +140,12 @@ def _updateLoadBalance_safe(node,
   newNode = deepcopy(node)
   
   newNode[CURRENT_LOAD_BALANCE] = \
-      newNode[LOAD_BALANCE_UPDATE](node[STRATEGY_INFO],
+      newNode[LOAD_BALANCE_UPDATE](newNode[STRATEGY_INFO],
                                    numNetworks,
                                    newNode[WEIGHTS],
                                    newNode[CURRENT_LOAD_BALANCE],
-                                   newNode[DISTRIBUTION_PARAMETERS])
+                                   newNode[DISTRIBUTION_PARAMETERS],
+                                   **_randomOptions(newNode))
   
   return newNode
 
@@ -124,16 +155,22 @@ def _updateLoadBalance_fast(node,
                             numNetworks):
   
   node[CURRENT_LOAD_BALANCE] = \
-      node[CURRENT_LOAD_BALANCE](node[STRATEGY_INFO],
-                                 numNetworks,
-                                 node[WEIGHTS],
-                                 node[CURRENT_LOAD_BALANCE],
-                                 node[DISTRIBUTION_PARAMETERS])
+      node[LOAD_BALANCE_UPDATE](node[STRATEGY_INFO],
+                                numNetworks,
+                                node[WEIGHTS],
+                                node[CURRENT_LOAD_BALANCE],
+                                node[DISTRIBUTION_PARAMETERS],
+                                **_randomOptions(node))
 
   return node
 
 
 
+_UPDATES = {'safe': (_updateNodeStrategyInfo_safe, _updateLoadBalance_safe),
+            'fast': (_updateNodeStrategyInfo_fast, _updateLoadBalance_fast)}
+
+
+
 def _generatePackets(node,
                      rounding=math.ceil):
   # Grab the distribution information from the node structure. This information
@@ -155,6 +192,72 @@ def _createCDF(loadPMF):
   return loadCDF
 
 
+
+def _loadPMF(loadCDF):
+  # The differences of a float CDF can come out slightly negative, or sum to
+  # slightly more than 1, either of which multinomial rejects. Works on the
+  # last axis, for a single CDF or one per row.
+  loadPMF = np.maximum(np.diff(loadCDF, prepend=0), 0)
+  return loadPMF / loadPMF.sum(axis=-1, keepdims=True)
+
+
+
+def _floorTraffic(loadBalance,
+                  numPackets):
+  trafficDistribution = []
+  for load in loadBalance:
+    trafficDistribution.append(math.floor(load * numPackets))
+  return trafficDistribution
+
+
+
+def _splitTraffic_sequential(loadBalance,
+                             numPackets,
+                             rng=None):
+  loadBalanceCDF = _createCDF(loadBalance)
+  trafficDistribution = _floorTraffic(loadBalance, numPackets)
+  
+  numPackets -= sum(trafficDistribution)
+  
+  uniform = random.uniform if rng is None else rng.uniform
+  
+  for i in range(numPackets):
+    assignment = uniform(0, 1)
+    for entry in range(len(loadBalanceCDF)):
+      # _create CDF should ensure the last entry is 1
+      if assignment <= loadBalanceCDF[entry]:
+        trafficDistribution[entry] += 1
+        break
+  
+  return trafficDistribution
+
+
+
+def _splitTraffic_multinomial(loadBalance,
+                              numPackets,
+                              rng=None):
+  # Same distribution as the sequential split: the leftover packets are
+  # independent draws from the load balance, so their counts are a single
+  # multinomial sample. The PMF is taken from the CDF so that the last entry
+  # absorbs any rounding error, exactly as in the sequential split.
+  trafficDistribution = _floorTraffic(loadBalance, numPackets)
+  
+  numPackets -= sum(trafficDistribution)
+  
+  if numPackets > 0:
+    loadPMF = _loadPMF(_createCDF(loadBalance))
+    leftover = (np.random if rng is None else rng).multinomial(numPackets, loadPMF)
+    for entry in range(len(trafficDistribution)):
+      trafficDistribution[entry] += int(leftover[entry])
+  
+  return trafficDistribution
+
+
+
+_SPLITS = {'sequential': _splitTraffic_sequential,
+           'multinomial': _splitTraffic_multinomial}
+
+
 ###############################################################################
 ###############################################################################
 
@@ -168,38 +271,106 @@ def _createCDF(loadPMF):
 def updateNodeStrategy(node,
                        numNetworks,
                        trafficSent,
-                       networkResponse):
+                       networkResponse,
+                       update='safe'):
+  """
+    Updates the node's strategy information and load balance with the
+    network responses of this time step, and returns the updated node.
+    
+    Input:
+      
+      update:
+        'safe' works on a deep copy and leaves the given node untouched,
+        'fast' updates the given node in place and returns it. Both give the
+        same updated node.
+  """
   
-  newNode = _updateNodeStrategyInfo_safe(node,
-                                         trafficSent,
-                                         networkResponse)
+  updateInfo, updateLoadBalance = _UPDATES[update]
   
-  newNode = _updateLoadBalance_safe(newNode,
-                                    numNetworks)
+  with Profile.phase('strategy_info'):
+    newNode = updateInfo(node,
+                         trafficSent,
+                         networkResponse)
+  
+  with Profile.phase('load_balance'):
+    newNode = updateLoadBalance(newNode,
+                                numNetworks)
   
   return newNode
 
 
 
-def getTraffic(node):
-  loadBalanceCDF = _createCDF(node[CURRENT_LOAD_BALANCE])
-  numPackets = _generatePackets(node)
+def getStrategyInfo(node):
+  """
+    Returns the node's strategy information in the form it should be written
+    out, as given by the strategy's optional info_view function.
+  """
   
-  trafficDistribution = []
-  for load in node[CURRENT_LOAD_BALANCE]:
-    trafficDistribution.append(math.floor(load * numPackets))
+  return node[INFO_VIEW](node[STRATEGY_INFO])
+
+
+
+def getTraffic(node,
+               split='sequential',
+               loadBalance=None):
+  """
+    Generates the node's packets for this time step and splits them across
+    the networks according to the node's current load balance.
+    
+    Input:
+      
+      split:
+        'sequential' assigns each leftover packet with its own uniform draw,
+        'multinomial' assigns all of them with a single multinomial sample.
+        Both give the same distribution.
+      
+      loadBalance:
+        The load balance to split by instead of the node's current one, for
+        callers that keep the load balances elsewhere
+  """
   
-  numPackets -= sum(trafficDistribution)
+  if loadBalance is None:
+    loadBalance = node[CURRENT_LOAD_BALANCE]
   
-  for i in range(numPackets):
-    assignment = random.uniform(0, 1)
-    for entry in range(len(loadBalanceCDF)):
-      # _create CDF should ensure the last entry is 1
-      if assignment <= loadBalanceCDF[entry]:
-        trafficDistribution[entry] += 1
-        break
+  return _SPLITS[split](loadBalance,
+                        _generatePackets(node),
+                        node.get(RNG))
+
+
+
+def getTrafficBatch(loadBalances,
+                    numPackets,
+                    rng):
+  """
+    Multinomial traffic split for many nodes at once
+    
+    Input:
+      
+      loadBalances:
+        A float array (numNodes, numNetworks) of the nodes' load balances
+      
+      numPackets:
+        An integer array (numNodes,) of the packets each node generated
+      
+      rng:
+        A numpy Generator
+    
+    Returns an integer array (numNodes, numNetworks) of packets sent to each
+    network.
+  """
   
-  return trafficDistribution
+  loadBalances = np.asarray(loadBalances, dtype=float)
+  numPackets = np.asarray(numPackets, dtype=np.int64)
+  
+  traffic = np.floor(loadBalances * numPackets[:, None]).astype(np.int64)
+  leftover = np.maximum(numPackets - traffic.sum(axis=1), 0)
+  
+  if leftover.any():
+    loadCDF = np.cumsum(loadBalances, axis=1)
+    loadCDF[:, -1] = 1
+    traffic += rng.multinomial(leftover, _loadPMF(loadCDF))
+  
+  return traffic
 
 
 
@@ -209,7 +380,8 @@ def createSourceNode(nodeName,
                      distributionParameters,
                      nodeStrategy,
                      priorityWeights,
-                     distribution='_gaussian'):
+                     distribution='_gaussian',
+                     rng=None):
   """
     Takes node parameters and returns a node object (dictionary)
     
@@ -236,6 +408,11 @@ def createSourceNode(nodeName,
       distribution:
         A function name for the distribution the node generates traffic from.
         Defaults to gaussian.
+      
+      rng:
+        A numpy Generator owned by the node, which all of its random draws
+        come from. Without one, the node draws from the global random and
+        numpy.random state.
   """
   
   priorityWeights = _normalizeWeights(priorityWeights)
@@ -249,14 +426,26 @@ def createSourceNode(nodeName,
                                                                   numNetworks,
                                                                   priorityWeights)
   
-  return {NAME: nodeName,
+  if rng is None:
+    distributionFunction = eval(distribution)(nodeName, distributionParameters)
+  else:
+    distributionFunction = eval(distribution)(nodeName, distributionParameters, rng)
+  
+  node = {NAME: nodeName,
+          STRATEGY: nodeStrategy,
           STRATEGY_UPDATE: getattr(Strategies, nodeStrategy + '_update_info'),
           LOAD_BALANCE_UPDATE: getattr(Strategies, nodeStrategy + '_update_load'),
+          INFO_VIEW: getattr(Strategies, nodeStrategy + '_info_view', _infoAsIs),
           CURRENT_LOAD_BALANCE: initialLoadBalance,
           STRATEGY_INFO: initialInfo,
-          DISTRIBUTION: eval(distribution)(nodeName, distributionParameters),
+          DISTRIBUTION: distributionFunction,
           WEIGHTS: priorityWeights,
           DISTRIBUTION_PARAMETERS: distributionParameters}
+  
+  if rng is not None:
+    node[RNG] = rng
+  
+  return node
 
 ###############################################################################
 ###############################################################################
@@ -1,6 +1,8 @@
 import math
+import numpy as np
 import learn_capacity_reliability
 import optimize
+import Profile
 from copy import deepcopy
 from numpy import random
 
@@ -85,46 +87,261 @@ PRIOR_BETA = 'prior_beta'
 # The exact meaning of these variables will be determined by the specific strategy.
 # However, the first entry of 'networkParameters' will always be 'packets_returned',
 # which is the global constant PACKETS_RETURNED in this file
+#
+# A strategy may also provide the following function, to be used in place of
+# currentStrategyInfo wherever the strategy information is written out
+# (for example when currentStrategyInfo holds NumPy arrays):
+#
+#     strategyname_info_view(currentStrategyInfo) -> strategyInfoView
+#
+# strategyInfoView should be made of Python literals (dicts, lists, numbers,
+# strings), so that the output can be read back with ProcessOutput.py
+#
+# Nodes may own a numpy Generator (see ParseFile.parseInput). For those nodes
+# strategyname_update_load is called with the extra keyword argument rng, and
+# a strategy that draws random numbers should take them from it.
+#
+# Finally, a strategy may provide a batch interface, which updates every node
+# using the strategy at once. VectorSimulation.py uses it instead of the
+# single node functions when all 4 of these functions are present:
+#
+#     strategyname_stack_info(strategyInfos) -> stackedStrategyInfo
+#
+#     strategyname_unstack_info(stackedStrategyInfo) -> strategyInfos
+#
+#     strategyname_update_info_batch(stackedStrategyInfo,
+#                                    trafficSent,
+#                                    networkResponses,
+#                                    priorityWeights,
+#                                    packetGenerationParameters) ->
+#                                         stackedStrategyInfo
+#
+#     strategyname_update_load_batch(stackedStrategyInfo,
+#                                    numNetworks,
+#                                    priorityWeights,
+#                                    packetDistributions,
+#                                    packetGenerationParameters) ->
+#                                         packetDistributions
+#
+# update_load_batch is given the extra keyword argument rngs, a list of the
+# nodes' Generators, when the nodes own one.
+#
+# strategyInfos is a list of currentStrategyInfo, one per node, and
+# stackedStrategyInfo may be of any type. unstack_info must return
+# information that is not changed by later batch updates. The other
+# parameters hold the single node parameters of every node, stacked along
+# a first axis of length numberOfNodes:
+#
+# trafficSent:
+#   An integer array (numberOfNodes, numberOfNetworks)
+#
+# networkResponses:
+#   A dictionary mapping each network response name to a float array
+#   (numberOfNodes, numberOfNetworks)
+#
+# priorityWeights:
+#   A dictionary mapping each priority weight name to a float array
+#   (numberOfNodes,)
+#
+# packetGenerationParameters:
+#   A float array (numberOfNodes, 2)
+#
+# packetDistributions:
+#   A float array (numberOfNodes, numberOfNetworks)
 
 
 ###############################################################################
 #
 # Final learning strategy (need to update optimization)
 #
+# The priors of all networks are kept in one array indexed by
+# [network, metric, prior parameter], using the *_INDEX constants below, and
+# the packet records of all networks in one ring buffer array indexed by
+# [network, record, (packets sent, packets returned)]. final_info_view gives
+# the same information as nested dicts and lists.
+#
 ###############################################################################
+
+# metric indices into the prior array
+COST_INDEX = 0
+SPEED_INDEX = 1
+CAPACITY_INDEX = 2
+RELIABILITY_INDEX = 3
+
+# prior parameter indices into the prior array
+MU_INDEX = 0
+VAR_INDEX = 1
+ALPHA_INDEX = 2
+BETA_INDEX = 3
+
+_METRIC_NAMES = [COST, SPEED, CAPACITY, RELIABILITY]
+_PRIOR_NAMES = [PRIOR_MU, PRIOR_VAR, PRIOR_ALPHA, PRIOR_BETA]
+
+# Incremental load balancing: when every capacity mean, capacity standard
+# deviation and coefficient is within RESOLVE_TOLERANCE (relative) of its
+# value at the last solve, the last solution is used again instead of
+# solving. 0 solves every time. Set it before the nodes are created.
+RESOLVE_TOLERANCE = 0.0
+
+# how the final strategy estimates capacity from its packet record when only
+# some time steps hit capacity, passed to learn_prior: 'grid' or 'mle'
+CAPACITY_METHOD = 'grid'
+
+# the inputs (capacity mean, capacity std, coefficient) and the solution of
+# the last solve, per network. These are solver state, and are left out of
+# final_info_view
+LAST_SOLVE_INPUTS = 'last_solve_inputs'
+LAST_SOLVE_LOAD = 'last_solve_load'
+
+
+
+def _updateCostSpeed(priors,
+                     observed):
+  
+  # NormGamma_update works elementwise, so the cost and speed priors of every
+  # network (and node, for a batch) are updated at once. observed holds the
+  # observed (cost, speed) along its last axis.
+  costSpeed = priors[..., COST_INDEX:SPEED_INDEX + 1, :]
   
+  priors[..., COST_INDEX:SPEED_INDEX + 1, MU_INDEX], \
+  priors[..., COST_INDEX:SPEED_INDEX + 1, VAR_INDEX], \
+  priors[..., COST_INDEX:SPEED_INDEX + 1, ALPHA_INDEX], \
+  priors[..., COST_INDEX:SPEED_INDEX + 1, BETA_INDEX] = \
+      learn_capacity_reliability.NormGamma_update(observed,
+                                                  costSpeed[..., MU_INDEX],
+                                                  costSpeed[..., VAR_INDEX],
+                                                  costSpeed[..., ALPHA_INDEX],
+                                                  costSpeed[..., BETA_INDEX])
+  
+  return priors
+
+
+
+def _observedCostSpeed(networkResponse):
+  
+  return np.array([[response[COST], response[SPEED]]
+                   for response in networkResponse])
+
+
+
+def _learnCapacity(priors,
+                   packetRecord,
+                   currentIteration,
+                   keepPackets,
+                   trafficDistributionParameters):
+  
+  # re-learn the capacity and reliability priors of every network of one
+  # node from its packet record
+  for netNum in range(len(priors)):
+    
+    capacityPrior = priors[netNum, CAPACITY_INDEX]
+    reliabilityPrior = priors[netNum, RELIABILITY_INDEX]
+    
+    with Profile.phase('learn_prior'):
+      capacity_mu,capacity_std,reliability,learn_c = \
+          learn_capacity_reliability.learn_prior(packetRecord[netNum].tolist(),
+                                 trafficDistributionParameters[0],
+                                 trafficDistributionParameters[1],
+                                 method=CAPACITY_METHOD)
+    
+    if currentIteration == keepPackets:
+      
+      capacityPrior[MU_INDEX] = capacity_mu
+      capacityPrior[VAR_INDEX] = 2.0
+      capacityPrior[ALPHA_INDEX] = 2.0
+      capacityPrior[BETA_INDEX] = (capacity_std**2) * capacityPrior[ALPHA_INDEX]
+      reliabilityPrior[MU_INDEX] = reliability
+      
+    else:
+      reliability_mem = reliabilityPrior[MU_INDEX]
+      reliabilityPrior[MU_INDEX] = (reliability+reliability_mem)/2
+      if learn_c:
+        capacityPrior[:] = \
+              learn_capacity_reliability.NormGamma_update(capacity_mu,
+                               capacityPrior[MU_INDEX],
+                               capacityPrior[VAR_INDEX],
+                               capacityPrior[ALPHA_INDEX],
+                               capacityPrior[BETA_INDEX])
+  
+  return priors
+
+
+
+def _optimizationInputs(priors,
+                        weights):
+  
+  # capacity means, capacity standard deviations and coefficients for
+  # optimize.solve_opt. For a batch, weights hold (numberOfNodes, 1) arrays.
+  capacityMeans = priors[..., CAPACITY_INDEX, MU_INDEX]
+  capacityStdDevs = np.sqrt(priors[..., CAPACITY_INDEX, BETA_INDEX] / \
+                            priors[..., CAPACITY_INDEX, ALPHA_INDEX])
+  coefficients = (priors[..., COST_INDEX, MU_INDEX]*weights[COST] + \
+                  priors[..., SPEED_INDEX, MU_INDEX]*weights[SPEED] + \
+                  weights[PACKETS_RETURNED]) * \
+                 priors[..., RELIABILITY_INDEX, MU_INDEX]
+  
+  return capacityMeans, capacityStdDevs, coefficients
+
 
-def final_initial_info(numNetworks,
-                       priorityWeights):
 
-  prior_vals = {PRIOR_MU: 1.0,
-                PRIOR_VAR: 0.1,
-                PRIOR_ALPHA: 1.0,
-                PRIOR_BETA: 1.0}
+def _needsSolve(lastInputs,
+                lastLoad,
+                inputs):
   
-  prior_capacity = {PRIOR_MU: 0,
-                    PRIOR_VAR: 0,
-                    PRIOR_ALPHA: 0,
-                    PRIOR_BETA: 0}
+  # whether the inputs have moved more than RESOLVE_TOLERANCE since the last
+  # solve (or nothing has been solved yet). For a batch, there is one answer
+  # per node.
+  unchanged = np.abs(inputs - lastInputs) <= RESOLVE_TOLERANCE * np.abs(lastInputs)
+  return (RESOLVE_TOLERANCE <= 0) | \
+         (np.sum(lastLoad, axis=-1) <= 0) | \
+         ~np.all(unchanged, axis=(-2, -1))
 
-  prior_reliability = {PRIOR_MU: 0}
 
-  prior_vars = {COST: deepcopy(prior_vals),
-                SPEED: deepcopy(prior_vals),
-                CAPACITY: deepcopy(prior_capacity),
-                RELIABILITY: deepcopy(prior_reliability)}
+
+def final_initial_info(numNetworks,
+                       priorityWeights):
+  
+  # cost and speed start from mu = 1, var = 0.1, alpha = 1, beta = 1,
+  # capacity and reliability from zeros
+  priors = np.zeros((numNetworks, len(_METRIC_NAMES), len(_PRIOR_NAMES)))
+  priors[:, COST_INDEX:SPEED_INDEX + 1, :] = [1.0, 0.1, 1.0, 1.0]
   
   #keep_number_of_packets = max(5*numNetworks,10)
   keep_number_of_packets = 10
   
   current_iteration = 0
   
-  packet_record = [[] for i in range(keep_number_of_packets)]
+  packet_record = np.zeros((numNetworks, keep_number_of_packets, 2),
+                           dtype=np.int64)
   
-  return {PRIOR_VALUES: [deepcopy(prior_vars) for i in range(numNetworks)],
-          'packet_record': [deepcopy(packet_record) for i in range(numNetworks)],
+  return {PRIOR_VALUES: priors,
+          'packet_record': packet_record,
           'keep_packets': keep_number_of_packets,
-          'current_iteration': current_iteration}
+          'current_iteration': current_iteration,
+          LAST_SOLVE_INPUTS: np.zeros((numNetworks, 3)),
+          LAST_SOLVE_LOAD: np.zeros(numNetworks)}
+
+
+
+def _exploreLoad(numNetworks,
+                 rng=None):
+  
+  # a random load balance, used while the packet record fills up
+  if rng is None:
+    i = random.randint(low = 0, high = numNetworks)
+    p = random.uniform(0,1)
+  else:
+    i = rng.integers(low = 0, high = numNetworks)
+    p = rng.uniform(0,1)
+  
+  if p < 0.5 or numNetworks == 1:
+    exploreLoad = [0] * numNetworks
+    exploreLoad[i] = 1
+  else:
+    exploreLoad = [0.4/(numNetworks-1)] * numNetworks
+    exploreLoad[i] = 0.6
+  
+  return exploreLoad
 
 
 
@@ -149,76 +366,21 @@ def final_update_info(currentStrategyInfo,
   
   currentStrategyInfo['current_iteration'] += 1
   
-  for netNum in range(len(networkResponse)):
-    
-    currentStrategyInfo['packet_record'][netNum][changePacket] = \
-        [trafficSentToNetwork[netNum], networkResponse[netNum][PACKETS_RETURNED]]
-    
-    currentPacketRecord = currentStrategyInfo['packet_record'][netNum]
-    
-    observedCost = networkResponse[netNum][COST]
-    observedSpeed = networkResponse[netNum][SPEED]
-    
-    cost_mu, cost_v, cost_a, cost_b = \
-        learn_capacity_reliability.NormGamma_update(observedCost,
-                         currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_MU],
-                         currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_VAR],
-                         currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_ALPHA],
-                         currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_BETA])
-    
-    currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_MU] = cost_mu
-    currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_VAR] = cost_v
-    currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_ALPHA] = cost_a
-    currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_BETA] = cost_b
-    
-    
-    speed_mu, speed_v, speed_a, speed_b = \
-        learn_capacity_reliability.NormGamma_update(observedSpeed,
-                         currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_MU],
-                         currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_VAR],
-                         currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_ALPHA],
-                         currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_BETA])
-    
-    currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_MU] = speed_mu
-    currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_VAR] = speed_v
-    currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_ALPHA] = speed_a
-    currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_BETA] = speed_b
-    
-    if currentStrategyInfo['current_iteration'] % currentStrategyInfo['keep_packets'] == 0:
-      if currentStrategyInfo['current_iteration'] == currentStrategyInfo['keep_packets']:
-        
-        capacity_mu,capacity_std,reliability,learn_c = \
-            learn_capacity_reliability.learn_prior(currentPacketRecord,
-                                 trafficDistributionParameters[0],
-                                 trafficDistributionParameters[1])
-        
-        currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_MU] = capacity_mu
-        currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_VAR] = 2.0
-        currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_ALPHA] = 2.0
-        currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_BETA] = \
-          (capacity_std**2) * currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_ALPHA]
-        currentStrategyInfo[PRIOR_VALUES][netNum][RELIABILITY][PRIOR_MU] = reliability
-        
-      else:
-        capacity_mu,capacity_std,reliability,learn_c = \
-            learn_capacity_reliability.learn_prior(currentPacketRecord,
-                                 trafficDistributionParameters[0],
-                                 trafficDistributionParameters[1])
-
-        reliability_mem = currentStrategyInfo[PRIOR_VALUES][netNum][RELIABILITY][PRIOR_MU]
-        currentStrategyInfo[PRIOR_VALUES][netNum][RELIABILITY][PRIOR_MU] = (reliability+reliability_mem)/2
-        if learn_c:
-          prior_mu, prior_v, prior_a, prior_b = \
-                learn_capacity_reliability.NormGamma_update(capacity_mu,
-                                 currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_MU],
-                                 currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_VAR],
-                                 currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_ALPHA],
-                                 currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_BETA])
-            
-          currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_MU] = prior_mu
-          currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_VAR] = prior_v
-          currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_ALPHA] = prior_a
-          currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_BETA] = prior_b 
+  priors = currentStrategyInfo[PRIOR_VALUES]
+  packetRecord = currentStrategyInfo['packet_record']
+  
+  packetRecord[:, changePacket, 0] = trafficSentToNetwork
+  packetRecord[:, changePacket, 1] = [response[PACKETS_RETURNED]
+                                      for response in networkResponse]
+  
+  _updateCostSpeed(priors, _observedCostSpeed(networkResponse))
+  
+  if currentStrategyInfo['current_iteration'] % currentStrategyInfo['keep_packets'] == 0:
+    _learnCapacity(priors,
+                   packetRecord,
+                   currentStrategyInfo['current_iteration'],
+                   currentStrategyInfo['keep_packets'],
+                   trafficDistributionParameters)
 
   return currentStrategyInfo
 
@@ -229,46 +391,39 @@ def final_update_load(currentStrategyInfo,
                          numNetworks,
                          weights,
                          oldLoad,
-                         trafficDistributionParameters):
-  capacityMeans = []
-  capacityStdDevs = []
-  coefficients = []
+                         trafficDistributionParameters,
+                         rng=None):
 
   if currentStrategyInfo['current_iteration'] < currentStrategyInfo['keep_packets']:
-    i = random.randint(low = 0, high = numNetworks)
-    p = random.uniform(0,1)
-    if p < 0.5 or numNetworks == 1:
-      updatedLoad = [0] * numNetworks
-      updatedLoad[i] = 1
-    else:
-      updatedLoad = [0.4/(numNetworks-1)] * numNetworks
-      updatedLoad[i] = 0.6     
+    updatedLoad = _exploreLoad(numNetworks, rng)
 
   elif currentStrategyInfo['current_iteration'] % currentStrategyInfo['keep_packets'] == 0:
 
-    for netNum in range(numNetworks):
-      capacityAlpha = currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_ALPHA]
-      capacityBeta = currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_BETA]
-      costMean = currentStrategyInfo[PRIOR_VALUES][netNum][COST][PRIOR_MU]
-      speedMean = currentStrategyInfo[PRIOR_VALUES][netNum][SPEED][PRIOR_MU]
-      
-      capacityMeans.append(currentStrategyInfo[PRIOR_VALUES][netNum][CAPACITY][PRIOR_MU])
-      capacityStdDevs.append(math.sqrt(capacityBeta / capacityAlpha))
-      coefficients.append((costMean*weights[COST] + \
-                          speedMean*weights[SPEED] + \
-                          weights[PACKETS_RETURNED]) * \
-                          currentStrategyInfo[PRIOR_VALUES][netNum][RELIABILITY][PRIOR_MU])
+    capacityMeans, capacityStdDevs, coefficients = \
+        _optimizationInputs(currentStrategyInfo[PRIOR_VALUES], weights)
+    inputs = np.stack([capacityMeans, capacityStdDevs, coefficients], axis=-1)
     
     #print(capacityMeans,capacityStdDevs,reliability)
 
-    newLoad = optimize.solve_opt(capacityMeans,
-                                 capacityStdDevs,
-                                 coefficients,
-                                 trafficDistributionParameters[0] + \
-                                 trafficDistributionParameters[1])
-    
-    newLoadSum = sum(newLoad)
-    newLoad = [x/newLoadSum for x in newLoad]
+    if _needsSolve(currentStrategyInfo[LAST_SOLVE_INPUTS],
+                   currentStrategyInfo[LAST_SOLVE_LOAD],
+                   inputs):
+      # the current load is usually close to the solution
+      with Profile.phase('solve_opt'):
+        newLoad = optimize.solve_opt(capacityMeans.tolist(),
+                                     capacityStdDevs.tolist(),
+                                     coefficients.tolist(),
+                                     trafficDistributionParameters[0] + \
+                                     trafficDistributionParameters[1],
+                                     init_point=list(oldLoad))
+      
+      newLoadSum = sum(newLoad)
+      newLoad = [x/newLoadSum for x in newLoad]
+      
+      currentStrategyInfo[LAST_SOLVE_INPUTS] = inputs
+      currentStrategyInfo[LAST_SOLVE_LOAD] = np.array(newLoad)
+    else:
+      newLoad = currentStrategyInfo[LAST_SOLVE_LOAD].tolist()
     
     updatedLoad = []
     for index in range(len(newLoad)):
@@ -279,3 +434,286 @@ def final_update_load(currentStrategyInfo,
 
   return updatedLoad
 
+
+
+def final_info_view(currentStrategyInfo):
+  
+  priorView = []
+  for networkPriors in currentStrategyInfo[PRIOR_VALUES].tolist():
+    networkView = {}
+    for metric, metricPriors in zip(_METRIC_NAMES, networkPriors):
+      networkView[metric] = dict(zip(_PRIOR_NAMES, metricPriors))
+    # only the mean of the reliability is used
+    networkView[RELIABILITY] = {PRIOR_MU: networkView[RELIABILITY][PRIOR_MU]}
+    priorView.append(networkView)
+  
+  view = {}
+  for entry in currentStrategyInfo:
+    if entry in (LAST_SOLVE_INPUTS, LAST_SOLVE_LOAD):
+      continue
+    if isinstance(currentStrategyInfo[entry], np.ndarray):
+      view[entry] = currentStrategyInfo[entry].tolist()
+    else:
+      view[entry] = currentStrategyInfo[entry]
+  view[PRIOR_VALUES] = priorView
+  
+  if 'packet_record' in currentStrategyInfo:
+    # records that have not been written yet are empty
+    filled = min(currentStrategyInfo['current_iteration'],
+                 currentStrategyInfo['keep_packets'])
+    view['packet_record'] = []
+    for networkRecord in currentStrategyInfo['packet_record'].tolist():
+      view['packet_record'].append(networkRecord[:filled] + \
+                                   [[] for i in range(len(networkRecord) - filled)])
+  
+  return view
+
+
+
+def final_stack_info(strategyInfos):
+  
+  return {PRIOR_VALUES: np.stack([info[PRIOR_VALUES] for info in strategyInfos]),
+          'packet_record': np.stack([info['packet_record'] for info in strategyInfos]),
+          'keep_packets': strategyInfos[0]['keep_packets'],
+          'current_iteration': np.array([info['current_iteration']
+                                         for info in strategyInfos]),
+          LAST_SOLVE_INPUTS: np.stack([info[LAST_SOLVE_INPUTS] for info in strategyInfos]),
+          LAST_SOLVE_LOAD: np.stack([info[LAST_SOLVE_LOAD] for info in strategyInfos])}
+
+
+
+def final_unstack_info(stackedInfo):
+  
+  strategyInfos = []
+  for nodeNum in range(len(stackedInfo['current_iteration'])):
+    strategyInfos.append(
+        {PRIOR_VALUES: stackedInfo[PRIOR_VALUES][nodeNum].copy(),
+         'packet_record': stackedInfo['packet_record'][nodeNum].copy(),
+         'keep_packets': stackedInfo['keep_packets'],
+         'current_iteration': int(stackedInfo['current_iteration'][nodeNum]),
+         LAST_SOLVE_INPUTS: stackedInfo[LAST_SOLVE_INPUTS][nodeNum].copy(),
+         LAST_SOLVE_LOAD: stackedInfo[LAST_SOLVE_LOAD][nodeNum].copy()})
+  
+  return strategyInfos
+
+
+
+def final_update_info_batch(stackedInfo,
+                            trafficSent,
+                            networkResponses,
+                            weights,
+                            trafficDistributionParameters):
+  
+  keepPackets = stackedInfo['keep_packets']
+  changePacket = stackedInfo['current_iteration'] % keepPackets
+  
+  stackedInfo['current_iteration'] += 1
+  
+  priors = stackedInfo[PRIOR_VALUES]
+  packetRecord = stackedInfo['packet_record']
+  nodeNums = np.arange(len(changePacket))
+  
+  packetRecord[nodeNums, :, changePacket, 0] = trafficSent
+  packetRecord[nodeNums, :, changePacket, 1] = networkResponses[PACKETS_RETURNED]
+  
+  _updateCostSpeed(priors, np.stack([networkResponses[COST],
+                                     networkResponses[SPEED]], axis=-1))
+  
+  # learn_prior works on one packet record at a time
+  for nodeNum in np.flatnonzero(stackedInfo['current_iteration'] % keepPackets == 0):
+    _learnCapacity(priors[nodeNum],
+                   packetRecord[nodeNum],
+                   stackedInfo['current_iteration'][nodeNum],
+                   keepPackets,
+                   trafficDistributionParameters[nodeNum])
+  
+  return stackedInfo
+
+
+
+def final_update_load_batch(stackedInfo,
+                            numNetworks,
+                            weights,
+                            oldLoads,
+                            trafficDistributionParameters,
+                            rngs=None):
+  
+  currentIteration = stackedInfo['current_iteration']
+  keepPackets = stackedInfo['keep_packets']
+  updatedLoads = np.array(oldLoads, dtype=float)
+  
+  # same random loads as final_update_load
+  explore = np.flatnonzero(currentIteration < keepPackets)
+  if rngs is not None:
+    # each node draws from its own generator
+    for nodeNum in explore:
+      updatedLoads[nodeNum] = _exploreLoad(numNetworks, rngs[nodeNum])
+  elif len(explore) > 0:
+    i = random.randint(low = 0, high = numNetworks, size = len(explore))
+    p = random.uniform(0, 1, size = len(explore))
+    if numNetworks == 1:
+      p[:] = 0
+    updatedLoads[explore] = np.where((p < 0.5)[:, None],
+                                     0,
+                                     0.4/max(numNetworks-1, 1))
+    updatedLoads[explore, i] = np.where(p < 0.5, 1, 0.6)
+  
+  resolve = np.flatnonzero((currentIteration >= keepPackets) & \
+                             (currentIteration % keepPackets == 0))
+  if len(resolve) > 0:
+    capacityMeans, capacityStdDevs, coefficients = \
+        _optimizationInputs(stackedInfo[PRIOR_VALUES][resolve],
+                            {name: weights[name][resolve, None]
+                             for name in weights})
+    inputs = np.stack([capacityMeans, capacityStdDevs, coefficients], axis=-1)
+    
+    solve = _needsSolve(stackedInfo[LAST_SOLVE_INPUTS][resolve],
+                        stackedInfo[LAST_SOLVE_LOAD][resolve],
+                        inputs)
+    solveNodes = resolve[solve]
+    if len(solveNodes) > 0:
+      # the current loads are usually close to the solutions
+      with Profile.phase('solve_opt'):
+        newLoads = optimize.solve_opt_batch(capacityMeans[solve],
+                                            capacityStdDevs[solve],
+                                            coefficients[solve],
+                                            trafficDistributionParameters[solveNodes, 0] + \
+                                            trafficDistributionParameters[solveNodes, 1],
+                                            updatedLoads[solveNodes])
+      newLoads /= np.sum(newLoads, axis=1)[:, None]
+      
+      stackedInfo[LAST_SOLVE_INPUTS][solveNodes] = inputs[solve]
+      stackedInfo[LAST_SOLVE_LOAD][solveNodes] = newLoads
+    
+    updatedLoads[resolve] = (stackedInfo[LAST_SOLVE_LOAD][resolve] + \
+                             updatedLoads[resolve]) / 2
+  
+  return updatedLoads
+
+
+
+###############################################################################
+#
+# Online learning strategy
+#
+# Same priors and load balancing as the final strategy, but capacity and
+# reliability are learned from each observation as it comes in instead of
+# being re-estimated from a window of packet records every keep_packets
+# steps, so every step costs the same.
+#
+###############################################################################
+
+
+def online_initial_info(numNetworks,
+                        priorityWeights):
+  
+  initialInfo = final_initial_info(numNetworks,
+                                   priorityWeights)
+  
+  # nothing is re-learned from the packet record, reliability is learned from
+  # running totals of the time steps below capacity, and the best share of
+  # packets returned in any time step, instead
+  del initialInfo['packet_record']
+  initialInfo['packets_sent'] = np.zeros(numNetworks, dtype=np.int64)
+  initialInfo['packets_returned'] = np.zeros(numNetworks, dtype=np.int64)
+  initialInfo['best_return_ratio'] = np.zeros(numNetworks)
+  
+  return initialInfo
+
+
+
+def online_initial_load_balance(initialInfo,
+                                numNetworks,
+                                weights):
+  
+  return final_initial_load_balance(initialInfo,
+                                    numNetworks,
+                                    weights)
+
+
+
+def online_update_info(currentStrategyInfo,
+                       trafficSentToNetwork,
+                       networkResponse,
+                       weights,
+                       trafficDistributionParameters):
+  
+  currentStrategyInfo['current_iteration'] += 1
+  
+  priors = currentStrategyInfo[PRIOR_VALUES]
+  
+  _updateCostSpeed(priors, _observedCostSpeed(networkResponse))
+  
+  for netNum in range(len(networkResponse)):
+    
+    capacityPrior = priors[netNum, CAPACITY_INDEX]
+    reliabilityPrior = priors[netNum, RELIABILITY_INDEX]
+    
+    packetsSent = trafficSentToNetwork[netNum]
+    packetsReturned = networkResponse[netNum][PACKETS_RETURNED]
+    
+    # learn_prior ignores these observations too
+    if packetsSent == 0 or packetsReturned == 0:
+      continue
+    
+    # Start from the capacity learn_prior guesses when it has seen nothing
+    # hit capacity, with the prior strength the final strategy uses
+    if capacityPrior[ALPHA_INDEX] == 0:
+      capacityPrior[MU_INDEX] = trafficDistributionParameters[0] + \
+                                2 * trafficDistributionParameters[1]
+      capacityPrior[VAR_INDEX] = 2.0
+      capacityPrior[ALPHA_INDEX] = 2.0
+      capacityPrior[BETA_INDEX] = (5**2) * capacityPrior[ALPHA_INDEX]
+    
+    # Time steps that hit capacity return fewer packets than reliability
+    # alone would, so only pool the ones the capacity prior puts well below
+    # capacity. A single one's share of returned packets depends on how the
+    # network picked among all nodes' packets, which pooling evens out.
+    # Until there are any, take the best share returned in any time step,
+    # like learn_prior does.
+    bestRatio = currentStrategyInfo['best_return_ratio']
+    bestRatio[netNum] = max(bestRatio[netNum], packetsReturned / packetsSent)
+    
+    capacityStd = np.sqrt(capacityPrior[BETA_INDEX] / capacityPrior[ALPHA_INDEX])
+    if packetsSent < capacityPrior[MU_INDEX] - 2 * capacityStd:
+      currentStrategyInfo['packets_sent'][netNum] += packetsSent
+      currentStrategyInfo['packets_returned'][netNum] += packetsReturned
+    
+    if currentStrategyInfo['packets_sent'][netNum] > 0:
+      reliabilityPrior[MU_INDEX] = currentStrategyInfo['packets_returned'][netNum] / \
+                                   currentStrategyInfo['packets_sent'][netNum]
+    else:
+      reliabilityPrior[MU_INDEX] = bestRatio[netNum]
+    
+    capacityPrior[:] = \
+        learn_capacity_reliability.online_update([packetsSent, packetsReturned],
+                                                 reliabilityPrior[MU_INDEX],
+                                                 capacityPrior[MU_INDEX],
+                                                 capacityPrior[VAR_INDEX],
+                                                 capacityPrior[ALPHA_INDEX],
+                                                 capacityPrior[BETA_INDEX])
+  
+  return currentStrategyInfo
+
+
+
+def online_update_load(currentStrategyInfo,
+                       numNetworks,
+                       weights,
+                       oldLoad,
+                       trafficDistributionParameters,
+                       rng=None):
+  
+  return final_update_load(currentStrategyInfo,
+                           numNetworks,
+                           weights,
+                           oldLoad,
+                           trafficDistributionParameters,
+                           rng)
+
+
+
+def online_info_view(currentStrategyInfo):
+  
+  return final_info_view(currentStrategyInfo)
+
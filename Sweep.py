@@ -0,0 +1,288 @@
+import os
+import argparse
+import configparser
+import itertools
+from fnmatch import fnmatchcase
+import numpy as np
+import Ensemble
+import ParseFile
+
+# Runs a base configuration over a grid of parameter values.
+#
+# A sweep is a base configuration plus axes. An axis names a configuration
+# option as 'section.option', where section may be a shell-style pattern
+# matching several sections (e.g. 'node_*.weights' or
+# 'network_2.metricParameters'), and lists the values it takes. The points of
+# the sweep are either every combination of axis values or a number of
+# randomly sampled combinations.
+#
+# Every point is run as an ensemble (see Ensemble.py), all in one process
+# pool whose workers stay up for the whole sweep, and with the same
+# replication seeds for every point. Each point's result is tagged with the
+# axis values of the point.
+#
+# A sweep can be written as a file in the configuration file format:
+#
+#   [sweep]
+#   config = example.conf
+#   timeSteps = 100
+#   replications = 10
+#   seed = 1
+#   samples = 20
+#
+#   [node_*.weights]
+#   values = [[1, 1, 1], [2, 1, 1], [1, 2, 1]]
+#
+#   [network_2.metricParameters]
+#   values = ['[(92,12), (0.88,0.0), (2, 0.03), (2,0.07)]',
+#             '[(120,12), (0.88,0.0), (2, 0.03), (2,0.07)]']
+#
+# config is relative to the directory of the sweep file. seed and samples
+# are optional, and every point is run when samples is left out. Axis values
+# are Python literals, and are written into the configuration as they would
+# be printed, or as is for strings.
+
+SWEEP = 'sweep'
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+def _optionValue(value):
+
+  if isinstance(value, str):
+    return value
+  return str(value)
+
+
+
+def _splitAxis(axis):
+
+  section, option = axis.rsplit('.', 1)
+  # configparser option names are lower case
+  return section, option.lower()
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def gridPoints(axes):
+  """
+    Returns every combination of the axis values, as a list of dictionaries
+    mapping each axis to a value. axes maps each axis to a list of values.
+  """
+
+  names = list(axes)
+  return [dict(zip(names, values))
+          for values in itertools.product(*[axes[name] for name in names])]
+
+
+
+def samplePoints(axes,
+                 samples,
+                 rng):
+  """
+    Returns samples combinations of axis values, each value drawn uniformly
+    from its axis with the numpy Generator rng.
+  """
+
+  points = []
+  for sample in range(samples):
+    points.append({name: axes[name][rng.integers(len(axes[name]))]
+                   for name in axes})
+  return points
+
+
+
+def applyPoint(baseConfig,
+               point):
+  """
+    Returns a copy of baseConfig (as returned by ParseFile.readConfig) with
+    the option of each axis of point set to the point's value in every
+    section the axis matches.
+  """
+
+  config = {section: dict(options) for section, options in baseConfig.items()}
+
+  for axis, value in point.items():
+    sectionPattern, option = _splitAxis(axis)
+    sections = [section for section in config
+                if fnmatchcase(section, sectionPattern)]
+    if len(sections) == 0:
+      raise ValueError("sweep axis '{}' matches no section".format(axis))
+    for section in sections:
+      config[section][option] = _optionValue(value)
+
+  return config
+
+
+
+def runSweep(timeSteps,
+             baseConfig,
+             axes,
+             replications=1,
+             samples=None,
+             seed=None,
+             processes=None,
+             engine='numpy',
+             nodeUpdate='fast',
+             quantiles=(),
+             cacheDirectory=None,
+             cacheBytes=Ensemble.ResultCache.DEFAULT_MAX_BYTES):
+  """
+    Runs an ensemble of replications for every point of the sweep and
+    returns a list with one result per point.
+
+    Input:
+
+      baseConfig:
+        A configuration file name, or a configuration as returned by
+        ParseFile.readConfig
+
+      axes:
+        A dictionary mapping axes ('section.option') to lists of values
+
+      samples:
+        The number of points to sample, or None to run every combination
+
+      seed, processes, engine, nodeUpdate, quantiles, cacheDirectory,
+      cacheBytes:
+        See Ensemble.runEnsemble. The seed also picks the sampled points.
+        With a cache, only the points that changed since an earlier sweep
+        are run again.
+
+    Output:
+
+      A list holding, for each point, the result of Ensemble.runEnsemble
+      with an additional 'point' entry mapping each axis to its value
+  """
+
+  if isinstance(baseConfig, str):
+    baseConfig = ParseFile.readConfig(baseConfig)
+
+  # fix the seed now, so that the points and replications come from it
+  seed = np.random.SeedSequence(seed).entropy
+
+  if samples is None:
+    points = gridPoints(axes)
+  else:
+    points = samplePoints(axes, samples, np.random.default_rng(seed))
+
+  results = Ensemble.runEnsembles(timeSteps,
+                                  [applyPoint(baseConfig, point) for point in points],
+                                  replications,
+                                  seed=seed,
+                                  processes=processes,
+                                  engine=engine,
+                                  nodeUpdate=nodeUpdate,
+                                  quantiles=quantiles,
+                                  cacheDirectory=cacheDirectory,
+                                  cacheBytes=cacheBytes)
+
+  for result, point in zip(results, points):
+    result['point'] = point
+
+  return results
+
+
+
+def readSweep(fileName):
+  """
+    Reads a sweep file and returns a dictionary with the keyword arguments
+    of runSweep. The base configuration file is looked up relative to the
+    sweep file.
+  """
+
+  sweepConfig = configparser.ConfigParser()
+  sweepConfig.read(fileName)
+
+  settings = sweepConfig[SWEEP]
+  sweep = {'timeSteps': settings.getint('timeSteps'),
+           'baseConfig': os.path.join(os.path.dirname(fileName),
+                                      settings['config']),
+           'axes': {},
+           'replications': settings.getint('replications', 1)}
+  if 'seed' in settings:
+    sweep['seed'] = settings.getint('seed')
+  if 'samples' in settings:
+    sweep['samples'] = settings.getint('samples')
+
+  for section in sweepConfig.sections():
+    if section != SWEEP:
+      sweep['axes'][section] = eval(sweepConfig[section]['values'])
+
+  return sweep
+
+
+
+def saveSweep(results,
+              outFile):
+  """
+    Saves the results of runSweep to a NumPy .npz file. 'axes' holds the
+    axis names and 'points' the value of every axis at every point (as
+    strings), and the statistics are stacked along a first axis of points,
+    under names such as 'traffic_response-mean'.
+  """
+
+  axes = list(results[0]['point'])
+  arrays = {'seed': np.array(str(results[0]['seed'])),
+            'replications': np.array(results[0]['replications']),
+            'nodes': np.array(results[0]['nodes']),
+            'networks': np.array(results[0]['networks']),
+            'axes': np.array(axes),
+            'points': np.array([[_optionValue(result['point'][axis])
+                                 for axis in axes]
+                                for result in results])}
+  for name in Ensemble.RECORDED:
+    for statistic in results[0][name]:
+      arrays['{}-{}'.format(name, statistic)] = \
+          np.stack([result[name][statistic] for result in results])
+
+  np.savez(outFile, **arrays)
+
+###############################################################################
+###############################################################################
+
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(
+      description='Run a parameter sweep and save per time step statistics '
+                  'for every point to a .npz file')
+  parser.add_argument('sweepFile')
+  parser.add_argument('outFile')
+  parser.add_argument('--processes', type=int, default=None,
+                      help='worker processes (default: number of CPUs)')
+  parser.add_argument('--engine', choices=sorted(Ensemble.ENGINES),
+                      default='numpy')
+  parser.add_argument('--quantiles', type=float, nargs='+', default=[],
+                      help='also save these quantiles across replications, '
+                           'which keeps every replication of a point in '
+                           'memory (default: none)')
+  parser.add_argument('--cache-dir', default=None,
+                      help='reuse results of seeded points stored in this '
+                           'directory (default: no cache)')
+  parser.add_argument('--cache-size', type=int, default=1024, metavar='MB',
+                      help='size limit of the cache (default: 1024)')
+  args = parser.parse_args()
+
+  results = runSweep(processes=args.processes,
+                     engine=args.engine,
+                     quantiles=args.quantiles,
+                     cacheDirectory=args.cache_dir,
+                     cacheBytes=args.cache_size * 2**20,
+                     **readSweep(args.sweepFile))
+  saveSweep(results, args.outFile)
+  print('seed: {}'.format(results[0]['seed']))
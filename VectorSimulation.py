@@ -0,0 +1,613 @@
+import random
+import numpy as np
+from copy import deepcopy
+import BinaryOutput
+import Metrics
+import Network
+import Profile
+import SourceNode
+import Simulation
+import Strategies
+
+# A drop-in alternative to Simulation.executeSimulation.
+#
+# The state of the whole simulation is kept as NumPy arrays indexed by
+# [node, network], so that a time step is advanced with a handful of array
+# operations instead of a Python loop per node and per network:
+#
+#   loadBalances      float (numNodes, numNetworks)
+#   packetParameters  float (numNodes, 2), gaussian mean and standard deviation
+#   traffic           int   (numNodes, numNetworks), packets sent this step
+#   responses         int   (numNodes, numNetworks), packets returned this step
+#
+# Network parameters are sampled for every network at once for metrics that
+# have a vectorized counterpart (see _VECTORIZED_METRICS). Any other metric
+# function is still called through Network.generateNetworkResponse, so custom
+# metrics keep working, just without the speedup.
+#
+# Nodes whose strategy has the batch interface described in Strategies.py
+# are updated with one call per strategy, on stacked strategy information
+# that is kept for the whole run, and their node dictionaries are never
+# rebuilt. stepCallback is given the load balance array, and the text output
+# a copy of the stacked information, which the writer thread unstacks. Nodes
+# of any other strategy go through SourceNode.updateNodeStrategy one at a
+# time.
+#
+# When the nodes and networks own numpy Generators (ParseFile.parseInput with
+# a seed), each of them draws from its own generator, making exactly the draws
+# it makes in Simulation.executeSimulation, and the two engines give
+# identical results. Nodes then draw their packets, and the uniforms or
+# multinomial sample of their leftover packets, one node at a time, but the
+# traffic is still split with array operations (see _SPLITS).
+
+
+
+###############################################################################
+#
+# Internal Functions
+#
+###############################################################################
+
+
+
+####################################
+#
+# Node traffic
+#
+####################################
+
+def _getPacketParameters(nodes):
+
+  # Gaussian nodes draw through (a copy of) random.Random.gauss
+  gaussianNodes = np.array([getattr(node[SourceNode.DISTRIBUTION][0],
+                                    '__func__', None) is random.Random.gauss
+                            for node in nodes], dtype=bool)
+
+  packetParameters = np.zeros((len(nodes), 2))
+  for index, node in enumerate(nodes):
+    if gaussianNodes[index]:
+      packetParameters[index] = node[SourceNode.DISTRIBUTION][1]
+
+  return gaussianNodes, packetParameters
+
+
+
+def _generatePackets(nodes,
+                     gaussianNodes,
+                     packetParameters,
+                     rng):
+
+  numPackets = np.maximum(np.ceil(rng.normal(packetParameters[:, 0],
+                                             packetParameters[:, 1])), 0)
+  numPackets = numPackets.astype(np.int64)
+
+  # Nodes with a non-gaussian distribution draw their packets one by one
+  for index in np.flatnonzero(~gaussianNodes):
+    numPackets[index] = SourceNode._generatePackets(nodes[index])
+
+  return numPackets
+
+
+
+def _floorTraffic(loadBalances,
+                  numPackets):
+
+  # the whole packets of every node's load balance, and the packets left over
+  traffic = np.floor(loadBalances * numPackets[:, None]).astype(np.int64)
+  return traffic, numPackets - traffic.sum(axis=1)
+
+
+
+def _loadCDF(loadBalances):
+
+  # as SourceNode._createCDF, for every node
+  loadCDF = np.cumsum(loadBalances, axis=1)
+  loadCDF[:, -1] = 1
+  return loadCDF
+
+
+
+def _splitTraffic_sequential(loadBalances,
+                             numPackets,
+                             rng,
+                             streams=None):
+  """
+    Array version of SourceNode._splitTraffic_sequential. Every leftover
+    packet is assigned with its own uniform, drawn from rng, or from the
+    node's own generator in streams, when the nodes have one. Those are the
+    draws the sequential split makes.
+  """
+
+  traffic, leftover = _floorTraffic(loadBalances, numPackets)
+
+  leftoverNodes = np.flatnonzero(leftover > 0)
+  if len(leftoverNodes) == 0:
+    return traffic
+
+  if streams is None:
+    uniforms = rng.uniform(0, 1, int(leftover[leftoverNodes].sum()))
+  else:
+    uniforms = np.concatenate([streams[nodeNum].uniform(0, 1, leftover[nodeNum])
+                               for nodeNum in leftoverNodes])
+  packetNodes = np.repeat(leftoverNodes, leftover[leftoverNodes])
+
+  # A packet goes to the first network whose CDF entry is at least its
+  # uniform. The running maximum keeps that network the same, and makes it
+  # the number of entries below the uniform.
+  loadCDF = np.maximum.accumulate(_loadCDF(loadBalances), axis=1)
+
+  assignments = np.sum(uniforms[:, None] > loadCDF[packetNodes], axis=1)
+  np.add.at(traffic, (packetNodes, assignments), 1)
+
+  return traffic
+
+
+
+def _splitTraffic_multinomial(loadBalances,
+                              numPackets,
+                              rng,
+                              streams=None):
+  """
+    Array version of SourceNode._splitTraffic_multinomial. Without streams,
+    the leftover packets of every node are drawn at once, by
+    SourceNode.getTrafficBatch. Nodes with their own generators each make
+    the single multinomial draw the multinomial split makes.
+  """
+
+  if streams is None:
+    return SourceNode.getTrafficBatch(loadBalances, numPackets, rng)
+
+  traffic, leftover = _floorTraffic(loadBalances, numPackets)
+  loadPMF = SourceNode._loadPMF(_loadCDF(loadBalances))
+
+  for nodeNum in np.flatnonzero(leftover > 0):
+    traffic[nodeNum] += streams[nodeNum].multinomial(leftover[nodeNum],
+                                                     loadPMF[nodeNum])
+
+  return traffic
+
+
+
+_SPLITS = {'sequential': _splitTraffic_sequential,
+           'multinomial': _splitTraffic_multinomial}
+
+
+
+####################################
+#
+# Network responses
+#
+####################################
+
+def _returnTraffic(trafficRecieved,
+                   networkCapacity,
+                   networkReliability,
+                   rng,
+                   rounding=round):
+  """
+    Array version of Metrics._returnTraffic. trafficRecieved is an integer
+    array with one entry per node.
+  """
+
+  totalPackets = int(trafficRecieved.sum())
+
+  carriedThrough = rounding(min(totalPackets, networkCapacity) * \
+                            networkReliability)
+
+  if carriedThrough == 0:
+    return np.zeros(len(trafficRecieved), dtype=np.int64)
+
+  # Works on the per node counts, see Metrics._survivingPackets_hypergeometric
+  return rng.multivariate_hypergeometric(trafficRecieved,
+                                         carriedThrough,
+                                         method='marginals')
+
+
+
+def _testMetric(trafficRecieved,
+                networkParameters,
+                rng):
+  """
+    Array version of Metrics.testMetric.
+
+    Returns (packets returned to each node, parameters reported to the nodes,
+             parameters chosen for the network)
+  """
+
+  paramNames = list(networkParameters)
+  with Profile.phase('metric_sampling'):
+    paramValues = np.maximum(
+        rng.normal([networkParameters[param][0] for param in paramNames],
+                   [networkParameters[param][1] for param in paramNames]),
+        0).tolist()
+
+  # Like testMetric, nodes are reported the unclamped reliability
+  returnedParams = dict(zip(paramNames, paramValues))
+  chosenParams = dict(returnedParams)
+  chosenParams['reliability'] = min(chosenParams['reliability'], 1)
+
+  with Profile.phase('return_traffic'):
+    packetsReturned = _returnTraffic(trafficRecieved,
+                                     chosenParams['capacity'],
+                                     chosenParams['reliability'],
+                                     rng)
+
+  return (packetsReturned, returnedParams, chosenParams)
+
+
+
+_VECTORIZED_METRICS = {Metrics.testMetric: _testMetric}
+
+
+
+def _generateNetworkResponses(networks,
+                              traffic,
+                              rng):
+  """
+    Returns (responses, networkResponses, selectedParams)
+
+    responses is an integer array (numNodes, numNetworks) of returned packets.
+    networkResponses holds, for each network, either a single dict of the
+    parameters reported to every node, or the per node list of response dicts
+    given by a non-vectorized metric function.
+  """
+
+  responses = np.zeros(traffic.shape, dtype=np.int64)
+  networkResponses = []
+  selectedParams = []
+
+  for netNum, network in enumerate(networks):
+    metric = network[Network.MET_FUNC]
+
+    if metric in _VECTORIZED_METRICS:
+      packetsReturned, returnedParams, chosenParams = \
+          _VECTORIZED_METRICS[metric](traffic[:, netNum],
+                                      network[Network.PARAMS],
+                                      network.get(Network.RNG, rng))
+      responses[:, netNum] = packetsReturned
+      networkResponses.append(returnedParams)
+    else:
+      response, chosenParams = \
+          Network.generateNetworkResponse(network,
+                                          traffic[:, netNum].tolist())
+      responses[:, netNum] = [entry['traffic_response'] for entry in response]
+      networkResponses.append(response)
+
+    selectedParams.append(chosenParams)
+
+  return responses, networkResponses, selectedParams
+
+
+
+def _getNodeResponse(nodeNum,
+                     responses,
+                     networkResponses):
+
+  nodeResponse = []
+
+  for netNum, networkResponse in enumerate(networkResponses):
+    if isinstance(networkResponse, dict):
+      response = dict(networkResponse)
+      response['traffic_response'] = int(responses[nodeNum, netNum])
+    else:
+      response = networkResponse[nodeNum]
+    nodeResponse.append(response)
+
+  return nodeResponse
+
+
+
+def _getResponseArrays(nodeNums,
+                       responses,
+                       networkResponses):
+
+  # Network responses of the given nodes as one (nodes, networks) array per
+  # response name
+  responseArrays = {}
+
+  for netNum, networkResponse in enumerate(networkResponses):
+    if isinstance(networkResponse, dict):
+      nodeResponses = [networkResponse]
+    else:
+      nodeResponses = [networkResponse[nodeNum] for nodeNum in nodeNums]
+
+    for name in nodeResponses[0]:
+      if name not in responseArrays:
+        responseArrays[name] = np.zeros((len(nodeNums), len(networkResponses)))
+      responseArrays[name][:, netNum] = [response[name] for response in nodeResponses]
+
+  responseArrays['traffic_response'] = responses[nodeNums]
+
+  return responseArrays
+
+
+
+####################################
+#
+# Batch strategies
+#
+####################################
+
+_BATCH_FUNCTIONS = ['_stack_info',
+                    '_unstack_info',
+                    '_update_info_batch',
+                    '_update_load_batch']
+
+
+
+def _nodeStreams(nodes):
+
+  # the nodes' own generators, or None unless every node has one
+  if all(SourceNode.RNG in node for node in nodes):
+    return [node[SourceNode.RNG] for node in nodes]
+  return None
+
+
+
+def _getBatchStrategies(nodes):
+  """
+    Returns (batchStrategies, singleNodes)
+
+    batchStrategies holds, for each strategy with the batch interface, a
+    dict with its batch functions, the numbers of its nodes, their stacked
+    strategy information, info view, priority weights, packet parameters and
+    own generators (or None).
+    singleNodes holds the numbers of all other nodes.
+  """
+
+  strategyNodes = {}
+  for nodeNum, node in enumerate(nodes):
+    strategyNodes.setdefault(node[SourceNode.STRATEGY], []).append(nodeNum)
+
+  batchStrategies = []
+  singleNodes = []
+
+  for strategy, nodeNums in strategyNodes.items():
+    functions = [getattr(Strategies, strategy + suffix, None)
+                 for suffix in _BATCH_FUNCTIONS]
+
+    if None in functions:
+      singleNodes.extend(nodeNums)
+      continue
+
+    stackInfo, unstackInfo, updateInfo, updateLoad = functions
+    groupNodes = [nodes[nodeNum] for nodeNum in nodeNums]
+
+    batchStrategies.append(
+        {'unstack_info': unstackInfo,
+         'info_view': groupNodes[0][SourceNode.INFO_VIEW],
+         'update_info': updateInfo,
+         'update_load': updateLoad,
+         'nodes': np.array(nodeNums),
+         'info': stackInfo([node[SourceNode.STRATEGY_INFO]
+                            for node in groupNodes]),
+         'weights': {name: np.array([node[SourceNode.WEIGHTS][name]
+                                     for node in groupNodes], dtype=float)
+                     for name in groupNodes[0][SourceNode.WEIGHTS]},
+         'parameters': np.array([node[SourceNode.DISTRIBUTION_PARAMETERS]
+                                 for node in groupNodes], dtype=float),
+         'rngs': _nodeStreams(groupNodes)})
+
+  return batchStrategies, sorted(singleNodes)
+
+
+
+def _updateBatchStrategy(batchStrategy,
+                         numNetworks,
+                         traffic,
+                         responses,
+                         networkResponses,
+                         loadBalances):
+
+  nodeNums = batchStrategy['nodes']
+
+  with Profile.phase('strategy_info'):
+    batchStrategy['info'] = \
+        batchStrategy['update_info'](batchStrategy['info'],
+                                     traffic[nodeNums],
+                                     _getResponseArrays(nodeNums,
+                                                        responses,
+                                                        networkResponses),
+                                     batchStrategy['weights'],
+                                     batchStrategy['parameters'])
+
+  randomOptions = {}
+  if batchStrategy['rngs'] is not None:
+    randomOptions['rngs'] = batchStrategy['rngs']
+
+  with Profile.phase('load_balance'):
+    loadBalances[nodeNums] = \
+        batchStrategy['update_load'](batchStrategy['info'],
+                                     numNetworks,
+                                     batchStrategy['weights'],
+                                     loadBalances[nodeNums],
+                                     batchStrategy['parameters'],
+                                     **randomOptions)
+
+
+
+def _strategyInfos(batchStrategies,
+                   nodes,
+                   singleNodes):
+
+  # The strategy information written for this time step, as a function for
+  # the writer thread (see Simulation._stepRecord). Only the copies of the
+  # stacked information are taken here.
+  stackedInfos = [(batchStrategy['nodes'],
+                   batchStrategy['unstack_info'],
+                   batchStrategy['info_view'],
+                   deepcopy(batchStrategy['info']))
+                  for batchStrategy in batchStrategies]
+  singleInfos = [(nodeNum, SourceNode.getStrategyInfo(nodes[nodeNum]))
+                 for nodeNum in singleNodes]
+
+  def strategyInfos():
+    infos = [None] * len(nodes)
+    for nodeNums, unstackInfo, infoView, stackedInfo in stackedInfos:
+      for nodeNum, strategyInfo in zip(nodeNums, unstackInfo(stackedInfo)):
+        infos[nodeNum] = infoView(strategyInfo)
+    for nodeNum, strategyInfo in singleInfos:
+      infos[nodeNum] = strategyInfo
+    return infos
+
+  return strategyInfos
+
+###############################################################################
+###############################################################################
+
+
+###############################################################################
+#
+# Forward-facing Functions
+#
+###############################################################################
+
+def executeSimulation(timeSteps,
+                      nodes,
+                      networks,
+                      outFile,
+                      nodeUpdate='safe',
+                      stepCallback=None,
+                      outFormat='text',
+                      writeIndex=False,
+                      writeBuffer=Simulation.DEFAULT_WRITE_BUFFER,
+                      split='sequential',
+                      rng=None):
+  """
+    Runs the simulation with the vectorized engine. Takes the same arguments,
+    in the same order, and writes the same output formats as
+    Simulation.executeSimulation. outFile may be None to write no output.
+    stepCallback is called the same way, but with arrays (nodes x networks)
+    instead of nested lists, which it may keep.
+
+    Input:
+
+      nodeUpdate:
+        Passed to SourceNode.updateNodeStrategy. With 'fast' the given nodes
+        are updated in place instead of being copied on every time step.
+        Nodes of batch strategies are never updated: their state is only
+        kept in arrays.
+
+      split:
+        'sequential' or 'multinomial', as for Simulation.executeSimulation.
+        Without generators of their own, all nodes draw the uniforms of the
+        sequential split, or the multinomial samples, at once from rng.
+
+      rng:
+        A numpy Generator used for every random draw of the engine. A new,
+        unseeded generator is created if none is given. Nodes and networks
+        with their own generators draw from those instead.
+
+    The time steps and their phases are timed by Profile, when it is
+    enabled, with the same phases as Simulation.executeSimulation.
+  """
+
+  if outFormat not in Simulation.OUTPUT_FORMATS:
+    raise ValueError("unknown output format '{}'".format(outFormat))
+
+  if split not in _SPLITS:
+    raise ValueError("unknown traffic split '{}'".format(split))
+
+  if rng is None:
+    rng = np.random.default_rng()
+
+  output = None
+  if outFile is not None and outFormat == 'text':
+    output = Simulation._startWriter(outFile,
+                                     nodes,
+                                     networks,
+                                     writeBuffer,
+                                     Simulation._clearIndex(outFile, writeIndex))
+  elif outFile is not None:
+    output = BinaryOutput.openOutput(outFile, timeSteps, nodes, networks)
+
+  numNetworks = len(networks)
+
+  gaussianNodes, packetParameters = _getPacketParameters(nodes)
+  loadBalances = np.array([node[SourceNode.CURRENT_LOAD_BALANCE]
+                           for node in nodes], dtype=float)
+  batchStrategies, singleNodes = _getBatchStrategies(nodes)
+  streams = _nodeStreams(nodes)
+  weights = [node[SourceNode.WEIGHTS] for node in nodes]
+  textOutput = outFile is not None and outFormat == 'text'
+
+  # only the nodes of other strategies are replaced, in a list of our own
+  nodes = list(nodes)
+
+  # the output is closed however the run ends, see Simulation._closeOutput
+  completed = False
+  try:
+    for step in range(timeSteps):
+
+      Profile.startStep()
+
+      with Profile.phase('traffic'):
+        if streams is not None:
+          numPackets = np.array([SourceNode._generatePackets(node)
+                                 for node in nodes], dtype=np.int64)
+        else:
+          numPackets = _generatePackets(nodes,
+                                        gaussianNodes,
+                                        packetParameters,
+                                        rng)
+        traffic = _SPLITS[split](loadBalances, numPackets, rng, streams)
+
+      with Profile.phase('network_response'):
+        responses, networkResponses, selectedParams = \
+            _generateNetworkResponses(networks, traffic, rng)
+
+      allTraffic = traffic.tolist()
+
+      with Profile.phase('strategy_update'):
+        for batchStrategy in batchStrategies:
+          _updateBatchStrategy(batchStrategy,
+                               numNetworks,
+                               traffic,
+                               responses,
+                               networkResponses,
+                               loadBalances)
+
+        for nodeNum in singleNodes:
+          newNode = SourceNode.updateNodeStrategy(nodes[nodeNum],
+                                                  numNetworks,
+                                                  allTraffic[nodeNum],
+                                                  _getNodeResponse(nodeNum,
+                                                                   responses,
+                                                                   networkResponses),
+                                                  nodeUpdate)
+          loadBalances[nodeNum] = newNode[SourceNode.CURRENT_LOAD_BALANCE]
+          nodes[nodeNum] = newNode
+
+      if stepCallback is not None:
+        with Profile.phase('callback'):
+          stepCallback(step, loadBalances.copy(), traffic, responses)
+
+      if outFile is not None and outFormat == 'binary':
+        with Profile.phase('write_data'):
+          BinaryOutput.writeStep(output,
+                                 traffic,
+                                 responses,
+                                 loadBalances,
+                                 selectedParams)
+      elif textOutput:
+        with Profile.phase('write_data'):
+          Simulation._writeStep(output,
+                                (step,
+                                 allTraffic,
+                                 responses.tolist(),
+                                 loadBalances.tolist(),
+                                 _strategyInfos(batchStrategies,
+                                                nodes,
+                                                singleNodes),
+                                 weights,
+                                 selectedParams))
+
+      Profile.endStep()
+
+    completed = True
+
+  finally:
+    Simulation._closeOutput(output, outFormat, completed)
+
+###############################################################################
+###############################################################################
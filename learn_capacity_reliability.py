@@ -1,8 +1,13 @@
-from scipy.stats import norm
+from scipy.special import log_ndtr
 import numpy as np
+import normal
 from scipy.optimize import curve_fit
 
-def learn_prior(observe, traffic_mu, traffic_std):
+# method chooses how capacity is estimated when only some observations hit
+# capacity: 'grid' searches a grid of means and standard deviations,
+# 'mle' solves for the censored normal maximum likelihood with
+# censored_normal_mle
+def learn_prior(observe, traffic_mu, traffic_std, method='grid'):
 
 	def learn_capacity_prior(observe, traffic_mu, traffic_std):
 		learn_c = True
@@ -45,53 +50,64 @@ def learn_prior(observe, traffic_mu, traffic_std):
 				else:
 					censored_PacketReceive_observe.append(observe[i][1])
 
-			def logl(observe,mean,std):
-			  # P(c|mean,std) = \Pi (if hit) p(c = packetReceive |mean,std) * (not hit)p(c > packetSent = packetreceive  | mean,std)
-			    ll = 0
-			    for item in observe:
-			        if item[1] == item [0]: # not hit
-			            ll += np.log(1-norm.cdf(item[1],loc = mean,scale = std))
-			        else:
-			            ll += np.log(norm.pdf(item[1],loc = mean,scale = std))
-			    return ll  
-
-			# find the grid search bound for mean
-			low_mean = round(np.mean(uncensored_PacketReceive_observe))
-			# [todo]: when traffic_std is big
-			upper_mean = max(round(traffic_mu + 2*traffic_std),low_mean + 1)
-
-			# find the grid search bound for std
-			low_std = np.std(uncensored_PacketReceive_observe)
-			if low_std == 0:
-				low_std = 5
-				upper_std = 10
+			if method == 'mle':
+				capacity_mu,capacity_std = censored_normal_mle(uncensored_PacketReceive_observe,
+				                                                censored_PacketReceive_observe)
 			else:
-				upper_std = max(low_std*min(1.0/uncensored_prec,5),low_std+0.1)
-
-			# print('capacity mean search range: ', low_mean,upper_mean)
-			# print('capacity std search range: ', low_std,upper_std)
-			# print('percentage of data uncensored: ', uncensored_prec)
-
-			ll_result = []
-			for mean in np.arange(low_mean,upper_mean):
-				for std in np.arange(low_std,upper_std,step = 0.1):
-					ll_result.append([mean,std,logl(observe,mean,std)]) 
-
-			ll_result = sorted(ll_result,key=lambda x: x[2],reverse = True)
-			capacity_mu = ll_result[0][0] 
-			capacity_std = ll_result[0][1]
-
-			if capacity_mu == low_mean:
-				upper_mean = low_mean + 1
-				low_mean = max(censored_PacketReceive_observe) + 1
-				# print('Expend mean search lower bound to ', low_mean)
-				for mean in np.arange(low_mean,upper_mean):
-					for std in np.arange(low_std,upper_std,step = 0.1):
-						ll_result.append([mean,std,logl(observe,mean,std)]) 
-
-				ll_result = sorted(ll_result,key=lambda x: x[2],reverse = True)
-				capacity_mu = ll_result[0][0] 
-				capacity_std = ll_result[0][1]      
+				def logl(observe,mean,std):
+				  # P(c|mean,std) = \Pi (if hit) p(c = packetReceive |mean,std) * (not hit)p(c > packetSent = packetreceive  | mean,std)
+				    # packet counts repeat, so each distinct count is evaluated once
+				    # and weighted by how often it was seen. The counts go on an axis
+				    # in front of the (mean x std) grid, summed over at the end.
+				    grid = (-1,) + (1,)*len(np.broadcast(mean,std).shape)
+				    received = np.array([item[1] for item in observe],dtype = float)
+				    not_hit = np.array([item[1] == item[0] for item in observe])
+				    ll = 0
+				    for hit,logp in [(not_hit,normal.logsf),(~not_hit,normal.logpdf)]:
+				        values,counts = np.unique(received[hit],return_counts = True)
+				        ll = ll + np.sum(counts.reshape(grid) * \
+				                         logp(values.reshape(grid),mean,std),axis = 0)
+				    return ll
+
+				# find the grid search bound for mean
+				low_mean = round(np.mean(uncensored_PacketReceive_observe))
+				# [todo]: when traffic_std is big
+				upper_mean = max(round(traffic_mu + 2*traffic_std),low_mean + 1)
+
+				# find the grid search bound for std
+				low_std = np.std(uncensored_PacketReceive_observe)
+				if low_std == 0:
+					low_std = 5
+					upper_std = 10
+				else:
+					upper_std = max(low_std*min(1.0/uncensored_prec,5),low_std+0.1)
+
+				# print('capacity mean search range: ', low_mean,upper_mean)
+				# print('capacity std search range: ', low_std,upper_std)
+				# print('percentage of data uncensored: ', uncensored_prec)
+
+				# logl broadcasts, so the whole (mean x std) grid is evaluated at once.
+				# argmax takes the first best point in (mean, std) order, as the
+				# stable sort of the grid did
+				def grid_search(means,stds):
+				    ll_grid = logl(observe,means[:,None],stds[None,:])
+				    best = np.unravel_index(np.argmax(ll_grid),ll_grid.shape)
+				    return means[best[0]],stds[best[1]],ll_grid[best]
+
+				std_grid = np.arange(low_std,upper_std,step = 0.1)
+				capacity_mu,capacity_std,best_ll = grid_search(np.arange(low_mean,upper_mean),std_grid)
+
+				if capacity_mu == low_mean:
+					upper_mean = low_mean + 1
+					low_mean = max(censored_PacketReceive_observe) + 1
+					# print('Expend mean search lower bound to ', low_mean)
+					mean_grid = np.arange(low_mean,upper_mean)
+					if len(mean_grid) > 0:
+						# the first search wins ties
+						mu,std,ll = grid_search(mean_grid,std_grid)
+						if ll > best_ll:
+							capacity_mu = mu
+							capacity_std = std
 
 		return capacity_mu,capacity_std,learn_c
 
@@ -122,11 +138,11 @@ def learn_prior(observe, traffic_mu, traffic_std):
 			reliability = (reliability+0.9)/2
 			capacity_mu_ah = capacity_mu_ah/reliability
 
-			p_nah = 1 - norm.cdf(min(PacketSent_obs),capacity_mu_nah,capacity_std_nah)
+			p_nah = normal.scalar_sf(min(PacketSent_obs),capacity_mu_nah,capacity_std_nah)
 			# p_ah1 = norm.cdf(min(PacketSent_obs),capacity_mu_ah,capacity_std_ah)
 			p_ah = 1
 			for x in PacketSent_obs:
-				p_ah = p_ah*norm.cdf(x,capacity_mu_ah,capacity_std_ah)
+				p_ah = p_ah*normal.scalar_cdf(x,capacity_mu_ah,capacity_std_ah)
 
 			if p_nah > 0.8 and p_ah < 0.2:
 				capacity_mu = capacity_mu_nah
@@ -147,6 +163,68 @@ def learn_prior(observe, traffic_mu, traffic_std):
 					learn_c = False
 	return capacity_mu,capacity_std,reliability,learn_c
 
+# Maximum likelihood fit of N(mean, std) to capacities, of which some were
+# observed (uncensored) and some are only known to be above an observed
+# value (censored). In terms of g = mean/std and d = 1/std the log likelihood
+#   sum_uncensored log(d) - (d*y - g)**2/2 + sum_censored log(Phi(g - d*c))
+# is concave, so it is maximized by Newton's method with step halving.
+# With few uncensored observations the likelihood can grow without bound as
+# std goes to 0, so std is kept at or above min_std packets.
+def censored_normal_mle(uncensored, censored, min_std=1.0, tol=1e-9, max_iter=100):
+    y = np.asarray(uncensored, dtype=float)
+    c = np.asarray(censored, dtype=float)
+
+    def loglik(g, d):
+        return len(y)*np.log(d) - np.sum((d*y - g)**2)/2 + np.sum(log_ndtr(g - d*c))
+
+    def newton(g, d, fix_d):
+        ll = loglik(g, d)
+        for i in range(max_iter):
+            r = d*y - g
+            u = g - d*c
+            # pdf(u)/cdf(u) and the second derivative of log(cdf(u))
+            mills = np.exp(normal.logpdf(u) - log_ndtr(u))
+            h2 = -mills*(u + mills)
+
+            grad = np.array([np.sum(r) + np.sum(mills),
+                             len(y)/d - np.sum(r*y) - np.sum(c*mills)])
+            hess = np.array([[-len(y) + np.sum(h2), np.sum(y) - np.sum(c*h2)],
+                             [np.sum(y) - np.sum(c*h2), -len(y)/d**2 - np.sum(y**2) + np.sum(c**2*h2)]])
+            if fix_d:
+                step = np.array([-grad[0]/hess[0, 0], 0])
+            elif d > 1e6/min_std or np.linalg.det(hess) <= 0:
+                # std is heading to 0
+                return g, d
+            else:
+                step = -np.linalg.solve(hess, grad)
+
+            # halve the step until the likelihood goes up (d must stay > 0)
+            t = 1.0
+            while True:
+                new_g, new_d = g + t*step[0], d + t*step[1]
+                if new_d > 0:
+                    new_ll = loglik(new_g, new_d)
+                    if new_ll >= ll:
+                        break
+                t /= 2
+                if t < 1e-10:
+                    return g, d
+            g, d, ll = new_g, new_d, new_ll
+            if np.max(np.abs(t*step)) < tol:
+                break
+        return g, d
+
+    # start from the uncensored observations, like the grid search does
+    std = max(np.std(y), min_std)
+    g, d = newton(np.mean(y)/std, 1/std, False)
+
+    # the unconstrained maximum has std < min_std (or there is none), so by
+    # concavity the constrained one is at std = min_std
+    if d > 1/min_std:
+        g, d = newton(g*(1/min_std)/d, 1/min_std, True)
+
+    return g/d, 1/d
+
 def NormGamma_update(observe,prior_mu,prior_v,prior_a,prior_b):
     prior_a = prior_a + 1.0/2
     prior_b = prior_b + prior_v/(prior_v+1)*(observe-prior_mu)**2/2
@@ -158,11 +236,10 @@ def online_update(observe,reliability,prior_mu_c,prior_v_c,prior_a_c,prior_b_c):
   	# high risk of underestimate the capacity when reliability is overestimated because of rounding
     [packetSent,packetReceived] = observe
     packetReceived = min(round(packetReceived/reliability),packetSent)
-    print([packetSent,packetReceived])
     mean = prior_mu_c
     std = np.sqrt(prior_b_c/prior_a_c)
     if packetSent == packetReceived: # didn't hit capacity
-        if 1-norm.cdf(packetReceived,loc = mean,scale = std) < 0.85:
+        if normal.scalar_sf(packetReceived,mean,std) < 0.85:
             (prior_mu_c,prior_v_c,prior_a_c,prior_b_c) = NormGamma_update(packetReceived + std,prior_mu_c,prior_v_c,prior_a_c,prior_b_c)
     else: # hit capacity, packReceived = capacity
         (prior_mu_c,prior_v_c,prior_a_c,prior_b_c) = NormGamma_update(packetReceived,prior_mu_c,prior_v_c,prior_a_c,prior_b_c)
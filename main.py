@@ -1,6 +1,17 @@
 import sys
+import argparse
 import ParseFile
+import optimize
+import ProcessOutput
+import Profile
+import ResultCache
 import Simulation
+import Strategies
+import VectorSimulation
+
+
+ENGINES = {'python': Simulation.executeSimulation,
+           'numpy': VectorSimulation.executeSimulation}
 
 
 if __name__ == "__main__":
@@ -8,10 +19,118 @@ if __name__ == "__main__":
     print("This program takes exactly 3 arguments, structured as follows:")
     print("main.py [simulation time steps] [config file] [output file]")
     exit()
-  
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('timeSteps', type=int)
+  parser.add_argument('configFile')
+  parser.add_argument('outFile')
+  parser.add_argument('--engine', choices=sorted(ENGINES), default='python',
+                      help='simulation engine (default: python)')
+  parser.add_argument('--node-update', choices=['safe', 'fast'], default='safe',
+                      help='copy nodes on every update (safe) or update them '
+                           'in place (fast) (default: safe)')
+  parser.add_argument('--split', choices=['sequential', 'multinomial'],
+                      default='sequential',
+                      help='assign the packets left after splitting by the '
+                           'load balance one at a time (sequential) or with '
+                           'one multinomial draw (multinomial), both with '
+                           'the same distribution (default: sequential)')
+  parser.add_argument('--solve-cache', type=int, default=0, metavar='SIZE',
+                      help='cache up to SIZE load balance solutions '
+                           '(default: 0, no cache)')
+  parser.add_argument('--solve-cache-tolerance', type=float, default=1e-3,
+                      help='solver inputs closer than this share a cached '
+                           'solution (default: 1e-3)')
+  parser.add_argument('--resolve-tolerance', type=float, default=0.0,
+                      help='reuse the last load balance solution while the '
+                           'solver inputs have changed by less than this '
+                           'fraction (default: 0, always solve)')
+  parser.add_argument('--capacity-method', choices=['grid', 'mle'],
+                      default='grid',
+                      help='estimate capacity from the time steps that hit '
+                           'it by a grid search (grid) or by censored normal '
+                           'maximum likelihood (mle) (default: grid)')
+  parser.add_argument('--output-format', choices=Simulation.OUTPUT_FORMATS,
+                      default='text',
+                      help="'binary' writes numeric columns to the directory "
+                           "outFile instead of a text file (default: text)")
+  parser.add_argument('--index', action='store_true',
+                      help='also write the offset of every time step of a '
+                           'text output to outFile.index, for '
+                           'ProcessOutput.readSteps')
+  parser.add_argument('--write-buffer', type=int,
+                      default=Simulation.DEFAULT_WRITE_BUFFER, metavar='STEPS',
+                      help='time steps of text output written at once by the '
+                           'background writer (default: {})'.format(
+                               Simulation.DEFAULT_WRITE_BUFFER))
+  parser.add_argument('--seed', type=int, default=None,
+                      help='give every node and network its own random '
+                           'stream derived from this seed, for reproducible '
+                           'runs (default: unseeded)')
+  parser.add_argument('--cache-dir', default=None,
+                      help='reuse the output of an identical seeded run '
+                           'stored in this directory (default: no cache)')
+  parser.add_argument('--cache-size', type=int, default=1024, metavar='MB',
+                      help='size limit of the cache (default: 1024)')
+  parser.add_argument('--profile', default=None, metavar='FILE',
+                      help='time the phases of every time step and write '
+                           'a report to FILE (default: no profiling)')
+  args = parser.parse_args()
+
   sys.stdout = open("out.log", 'w')
-  
-  timeSteps = int(sys.argv[1])
-  nodes, networks = ParseFile.parseInput(sys.argv[2])
-  outFile = sys.argv[3]
-  Simulation.executeSimulation(timeSteps, nodes, networks, outFile)
\ No newline at end of file
+
+  if args.solve_cache > 0:
+    optimize.enable_solve_cache(args.solve_cache, args.solve_cache_tolerance)
+
+  Strategies.RESOLVE_TOLERANCE = args.resolve_tolerance
+  Strategies.CAPACITY_METHOD = args.capacity_method
+
+  # only seeded runs can be repeated, and so cached. The cache holds single
+  # files, and so no binary output.
+  cacheKey = None
+  if args.cache_dir is not None and args.seed is not None and \
+     args.output_format == 'text':
+    cacheKey = ResultCache.runKey(ParseFile.readConfig(args.configFile),
+                                  timeSteps=args.timeSteps,
+                                  seed=args.seed,
+                                  engine=args.engine,
+                                  nodeUpdate=args.node_update,
+                                  split=args.split,
+                                  solveCache=args.solve_cache,
+                                  solveCacheTolerance=args.solve_cache_tolerance,
+                                  resolveTolerance=args.resolve_tolerance,
+                                  capacityMethod=args.capacity_method)
+    if ResultCache.fetchFile(cacheKey, args.outFile, args.cache_dir):
+      # nothing is run, so the index is cleared or written here instead of
+      # by the engine
+      if Simulation._clearIndex(args.outFile, args.index) is not None:
+        ProcessOutput.buildIndex(args.outFile)
+      if args.profile is not None:
+        print('the output was taken from the cache, so nothing was run to '
+              'profile and {} was not written'.format(args.profile),
+              file=sys.stderr)
+      exit()
+
+  if args.profile is not None:
+    Profile.enable()
+
+  nodes, networks = ParseFile.parseInput(args.configFile, seed=args.seed)
+  ENGINES[args.engine](args.timeSteps, nodes, networks, args.outFile,
+                       nodeUpdate=args.node_update,
+                       split=args.split,
+                       outFormat=args.output_format,
+                       writeIndex=args.index,
+                       writeBuffer=args.write_buffer)
+
+  if args.profile is not None:
+    Profile.writeReport(args.profile)
+
+  if args.solve_cache > 0:
+    stats = optimize.solve_cache_stats()
+    print('solve cache: {} hits, {} misses, {} solutions stored'.format(
+              stats['hits'], stats['misses'], stats['size']),
+          file=sys.stderr)
+
+  if cacheKey is not None:
+    ResultCache.storeFile(cacheKey, args.outFile, args.cache_dir,
+                          args.cache_size * 2**20)
@@ -1,9 +1,16 @@
+import math
 import numpy as np
-from cvxopt import solvers, matrix, spdiag
-from scipy.stats import norm, truncnorm
-import random
+from collections import OrderedDict
+from scipy.special import ndtri
+import normal
 import scipy.integrate as integrate
 
+# cvxopt is only needed by the 'cvxopt' backend of solve_opt
+try:
+    from cvxopt import solvers, matrix, spdiag
+except ImportError:
+    solvers = matrix = spdiag = None
+
 # optimization problem is
 # max f0(x) s.t. sum(x) = p and xi >= 0
 # where:
@@ -33,7 +40,7 @@ import scipy.integrate as integrate
 # mu, sig are floats
 def eval_norm_deriv(x, mu, sig):
     # added -1 factor below
-    return -1 * norm.pdf(x, mu, sig) * ((mu - x) / (sig**2))
+    return -1 * normal.scalar_pdf(x, mu, sig) * ((mu - x) / (sig**2))
     
 # compute f(x)
 def eval_f(mu, sig, a, x):
@@ -42,10 +49,10 @@ def eval_f(mu, sig, a, x):
     ans = 0
     for i in range(n):
         # eval xi (1-Phi(xi))
-        ans += a[i] * x[i] * (1 - norm.cdf(x[i], mu[i], sig[i]))
+        ans += a[i] * x[i] * normal.scalar_sf(x[i], mu[i], sig[i])
         # eval int_{0}^xi N(mu_i, sig_i, x_i)*t dt
         if x[i] > 1e-5:
-            ans += a[i] * integrate.quad(lambda t: t*norm.pdf(t, mu[i], sig[i]), 0, x[i])[0]
+            ans += a[i] * integrate.quad(lambda t: t*normal.scalar_pdf(t, mu[i], sig[i]), 0, x[i])[0]
     # added -1 factor below
     return -1 * ans
 
@@ -56,9 +63,9 @@ def eval_f_grad(mu, sig, a, x):
     f_grad = np.zeros([1,n])
     for i in range(n):
         # deriv of xi (1-Phi(xi))
-        f_grad[0,i] = a[i] * (1 - norm.cdf(x[i], mu[i], sig[i]) - (x[i] * norm.pdf(x[i], mu[i], sig[i])))
+        f_grad[0,i] = a[i] * (normal.scalar_sf(x[i], mu[i], sig[i]) - (x[i] * normal.scalar_pdf(x[i], mu[i], sig[i])))
         # deriv of int_{0}^xi N(mu_i, sig_i, x_i)*t dt
-        f_grad[0,i] += a[i] * (x[i] * norm.pdf(x[i], mu[i], sig[i]))
+        f_grad[0,i] += a[i] * (x[i] * normal.scalar_pdf(x[i], mu[i], sig[i]))
     # added -1 factor below
     return matrix(-1 * f_grad)
 
@@ -70,24 +77,59 @@ def eval_f_Hess(mu, sig, a, x):
     f_grad_diag = [0 for i in range(n)]
     for i in range(n):
         # second deriv of xi (1-Phi(xi))
-        f_grad_diag[i] = a[i] * (-2*norm.pdf(x[i], mu[i], sig[i]) - (x[i] * eval_norm_deriv(x[i], mu[i], sig[i])))
+        f_grad_diag[i] = a[i] * (-2*normal.scalar_pdf(x[i], mu[i], sig[i]) - (x[i] * eval_norm_deriv(x[i], mu[i], sig[i])))
         
         # second deriv of int_{0}^xi N(mu_i, sig_i, x_i)*t dt
-        f_grad_diag[i] += a[i] * (x[i] * eval_norm_deriv(x[i], mu[i], sig[i]) + norm.pdf(x[i], mu[i], sig[i]))
+        f_grad_diag[i] += a[i] * (x[i] * eval_norm_deriv(x[i], mu[i], sig[i]) + normal.scalar_pdf(x[i], mu[i], sig[i]))
         
         # added -1 factor below
         f_grad_diag[i] *= -1
     return spdiag(f_grad_diag)
 
+# eval_f, eval_f_grad and eval_f_Hess above integrate numerically and loop
+# over the networks; they are kept as a reference. eval_objective gives the
+# same values in closed form for all networks at once, using the partial
+# expectation of N(mu, sig)
+#   int_0^x t*N(mu, sig, t) dt = mu*(Phi(z_x) - Phi(z_0)) - sig*(phi(z_x) - phi(z_0))
+# with z_t = (t - mu) / sig and Phi, phi the standard normal cdf and pdf.
+# Unlike the functions above, the results are not multiplied by -1.
+
+# compute f(x), the gradient of f and the diagonal of the Hessian of f
+# mu, sig, a, x are arrays with one entry per network
+def eval_objective(mu, sig, a, x):
+    mu = np.asarray(mu, dtype=float)
+    sig = np.asarray(sig, dtype=float)
+    a = np.asarray(a, dtype=float)
+    x = np.asarray(x, dtype=float).ravel()
+
+    z_x = (x - mu) / sig
+    z_0 = -mu / sig
+    cdf_x = normal.cdf(z_x)
+    sf_x = normal.sf(z_x)
+    pdf_x = normal.pdf(z_x)
+    pdf_0 = normal.pdf(z_0)
+
+    # x (1-Phi(x)) + int_0^x N(mu, sig, t)*t dt
+    f = np.sum(a * (x * sf_x + mu * (cdf_x - normal.cdf(z_0)) - sig * (pdf_x - pdf_0)))
+    # the x N(mu, sig, x) terms of the two parts cancel
+    f_grad = a * sf_x
+    f_Hess = -a * pdf_x / sig
+    return f, f_grad, f_Hess
+
 ######################
-# Optimization solver
+# Optimization solvers
 ######################
 
 # mu = list of means of capacity of our networks (ordered)
 # sig = list of the standard deviations of our networks (ordered)
 # a = list of coeffiecents for each network
 # p = list of packets we expect to send on each turn
-def solve_opt(mu, sig, a, p, init_point=None):
+
+# general purpose solver, kept as a reference for the water-filling solver
+def solve_opt_cvxopt(mu, sig, a, p, init_point=None):
+    if solvers is None:
+        raise ImportError("the 'cvxopt' backend of solve_opt needs cvxopt")
+
     mu = np.array(mu)
     sig = np.array(sig)
     a = np.array(a)
@@ -96,26 +138,31 @@ def solve_opt(mu, sig, a, p, init_point=None):
     # see all the requirements for F here:
     # http://cvxopt.org/userguide/solvers.html#problems-with-nonlinear-objectives
     
-    def F(x=None,z=None, init_point=None):
+    # start from init_point scaled to p, or from all traffic on network 0
+    if init_point is None or np.sum(init_point) <= 0:
+        x0 = np.zeros(n)
+        x0[0] = p*1.0
+    else:
+        x0 = np.array(init_point, dtype=float) * p / np.sum(init_point)
+
+    def F(x=None,z=None):
         # if no x, return (0, point in domain of f)
         if x is None:
-          if init_point == None:
-            init_point = np.zeros(n)
-            init_point[0] = p*1.0
-          arr = matrix(init_point)
+          arr = matrix(x0)
           return 0, arr
         # should be sum(x) != p but need some slack
         if np.abs(np.sum(x) - p) > 1e-5:
             return None
         # if x, calculate f(x) and gradient
-        f = eval_f(mu, sig, a, x)
-        Df = eval_f_grad(mu, sig, a, x)
+        # (minimizing, so everything is multiplied by -1)
+        f, f_grad, f_Hess = eval_objective(mu, sig, a, x)
+        Df = matrix(-1 * f_grad.reshape([1,n]))
         # if no z, then return f, grad
         if z is None:
-            return f, Df
+            return -1 * f, Df
         # else, also need to return Hessian
-        H = eval_f_Hess(mu, sig, a, x)
-        return f, Df, H
+        H = spdiag((-1 * f_Hess).tolist())
+        return -1 * f, Df, H
     
     
     # compute matrices for linear constraints
@@ -131,5 +178,356 @@ def solve_opt(mu, sig, a, p, init_point=None):
     sol = solvers.cp(F, G=G, h=h, A=A, b=b)['x']
     return np.array(sol).flatten().tolist()
 
+# f is separable, and the derivative of each term is
+#   a_i * (1 - cdf of N(mu_i, sig_i) at x_i)
+# which is decreasing in x_i, so f is concave. The KKT conditions say that
+# there is a multiplier lam with
+#   a_i * (1 - Phi_i(x_i)) = lam   if x_i > 0
+#   a_i * (1 - Phi_i(0))  <= lam   if x_i = 0
+# i.e. x_i(lam) = max(0, mu_i + sig_i * Phi^-1(1 - lam / a_i)), and zero for
+# networks with a_i <= lam. sum(x(lam)) is decreasing in lam, so we only need
+# a one dimensional search for sum(x(lam)) = p.
+#
+# When mu_i is many sig_i above 0, x_i(lam) climbs from 0 to near mu_i for
+# lam within floating point precision of a_i, so we narrow a bracket on lam
+# until the totals at its ends are within WATERFILL_TOLERANCE of p (or the
+# ends are neighbouring floats) and interpolate between their allocations.
+# Every x_i grows as lam falls, so the interpolated allocation is off by no
+# more than the distance of the closer total from p. The bracket is
+# narrowed by false position with the Illinois modification: when the same
+# end is kept twice in a row, the value at the other end is halved.
+#
+# A network with sig_i = 0 has a known capacity: x_i(lam) jumps from 0 to
+# mu_i at lam = a_i, and 1 - Phi_i is a step at mu_i.
+#
+# The single problem solver works on plain numbers, which is many times
+# faster than a batch of one. The batch solver takes the same steps for
+# every problem with the same arithmetic (summing one network at a time),
+# so that both give exactly the same allocations.
+
+# relative tolerance on sum(x) = p
+WATERFILL_TOLERANCE = 1e-10
+
+_TINY = np.finfo(float).tiny
+
+# sum along the last axis one network at a time, in the order the single
+# problem solver adds them
+def _sequential_sum(values):
+    total = np.zeros(values.shape[:-1])
+    for i in range(values.shape[-1]):
+        total = total + values[..., i]
+    return total
+
+# evaluate x(lam) for all networks
+# for a batch, mu, sig, a have one row per problem and lam one entry per row
+# lam / a is kept at or above the smallest normal float, so that x stays
+# finite (at about mu + 37.5 sig) as lam goes to 0
+def waterfill_alloc(mu, sig, a, lam):
+    lam = np.broadcast_to(np.expand_dims(lam, -1), a.shape)
+    x = np.zeros(a.shape)
+    active = a > lam
+    # Phi^-1(1 - q) = -Phi^-1(q)
+    q = np.maximum(lam[active] / a[active], _TINY)
+    x[active] = mu[active] - sig[active] * ndtri(q)
+    return np.maximum(x, 0)
+
+# 1 - Phi_i at x, taking the step (1/2 at mu_i) where sig_i is 0
+def waterfill_sf(mu, sig, x):
+    known = sig <= 0
+    sf = normal.sf(x, mu, np.where(known, 1, sig))
+    return np.where(known, np.where(x < mu, 1.0, np.where(x > mu, 0.0, 0.5)), sf)
+
+# lam at which the allocation x is optimal for its positive entries, or 0
+# where x is all zeros
+def waterfill_lam(mu, sig, a, x):
+    positive = x > 0
+    lam = np.where(positive, a * waterfill_sf(mu, sig, x), 0)
+    return _sequential_sum(lam) / np.maximum(np.sum(positive, axis=-1), 1)
+
+# when p is so far above the capacities that even the largest allocations,
+# at lam = 0, send too little. Out there the tails are about equal when
+# every network is the same number of standard deviations above its mean.
+# for a batch, mu and sig have one row per problem
+def waterfill_spread(mu, sig, p):
+    spread = np.array(sig, dtype=float)
+    spread[_sequential_sum(spread) <= 0] = 1
+    return mu + np.expand_dims(p - _sequential_sum(mu), -1) * \
+        spread / np.expand_dims(_sequential_sum(spread), -1)
+
+# solve many problems with the same number of networks at once
+# mu, sig, a are (problems x networks), p has one entry per problem
+# init_point is an optional (problems x networks) array of starting
+# allocations, e.g. the current load balances, in any scale. The search for
+# lam starts from the lam of the starting allocation, which needs far fewer
+# steps when the solution has not moved much.
+# returns the allocations as a (problems x networks) array
+# when the solution cache is enabled, each problem is looked up in it first,
+# like solve_opt does, and only the others are solved
+def solve_opt_batch(mu, sig, a, p, init_point=None):
+    if _cache is None:
+        return _solve_opt_batch(mu, sig, a, p, init_point)
+
+    mu = np.array(mu, dtype=float, ndmin=2)
+    sig = np.array(sig, dtype=float, ndmin=2)
+    a = np.array(a, dtype=float, ndmin=2)
+    p = np.array(p, dtype=float).reshape(-1)
+    x = np.zeros(mu.shape)
+
+    keys = [_cache_key(mu[i], sig[i], a[i], p[i], 'waterfill') for i in range(len(p))]
+    missing = []
+    for i, key in enumerate(keys):
+        if key in _cache:
+            _cache_stats['hits'] += 1
+            _cache.move_to_end(key)
+            x[i] = _cache[key]
+        else:
+            _cache_stats['misses'] += 1
+            missing.append(i)
+
+    if len(missing) > 0:
+        if init_point is not None:
+            init_point = np.array(init_point, dtype=float, ndmin=2)[missing]
+        x[missing] = _solve_opt_batch(mu[missing], sig[missing], a[missing], p[missing], init_point)
+        for i in missing:
+            _cache_store(keys[i], x[i].tolist())
+    return x
+
+def _solve_opt_batch(mu, sig, a, p, init_point=None):
+    mu = np.array(mu, dtype=float, ndmin=2)
+    sig = np.array(sig, dtype=float, ndmin=2)
+    a = np.array(a, dtype=float, ndmin=2)
+    p = np.array(p, dtype=float).reshape(-1)
+    n = mu.shape[1]
+    x = np.zeros(mu.shape)
+
+    # no network is worth sending to, split evenly
+    even = (p <= 0) | (np.max(a, axis=1) <= 0)
+    x[even] = (p[even] / n)[:, None]
+
+    rows = np.flatnonzero(~even)
+    mu, sig, a, p = mu[rows], sig[rows], a[rows], p[rows]
+
+    # everything grows without bound as lam goes to 0, unless p is so far
+    # above the capacities that there is no bracket to search, see
+    # waterfill_spread, and nothing is sent at lam = max(a)
+    lo = np.zeros(len(rows))
+    x_lo = waterfill_alloc(mu, sig, a, lo)
+    sum_lo = _sequential_sum(x_lo)
+    underflow = sum_lo < p
+    hi = np.max(a, axis=1)
+    x_hi = np.zeros(mu.shape)
+    sum_hi = np.zeros(len(rows))
+
+    # the values at the ends of the bracket that false position works on,
+    # and which end was kept by the last step (1 for lo, -1 for hi)
+    f_lo = sum_lo - p
+    f_hi = -p
+    kept = np.zeros(len(rows), dtype=int)
+
+    # the first step is to the lam of the starting allocation
+    lam = np.full(len(rows), np.nan)
+    if init_point is not None:
+        x0 = np.array(init_point, dtype=float, ndmin=2)[rows]
+        total = _sequential_sum(x0)
+        warm = total > 0
+        x0 = x0[warm] * np.expand_dims(p[warm] / total[warm], -1)
+        lam[warm] = waterfill_lam(mu[warm], sig[warm], a[warm], x0)
+
+    tolerance = WATERFILL_TOLERANCE * p
+    search = ~underflow
+    while True:
+        search &= (sum_lo - p > tolerance) & (p - sum_hi > tolerance)
+        s = np.flatnonzero(search)
+        if len(s) == 0:
+            break
+
+        step = lam[s]
+        falsi = ~((lo[s] < step) & (step < hi[s]))
+        step[falsi] = lo[s][falsi] + (hi[s][falsi] - lo[s][falsi]) * \
+            (f_lo[s][falsi] / (f_lo[s][falsi] - f_hi[s][falsi]))
+        halve = ~((lo[s] < step) & (step < hi[s]))
+        step[halve] = (lo[s][halve] + hi[s][halve]) / 2
+        # lo and hi are neighbouring floats
+        stuck = ~((lo[s] < step) & (step < hi[s]))
+        search[s[stuck]] = False
+        s, step = s[~stuck], step[~stuck]
+        lam[:] = np.nan
+
+        x_step = waterfill_alloc(mu[s], sig[s], a[s], step)
+        sum_step = _sequential_sum(x_step)
+        enough = sum_step >= p[s]
+
+        up = s[enough]
+        lo[up], x_lo[up], sum_lo[up] = step[enough], x_step[enough], sum_step[enough]
+        f_lo[up] = sum_step[enough] - p[up]
+        f_hi[up[kept[up] == 1]] /= 2
+        kept[up] = 1
+
+        down = s[~enough]
+        hi[down], x_hi[down], sum_hi[down] = step[~enough], x_step[~enough], sum_step[~enough]
+        f_hi[down] = sum_step[~enough] - p[down]
+        f_lo[down[kept[down] == -1]] /= 2
+        kept[down] = -1
+
+    solved = ~underflow
+    t = (p[solved] - sum_hi[solved]) / (sum_lo[solved] - sum_hi[solved])
+    x_solved = np.zeros(mu.shape)
+    x_solved[solved] = x_hi[solved] + t[:, None] * (x_lo[solved] - x_hi[solved])
+    x_solved[underflow] = waterfill_spread(mu[underflow], sig[underflow], p[underflow])
+
+    x[rows] = x_solved
+    return x
+
+# x(lam) and its total for a single problem, on plain numbers, with the
+# arithmetic of waterfill_alloc
+def waterfill_point(mu, sig, a, lam):
+    x = []
+    total = 0.0
+    for mu_i, sig_i, a_i in zip(mu, sig, a):
+        x_i = 0.0
+        if a_i > lam:
+            x_i = max(mu_i - sig_i * float(ndtri(max(lam / a_i, _TINY))), 0.0)
+        x.append(x_i)
+        total = total + x_i
+    return x, total
+
+# waterfill_lam for a single problem, on plain numbers
+def waterfill_point_lam(mu, sig, a, x):
+    lam = 0.0
+    positive = 0
+    for mu_i, sig_i, a_i, x_i in zip(mu, sig, a, x):
+        if x_i > 0:
+            if sig_i > 0:
+                sf = float(normal.sf(x_i, mu_i, sig_i))
+            else:
+                sf = 1.0 if x_i < mu_i else 0.0 if x_i > mu_i else 0.5
+            lam = lam + a_i * sf
+            positive += 1
+    return lam / max(positive, 1)
+
+# a single problem, with the steps _solve_opt_batch takes for it
+def _solve_opt_single(mu, sig, a, p, init_point=None):
+    mu = np.ravel(mu).astype(float).tolist()
+    sig = np.ravel(sig).astype(float).tolist()
+    a = np.ravel(a).astype(float).tolist()
+    p = float(p)
+    n = len(mu)
+
+    # no network is worth sending to, split evenly
+    if p <= 0 or max(a) <= 0:
+        return [p / n] * n
+
+    x_lo, sum_lo = waterfill_point(mu, sig, a, 0.0)
+    if sum_lo < p:
+        return waterfill_spread(np.array(mu), np.array(sig), p).tolist()
+    lo = 0.0
+    hi, x_hi, sum_hi = max(a), [0.0] * n, 0.0
+
+    f_lo = sum_lo - p
+    f_hi = -p
+    kept = 0
+
+    lam = math.nan
+    if init_point is not None:
+        x0 = np.ravel(init_point).astype(float).tolist()
+        total = 0.0
+        for x0_i in x0:
+            total = total + x0_i
+        if total > 0:
+            scale = p / total
+            lam = waterfill_point_lam(mu, sig, a, [x0_i * scale for x0_i in x0])
+
+    tolerance = WATERFILL_TOLERANCE * p
+    while sum_lo - p > tolerance and p - sum_hi > tolerance:
+        if not lo < lam < hi:
+            lam = lo + (hi - lo) * (f_lo / (f_lo - f_hi))
+        if not lo < lam < hi:
+            lam = (lo + hi) / 2
+        # lo and hi are neighbouring floats
+        if not lo < lam < hi:
+            break
+
+        x_lam, total = waterfill_point(mu, sig, a, lam)
+        if total >= p:
+            lo, x_lo, sum_lo, f_lo = lam, x_lam, total, total - p
+            if kept == 1:
+                f_hi /= 2
+            kept = 1
+        else:
+            hi, x_hi, sum_hi, f_hi = lam, x_lam, total, total - p
+            if kept == -1:
+                f_lo /= 2
+            kept = -1
+        lam = math.nan
+
+    t = (p - sum_hi) / (sum_lo - sum_hi)
+    return [x_hi_i + t * (x_lo_i - x_hi_i) for x_lo_i, x_hi_i in zip(x_lo, x_hi)]
+
+def solve_opt_waterfill(mu, sig, a, p, init_point=None):
+    return _solve_opt_single(mu, sig, a, p, init_point)
+
+SOLVERS = {'waterfill': solve_opt_waterfill,
+           'cvxopt': solve_opt_cvxopt}
+
+######################
+# Solution cache
+######################
+
+# Nodes with the same traffic and the same networks learn close to the same
+# parameters, so many of their problems are the same. When enabled, solve_opt
+# keeps the solutions of the last max_size problems, keyed on their
+# parameters rounded to multiples of tolerance, and returns the stored
+# solution when the rounded parameters match. solve_opt_batch uses the same
+# cache, for each of its problems.
+
+_cache = None
+_cache_tolerance = None
+_cache_max_size = 0
+_cache_stats = {'hits': 0, 'misses': 0}
+
+def enable_solve_cache(max_size=1024, tolerance=1e-3):
+    global _cache, _cache_tolerance, _cache_max_size
+    _cache = OrderedDict()
+    _cache_tolerance = tolerance
+    _cache_max_size = max_size
+    _cache_stats['hits'] = 0
+    _cache_stats['misses'] = 0
+
+def disable_solve_cache():
+    global _cache
+    _cache = None
+
+# returns a dict with the number of hits, misses and stored solutions
+def solve_cache_stats():
+    size = 0 if _cache is None else len(_cache)
+    return {'hits': _cache_stats['hits'],
+            'misses': _cache_stats['misses'],
+            'size': size}
+
+def _cache_key(mu, sig, a, p, solver):
+    rounded = np.round(np.concatenate([np.ravel(mu), np.ravel(sig), np.ravel(a), [p]]) / _cache_tolerance)
+    return (solver, len(np.ravel(mu))) + tuple(rounded.tolist())
+
+def _cache_store(key, sol):
+    _cache[key] = sol
+    # drop the least recently used solution
+    if len(_cache) > _cache_max_size:
+        _cache.popitem(last=False)
+
+def solve_opt(mu, sig, a, p, init_point=None, solver='waterfill'):
+    if _cache is None:
+        return SOLVERS[solver](mu, sig, a, p, init_point)
+
+    key = _cache_key(mu, sig, a, p, solver)
+    if key in _cache:
+        _cache_stats['hits'] += 1
+        _cache.move_to_end(key)
+        return list(_cache[key])
+
+    _cache_stats['misses'] += 1
+    sol = SOLVERS[solver](mu, sig, a, p, init_point)
+    _cache_store(key, list(sol))
+    return sol
+
 ##################################################
 ##################################################
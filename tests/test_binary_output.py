@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+import BinaryOutput
+import ParseFile
+import ProcessOutput
+import Simulation
+import VectorSimulation
+from conftest import EXAMPLE_CONFIG
+
+
+ENGINES = [Simulation.executeSimulation, VectorSimulation.executeSimulation]
+
+
+def _run(engine,
+         outFile,
+         timeSteps,
+         outFormat,
+         stepCallback=None):
+
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=6)
+  engine(timeSteps, nodes, networks, outFile,
+         outFormat=outFormat,
+         stepCallback=stepCallback)
+
+
+
+def _textColumns(outFile,
+                 nodeNames,
+                 networkNames,
+                 parameterNames):
+
+  # the binary columns of the text output
+  steps = [step for timeStep, step in sorted(ProcessOutput.processOutput(outFile).items())]
+  columns = {BinaryOutput.TRAFFIC: 'traffic_sent',
+             BinaryOutput.RESPONSE: 'traffic_response',
+             BinaryOutput.LOAD_BALANCE: 'load_balance'}
+  text = {column: np.array([[step['{}-{}'.format(node, key)] for node in nodeNames]
+                            for step in steps])
+          for column, key in columns.items()}
+  text[BinaryOutput.NETWORK_PARAMETERS] = \
+      np.array([[[step[network][name] for name in parameterNames]
+                 for network in networkNames]
+                for step in steps])
+  return text
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_binary_output_matches_text_output(tmp_path, engine):
+
+  _run(engine, str(tmp_path / 'run.out'), 25, 'text')
+  _run(engine, str(tmp_path / 'run'), 25, 'binary')
+
+  output = BinaryOutput.readOutput(str(tmp_path / 'run'))
+  assert output['steps'] == 25
+  text = _textColumns(str(tmp_path / 'run.out'),
+                      output['nodes'],
+                      output['networks'],
+                      output['parameters'])
+
+  for column in BinaryOutput.COLUMN_TYPES:
+    assert output[column].dtype == BinaryOutput.COLUMN_TYPES[column]
+    assert np.array_equal(output[column], text[column])
+    # the files are plain .npy files too
+    assert np.array_equal(np.load(str(tmp_path / 'run' / (column + '.npy'))),
+                          output[column])
+
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_stopped_run_reads_back_the_steps_written(tmp_path, engine):
+
+  def stop(timeStep, loadBalances, allTraffic, trafficResponses):
+    if timeStep == 7:
+      raise KeyboardInterrupt
+
+  with pytest.raises(KeyboardInterrupt):
+    _run(engine, str(tmp_path / 'run'), 25, 'binary', stepCallback=stop)
+  _run(engine, str(tmp_path / 'full'), 25, 'binary')
+
+  # steps 0 to 6 were written before the callback of step 7
+  output = BinaryOutput.readOutput(str(tmp_path / 'run'))
+  full = BinaryOutput.readOutput(str(tmp_path / 'full'))
+  assert output['steps'] == 7
+  for column in BinaryOutput.COLUMN_TYPES:
+    loaded = np.load(str(tmp_path / 'run' / (column + '.npy')))
+    assert loaded.shape == (7,) + full[column].shape[1:]
+    assert np.array_equal(loaded, full[column][:7])
+    assert np.array_equal(output[column], full[column][:7])
+
+
+
+def test_unfinished_output_reads_the_flushed_steps(tmp_path):
+
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG)
+  directory = str(tmp_path / 'run')
+  output = BinaryOutput.openOutput(directory, 10, nodes, networks, chunkSteps=3)
+
+  traffic = np.arange(20).reshape(5, 2, 2)
+  for step in range(5):
+    BinaryOutput.writeStep(output, traffic[step], traffic[step],
+                           [[0.5, 0.5], [0.25, 0.75]], [{}, {}])
+
+    # only whole chunks are on disk until the output is closed
+    written = BinaryOutput.readOutput(directory)
+    assert written['steps'] == 3 * ((step + 1) // 3)
+    assert np.array_equal(written[BinaryOutput.TRAFFIC],
+                          traffic[:written['steps']])
+    assert np.load(BinaryOutput._columnPath(directory, BinaryOutput.TRAFFIC)).shape == \
+           (written['steps'], 2, 2)
+
+  BinaryOutput.closeOutput(output)
+  assert np.array_equal(BinaryOutput.readOutput(directory)[BinaryOutput.TRAFFIC],
+                        traffic)
+
+
+
+def test_read_output_maps_the_files(tmp_path):
+
+  directory = str(tmp_path / 'run')
+  _run(VectorSimulation.executeSimulation, directory, 12, 'binary')
+  output = BinaryOutput.readOutput(directory)
+
+  for column in BinaryOutput.COLUMN_TYPES:
+    assert isinstance(output[column], np.memmap)
+    assert not output[column].flags.writeable
+
+  # node and network values are views on the mapped files
+  nodeName = output['nodes'][1]
+  networkName = output['networks'][0]
+  nodeTraffic = BinaryOutput.nodeValues(output, BinaryOutput.TRAFFIC, nodeName)
+  networkLoad = BinaryOutput.networkValues(output, BinaryOutput.LOAD_BALANCE,
+                                           networkName)
+  parameters = BinaryOutput.networkValues(output, BinaryOutput.NETWORK_PARAMETERS,
+                                          networkName)
+  assert np.shares_memory(nodeTraffic, output[BinaryOutput.TRAFFIC])
+  assert np.shares_memory(networkLoad, output[BinaryOutput.LOAD_BALANCE])
+  assert np.array_equal(nodeTraffic, output[BinaryOutput.TRAFFIC][:, 1, :])
+  assert np.array_equal(networkLoad, output[BinaryOutput.LOAD_BALANCE][:, :, 0])
+  assert parameters.shape == (12, len(output['parameters']))
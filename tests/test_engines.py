@@ -0,0 +1,82 @@
+import threading
+import numpy as np
+import pytest
+import ParseFile
+import ProcessOutput
+import Simulation
+import VectorSimulation
+from conftest import EXAMPLE_CONFIG
+
+
+def test_seeded_engines_write_the_same_output(tmp_path):
+
+  outputs = []
+  for engine in [Simulation.executeSimulation,
+                 VectorSimulation.executeSimulation]:
+    nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=9)
+    outFile = str(tmp_path / 'engine.out')
+    engine(60, nodes, networks, outFile)
+    with open(outFile) as f:
+      outputs.append(f.read())
+
+  assert outputs[0] == outputs[1]
+
+
+
+def test_seeded_engines_call_back_with_the_same_values():
+
+  recorded = []
+  for engine in [Simulation.executeSimulation,
+                 VectorSimulation.executeSimulation]:
+    steps = []
+    def recordStep(timeStep, loadBalances, allTraffic, trafficResponses):
+      steps.append((np.array(loadBalances),
+                    np.array(allTraffic),
+                    np.array(trafficResponses)))
+
+    nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=9)
+    # the same positional arguments mean the same thing to both engines
+    engine(30, nodes, networks, None, 'fast', recordStep)
+    recorded.append(steps)
+
+  assert len(recorded[0]) == len(recorded[1]) == 30
+  for pythonStep, numpyStep in zip(*recorded):
+    for pythonValues, numpyValues in zip(pythonStep, numpyStep):
+      assert np.array_equal(pythonValues, numpyValues)
+
+
+
+@pytest.mark.parametrize('engine', [Simulation.executeSimulation,
+                                    VectorSimulation.executeSimulation])
+def test_writer_stops_when_the_run_fails(tmp_path, engine):
+
+  def failingCallback(timeStep, loadBalances, allTraffic, trafficResponses):
+    if timeStep == 5:
+      raise RuntimeError('callback failed')
+
+  threads = threading.active_count()
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=9)
+  outFile = str(tmp_path / 'failed.out')
+
+  with pytest.raises(RuntimeError, match='callback failed'):
+    engine(20, nodes, networks, outFile, stepCallback=failingCallback,
+           writeBuffer=2)
+
+  assert threading.active_count() == threads
+  # the time steps before the failure are all written
+  assert sorted(ProcessOutput.processOutput(outFile)) == [0, 1, 2, 3, 4]
+
+
+
+@pytest.mark.parametrize('engine', [Simulation.executeSimulation,
+                                    VectorSimulation.executeSimulation])
+def test_writer_failure_is_raised(tmp_path, engine):
+
+  threads = threading.active_count()
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=9)
+  outFile = str(tmp_path / 'missing' / 'run.out')
+
+  with pytest.raises(FileNotFoundError):
+    engine(20, nodes, networks, outFile, writeBuffer=1)
+
+  assert threading.active_count() == threads
@@ -0,0 +1,22 @@
+import numpy as np
+import Ensemble
+from conftest import EXAMPLE_CONFIG
+
+
+def test_seeded_engines_give_the_same_ensemble():
+
+  results = [Ensemble.runEnsemble(20, EXAMPLE_CONFIG, 3,
+                                  seed=11,
+                                  processes=2,
+                                  engine=engine,
+                                  quantiles=(0.5,))
+             for engine in ['python', 'numpy']]
+
+  for name in Ensemble.RECORDED:
+    assert sorted(results[0][name]) == ['mean', 'q0.5', 'std']
+    for statistic in results[0][name]:
+      assert np.array_equal(results[0][name][statistic],
+                            results[1][name][statistic])
+
+  # the replications differ, so there is a spread to compare
+  assert np.any(results[0]['traffic_response']['std'] > 0)
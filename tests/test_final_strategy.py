@@ -0,0 +1,170 @@
+import math
+from copy import deepcopy
+import pytest
+import learn_capacity_reliability
+import optimize
+import ParseFile
+import Simulation
+import SourceNode
+import Strategies
+from conftest import EXAMPLE_CONFIG
+from Strategies import PACKETS_RETURNED, COST, SPEED, CAPACITY, RELIABILITY, \
+                       PRIOR_VALUES, PRIOR_MU, PRIOR_VAR, PRIOR_ALPHA, PRIOR_BETA
+
+
+# The final strategy as it was before its state moved into arrays: nested
+# dicts of priors and a list of [sent, returned] packet records per network.
+# The solve takes the current load as its starting point, like the strategy
+# does now, so that both take the same solver steps.
+
+def _referenceInitialInfo(numNetworks):
+
+  priorVals = {PRIOR_MU: 1.0, PRIOR_VAR: 0.1, PRIOR_ALPHA: 1.0, PRIOR_BETA: 1.0}
+  priorCapacity = {PRIOR_MU: 0, PRIOR_VAR: 0, PRIOR_ALPHA: 0, PRIOR_BETA: 0}
+  priorVars = {COST: deepcopy(priorVals),
+               SPEED: deepcopy(priorVals),
+               CAPACITY: deepcopy(priorCapacity),
+               RELIABILITY: {PRIOR_MU: 0}}
+  keepPackets = 10
+
+  return {PRIOR_VALUES: [deepcopy(priorVars) for i in range(numNetworks)],
+          'packet_record': [[[] for i in range(keepPackets)]
+                            for i in range(numNetworks)],
+          'keep_packets': keepPackets,
+          'current_iteration': 0}
+
+
+
+def _referenceNormGamma(prior,
+                        observed):
+
+  prior[PRIOR_MU], prior[PRIOR_VAR], prior[PRIOR_ALPHA], prior[PRIOR_BETA] = \
+      learn_capacity_reliability.NormGamma_update(observed,
+                                                  prior[PRIOR_MU],
+                                                  prior[PRIOR_VAR],
+                                                  prior[PRIOR_ALPHA],
+                                                  prior[PRIOR_BETA])
+
+
+
+def _referenceUpdateInfo(info,
+                         trafficSent,
+                         networkResponse,
+                         trafficParameters):
+
+  changePacket = info['current_iteration'] % info['keep_packets']
+  info['current_iteration'] += 1
+
+  for netNum, response in enumerate(networkResponse):
+    priors = info[PRIOR_VALUES][netNum]
+    record = info['packet_record'][netNum]
+    record[changePacket] = [trafficSent[netNum], response[PACKETS_RETURNED]]
+
+    _referenceNormGamma(priors[COST], response[COST])
+    _referenceNormGamma(priors[SPEED], response[SPEED])
+
+    if info['current_iteration'] % info['keep_packets'] != 0:
+      continue
+
+    capacityMu, capacityStd, reliability, learnC = \
+        learn_capacity_reliability.learn_prior(record,
+                                               trafficParameters[0],
+                                               trafficParameters[1])
+
+    if info['current_iteration'] == info['keep_packets']:
+      priors[CAPACITY][PRIOR_MU] = capacityMu
+      priors[CAPACITY][PRIOR_VAR] = 2.0
+      priors[CAPACITY][PRIOR_ALPHA] = 2.0
+      priors[CAPACITY][PRIOR_BETA] = (capacityStd**2) * priors[CAPACITY][PRIOR_ALPHA]
+      priors[RELIABILITY][PRIOR_MU] = reliability
+    else:
+      priors[RELIABILITY][PRIOR_MU] = (reliability + priors[RELIABILITY][PRIOR_MU]) / 2
+      if learnC:
+        _referenceNormGamma(priors[CAPACITY], capacityMu)
+
+
+
+def _referenceUpdateLoad(info,
+                         numNetworks,
+                         weights,
+                         oldLoad,
+                         trafficParameters,
+                         rng):
+
+  if info['current_iteration'] < info['keep_packets']:
+    return Strategies._exploreLoad(numNetworks, rng)
+
+  if info['current_iteration'] % info['keep_packets'] != 0:
+    return oldLoad
+
+  capacityMeans = []
+  capacityStdDevs = []
+  coefficients = []
+  for priors in info[PRIOR_VALUES]:
+    capacityMeans.append(priors[CAPACITY][PRIOR_MU])
+    capacityStdDevs.append(math.sqrt(priors[CAPACITY][PRIOR_BETA] / \
+                                     priors[CAPACITY][PRIOR_ALPHA]))
+    coefficients.append((priors[COST][PRIOR_MU]*weights[COST] + \
+                         priors[SPEED][PRIOR_MU]*weights[SPEED] + \
+                         weights[PACKETS_RETURNED]) * \
+                        priors[RELIABILITY][PRIOR_MU])
+
+  newLoad = optimize.solve_opt(capacityMeans,
+                               capacityStdDevs,
+                               coefficients,
+                               trafficParameters[0] + trafficParameters[1],
+                               init_point=list(oldLoad))
+  newLoadSum = sum(newLoad)
+
+  return [(x/newLoadSum + old) / 2 for x, old in zip(newLoad, oldLoad)]
+
+
+
+def _followWithReference(node,
+                         compared):
+
+  # steps a reference state alongside the node's own, with the same inputs
+  # and a copy of the same generator, and records both after every step
+  reference = {'info': _referenceInitialInfo(len(node[SourceNode.CURRENT_LOAD_BALANCE])),
+               'load': list(node[SourceNode.CURRENT_LOAD_BALANCE])}
+  updateInfo = node[SourceNode.STRATEGY_UPDATE]
+  updateLoad = node[SourceNode.LOAD_BALANCE_UPDATE]
+
+  def followInfo(info, trafficSent, networkResponse, weights, trafficParameters):
+    _referenceUpdateInfo(reference['info'], deepcopy(trafficSent),
+                         deepcopy(networkResponse), trafficParameters)
+    return updateInfo(info, trafficSent, networkResponse, weights,
+                      trafficParameters)
+
+  def followLoad(info, numNetworks, weights, oldLoad, trafficParameters, rng=None):
+    reference['load'] = _referenceUpdateLoad(reference['info'], numNetworks,
+                                             weights, reference['load'],
+                                             trafficParameters, deepcopy(rng))
+    load = updateLoad(info, numNetworks, weights, oldLoad, trafficParameters,
+                      rng=rng)
+    compared.append(((Strategies.final_info_view(info), list(load)),
+                     (deepcopy(reference['info']), list(reference['load']))))
+    return load
+
+  node[SourceNode.STRATEGY_UPDATE] = followInfo
+  node[SourceNode.LOAD_BALANCE_UPDATE] = followLoad
+
+
+
+@pytest.mark.parametrize('nodeUpdate', ['safe', 'fast'])
+def test_array_state_matches_dict_state(nodeUpdate):
+
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=8)
+  compared = []
+  for node in nodes:
+    assert node[SourceNode.STRATEGY] == 'final'
+    _followWithReference(node, compared)
+
+  Simulation.executeSimulation(45, nodes, networks, None, nodeUpdate=nodeUpdate)
+
+  # 45 steps re-learn the capacities and solve 4 times after exploring
+  assert len(compared) == 45 * len(nodes)
+  for (info, load), (referenceInfo, referenceLoad) in compared:
+    assert info == referenceInfo
+    assert load == referenceLoad
+  assert compared[-1][0][0]['current_iteration'] == 45
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import learn_capacity_reliability
+import normal
+import ParseFile
+import Simulation
+import Strategies
+import VectorSimulation
+from conftest import EXAMPLE_CONFIG
+from learn_capacity_reliability import censored_normal_mle, learn_prior
+
+
+def _sample(seed=5,
+            size=40):
+
+  # packets received are capped by a N(100, 10) capacity
+  rng = np.random.default_rng(seed)
+  capacity = np.round(rng.normal(100, 10, size))
+  sent = np.round(rng.normal(100, 20, size))
+  received = np.minimum(sent, capacity)
+  return sent, received
+
+
+
+def _logLikelihood(uncensored,
+                   censored,
+                   mean,
+                   std):
+
+  return np.sum(normal.logpdf(uncensored[:, None, None], mean, std), axis=0) + \
+         np.sum(normal.logsf(censored[:, None, None], mean, std), axis=0)
+
+
+
+def test_censored_mle_matches_grid():
+
+  sent, received = _sample()
+  uncensored = received[received < sent]
+  censored = received[received == sent]
+
+  mean, std = censored_normal_mle(uncensored, censored)
+
+  step = 0.05
+  means = np.arange(90, 110, step)
+  stds = np.arange(3, 20, step)
+  grid = _logLikelihood(uncensored, censored, means[:, None], stds[None, :])
+  best = np.unravel_index(np.argmax(grid), grid.shape)
+
+  assert mean == pytest.approx(means[best[0]], abs=step)
+  assert std == pytest.approx(stds[best[1]], abs=step)
+  assert _logLikelihood(uncensored, censored, mean, std) >= grid[best]
+
+
+
+def test_learn_prior_methods_agree():
+
+  sent, received = _sample()
+  observe = [[s, r] for s, r in zip(sent.tolist(), received.tolist())]
+
+  gridMean, gridStd, gridReliability, gridLearn = \
+      learn_prior(observe, 100, 20, method='grid')
+  mleMean, mleStd, mleReliability, mleLearn = \
+      learn_prior(observe, 100, 20, method='mle')
+
+  # the grid steps the mean by 1 and the std by 0.1
+  assert mleMean == pytest.approx(gridMean, abs=1)
+  assert mleStd == pytest.approx(gridStd, abs=0.2)
+  assert (mleReliability, mleLearn) == (gridReliability, gridLearn)
+
+
+
+@pytest.mark.parametrize('engine', [Simulation.executeSimulation,
+                                    VectorSimulation.executeSimulation])
+def test_simulation_uses_capacity_method(monkeypatch, tmp_path, engine):
+
+  calls = []
+  def spy(uncensored, censored):
+    calls.append(len(uncensored))
+    return censored_normal_mle(uncensored, censored)
+
+  monkeypatch.setattr(learn_capacity_reliability, 'censored_normal_mle', spy)
+
+  outputs = {}
+  for method in ['grid', 'mle']:
+    monkeypatch.setattr(Strategies, 'CAPACITY_METHOD', method)
+    calls.clear()
+    nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=3)
+    outFile = str(tmp_path / (method + '.out'))
+    engine(40, nodes, networks, outFile)
+    with open(outFile) as f:
+      outputs[method] = f.read()
+    # only the mle method solves for the censored maximum likelihood
+    assert (len(calls) > 0) == (method == 'mle')
+
+  assert outputs['grid'] != outputs['mle']
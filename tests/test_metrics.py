@@ -0,0 +1,81 @@
+import random
+import numpy as np
+import pytest
+import Metrics
+
+
+TRAFFIC = [5, 0, 12, 30, 3]
+CARRIED = 20
+DRAWS = 20000
+
+
+def _draws(sampling,
+           trafficRecieved,
+           carriedThrough,
+           rng):
+
+  return np.array([Metrics._SAMPLES[sampling](trafficRecieved,
+                                              carriedThrough,
+                                              rng)
+                   for draw in range(DRAWS)])
+
+
+
+def _hypergeometricMoments(trafficRecieved,
+                           carriedThrough):
+
+  # mean and variance of the packets returned to each node
+  traffic = np.array(trafficRecieved, dtype=float)
+  total = traffic.sum()
+  share = traffic / total
+  mean = carriedThrough * share
+  variance = carriedThrough * share * (1 - share) * \
+             (total - carriedThrough) / (total - 1)
+  return mean, variance
+
+
+
+@pytest.mark.parametrize('seeded', [False, True])
+def test_hypergeometric_matches_sampling_packets(seeded):
+
+  random.seed(1)
+  np.random.seed(1)
+  rng = np.random.default_rng(1) if seeded else None
+
+  draws = {sampling: _draws(sampling, TRAFFIC, CARRIED, rng)
+           for sampling in Metrics._SAMPLES}
+  mean, variance = _hypergeometricMoments(TRAFFIC, CARRIED)
+
+  for sampling, returned in draws.items():
+    assert np.all(returned.sum(axis=1) == CARRIED)
+    assert np.all((returned >= 0) & (returned <= TRAFFIC))
+
+    # within 5 standard errors of the mean, and 5% of the variance
+    assert np.all(np.abs(returned.mean(axis=0) - mean) <= \
+                  5 * np.sqrt(variance / DRAWS) + 1e-12)
+    assert np.allclose(returned.var(axis=0), variance, rtol=0.05, atol=1e-12)
+
+  assert np.all(np.abs(draws['hypergeometric'].mean(axis=0) - \
+                       draws['sample'].mean(axis=0)) <= \
+                5 * np.sqrt(2 * variance / DRAWS) + 1e-12)
+
+
+
+@pytest.mark.parametrize('sampling', sorted(Metrics._SAMPLES))
+@pytest.mark.parametrize('seeded', [False, True])
+def test_surviving_packet_bounds(sampling, seeded):
+
+  rng = np.random.default_rng(2) if seeded else None
+
+  # nothing returned, or every packet returned
+  assert Metrics._returnTraffic(TRAFFIC, 100, 0.0,
+                                sampling=sampling, rng=rng) == [0] * len(TRAFFIC)
+  assert Metrics._returnTraffic(TRAFFIC, 100, 1.0,
+                                sampling=sampling, rng=rng) == TRAFFIC
+  assert list(Metrics._SAMPLES[sampling](TRAFFIC, sum(TRAFFIC), rng)) == TRAFFIC
+
+  # capacity bounds the packets returned
+  returned = Metrics._returnTraffic(TRAFFIC, 10, 1.0,
+                                    sampling=sampling, rng=rng)
+  assert sum(returned) == 10
+  assert all(0 <= packets <= sent for packets, sent in zip(returned, TRAFFIC))
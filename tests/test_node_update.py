@@ -0,0 +1,56 @@
+import pytest
+import ParseFile
+import Simulation
+import SourceNode
+import Strategies
+import VectorSimulation
+from conftest import EXAMPLE_CONFIG
+
+
+ENGINES = {'python': Simulation.executeSimulation,
+           'numpy': VectorSimulation.executeSimulation}
+
+
+def _readOutput(fileName):
+
+  with open(fileName) as f:
+    return f.read()
+
+
+
+@pytest.mark.parametrize('engine', sorted(ENGINES))
+def test_fast_update_matches_safe(tmp_path, engine):
+
+  outputs = {}
+  for update in ['safe', 'fast']:
+    nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=3)
+    outFile = str(tmp_path / (update + '.out'))
+    ENGINES[engine](40, nodes, networks, outFile, nodeUpdate=update)
+    outputs[update] = _readOutput(outFile)
+
+  assert outputs['safe'] == outputs['fast']
+
+
+
+def test_safe_update_leaves_node_untouched():
+
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=3)
+  node = nodes[0]
+  loadBalance = list(node[SourceNode.CURRENT_LOAD_BALANCE])
+  trafficSent = [30] * len(networks)
+  networkResponse = [{Strategies.PACKETS_RETURNED: 25,
+                      Strategies.COST: 1.0,
+                      Strategies.SPEED: 1.0}] * len(networks)
+
+  safe = SourceNode.updateNodeStrategy(node, len(networks), trafficSent,
+                                       networkResponse, update='safe')
+
+  assert safe is not node
+  assert node[SourceNode.CURRENT_LOAD_BALANCE] == loadBalance
+
+  fast = SourceNode.updateNodeStrategy(node, len(networks), trafficSent,
+                                       networkResponse, update='fast')
+
+  assert fast is node
+  assert fast[SourceNode.CURRENT_LOAD_BALANCE] == \
+         safe[SourceNode.CURRENT_LOAD_BALANCE]
@@ -0,0 +1,141 @@
+import warnings
+import numpy as np
+import pytest
+import optimize
+
+
+def _problems(count,
+              seed=0):
+
+  # random problems with 1 to 4 networks
+  rng = np.random.default_rng(seed)
+  problems = []
+  for i in range(count):
+    n = rng.integers(1, 5)
+    problems.append((rng.uniform(50, 150, n),
+                     rng.uniform(5, 30, n),
+                     rng.uniform(0.5, 2, n),
+                     rng.uniform(50, 400)))
+  return problems
+
+
+
+@pytest.mark.parametrize('mu, sig, a, p', _problems(40))
+def test_waterfill_matches_cvxopt(mu, sig, a, p):
+
+  pytest.importorskip('cvxopt')
+  optimize.solvers.options['show_progress'] = False
+
+  waterfill = np.array(optimize.solve_opt(mu, sig, a, p, solver='waterfill'))
+  cvxopt = np.array(optimize.solve_opt(mu, sig, a, p, solver='cvxopt'))
+
+  assert np.all(waterfill >= 0)
+  assert np.sum(waterfill) == pytest.approx(p)
+  # cvxopt stops at its own tolerance, so water-filling can do a bit better
+  fWaterfill = optimize.eval_objective(mu, sig, a, waterfill)[0]
+  fCvxopt = optimize.eval_objective(mu, sig, a, cvxopt)[0]
+  assert fWaterfill >= fCvxopt - 1e-8 * abs(fCvxopt)
+  assert fWaterfill == pytest.approx(fCvxopt, rel=1e-6)
+
+
+
+@pytest.mark.parametrize('mu, sig, a, p', _problems(40, seed=1))
+def test_objective_matches_quadrature(mu, sig, a, p):
+
+  pytest.importorskip('cvxopt')
+
+  # the reference functions are negated, for cvxopt's minimization
+  x = np.random.default_rng(2).dirichlet(np.ones(len(mu))) * p
+  f, fGrad, fHess = optimize.eval_objective(mu, sig, a, x)
+
+  assert f == pytest.approx(-optimize.eval_f(mu, sig, a, x), rel=1e-10)
+  assert fGrad == pytest.approx(
+      -np.array(optimize.eval_f_grad(mu, sig, a, x)).ravel(), rel=1e-10)
+  assert fHess == pytest.approx(
+      -np.diag(np.array(optimize.matrix(optimize.eval_f_Hess(mu, sig, a, x)))),
+      rel=1e-10)
+
+
+
+def test_batch_uses_solve_cache():
+
+  mu = [[100, 90], [80, 70], [100, 90]]
+  sig = [[10, 10]] * 3
+  a = [[1, 1.2]] * 3
+  p = [150, 150, 150]
+
+  optimize.enable_solve_cache(16)
+  try:
+    first = optimize.solve_opt_batch(mu, sig, a, p)
+    assert optimize.solve_cache_stats() == {'hits': 0, 'misses': 3, 'size': 2}
+
+    second = optimize.solve_opt_batch(mu, sig, a, p)
+    assert optimize.solve_cache_stats()['hits'] == 3
+    assert np.array_equal(first, second)
+
+    # single and batch solves share the cache
+    assert optimize.solve_opt(mu[0], sig[0], a[0], p[0]) == first[0].tolist()
+    assert optimize.solve_cache_stats()['hits'] == 4
+  finally:
+    optimize.disable_solve_cache()
+
+
+
+@pytest.mark.parametrize('mu, sig, a', [([100], [10], [1]),
+                                        ([100, 50], [10, 5], [1, 2])])
+@pytest.mark.parametrize('p', [700, 1e3, 1e6])
+def test_waterfill_far_above_capacity(mu, sig, a, p):
+
+  with np.errstate(over='raise', invalid='raise'):
+    x = np.array(optimize.solve_opt(mu, sig, a, p))
+
+  assert np.all(np.isfinite(x))
+  assert np.sum(x) == pytest.approx(p)
+
+
+
+@pytest.mark.parametrize('init_point', [None, [0.5, 0.3, 0.2]])
+def test_waterfill_zero_variance(init_point):
+
+  # the first network's capacity is known exactly
+  mu = [100, 80, 120]
+  sig = [0, 10, 15]
+  a = [1.5, 1, 1.2]
+
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    for p in [50, 150, 400]:
+      x = np.array(optimize.solve_opt(mu, sig, a, p, init_point=init_point))
+      assert np.all(x >= 0)
+      assert np.sum(x) == pytest.approx(p)
+
+      batch = optimize.solve_opt_batch([mu], [sig], [a], [p],
+                                       None if init_point is None else [init_point])
+      assert batch[0] == pytest.approx(x, rel=1e-6, abs=1e-6)
+
+    # below its capacity, the best network takes everything
+    assert optimize.solve_opt(mu, sig, a, 50) == pytest.approx([50, 0, 0])
+
+
+
+@pytest.mark.parametrize('warm', [False, True])
+def test_batch_matches_single_solves(warm):
+
+  # random problems with 3 networks, some far above capacity and some with
+  # networks of known capacity
+  rng = np.random.default_rng(3)
+  count = 60
+  mu = rng.uniform(50, 150, (count, 3))
+  sig = rng.uniform(5, 30, (count, 3))
+  sig[::4, 0] = 0
+  sig[1::6] = 0
+  a = rng.uniform(0.5, 2, (count, 3))
+  p = rng.uniform(50, 400, count)
+  p[::5] = np.sum(mu[::5], axis=1) + rng.uniform(100, 1000, len(p[::5]))
+  initPoint = rng.dirichlet(np.ones(3), count) if warm else None
+
+  batch = optimize.solve_opt_batch(mu, sig, a, p, initPoint)
+  for i in range(count):
+    single = optimize.solve_opt(mu[i], sig[i], a[i], p[i],
+                                None if initPoint is None else initPoint[i])
+    assert batch[i].tolist() == single
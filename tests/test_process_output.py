@@ -0,0 +1,104 @@
+import shutil
+import configparser
+import ParseFile
+import ProcessOutput
+import Simulation
+from conftest import EXAMPLE_CONFIG
+
+
+def _writeOutput(outFile,
+                 timeSteps,
+                 seed):
+
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=seed)
+  Simulation.executeSimulation(timeSteps, nodes, networks, outFile,
+                               writeIndex=True)
+
+
+
+def test_index_matches_built_index(tmp_path):
+
+  outFile = str(tmp_path / 'run.out')
+  _writeOutput(outFile, 30, 2)
+
+  written = ProcessOutput.readIndex(outFile)
+  assert (written == ProcessOutput.buildIndex(outFile)).all()
+  assert ProcessOutput.readStep(outFile, 12) == \
+         ProcessOutput.processOutput(outFile)[12]
+
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+
+  # an output replaced without its index, as by a copy
+  outFile = str(tmp_path / 'run.out')
+  shorterFile = str(tmp_path / 'shorter.out')
+  _writeOutput(outFile, 30, 2)
+  _writeOutput(shorterFile, 20, 1)
+  shutil.copyfile(shorterFile, outFile)
+
+  expected = ProcessOutput.processOutput(shorterFile)
+  for timeStep in range(5, 15):
+    assert ProcessOutput.readStep(outFile, timeStep) == expected[timeStep]
+  assert len(ProcessOutput.readIndex(outFile)) == 20
+
+
+
+# values as the strategies and networks could hold them, with everything
+# str prints differently from JSON
+STRATEGY_INFOS = [
+    {'prior_vals': [{'capacity': {'prior_mu': float('nan'),
+                                  'prior_var': float('inf')}},
+                    {'capacity': {'prior_mu': -float('inf'),
+                                  'prior_var': 1e-300}}],
+     'packet_record': [[(37, 34), (12, 12)], [[], [[1, 2], [3]]]],
+     'names': ("it's", 'say "hi"', 'a", "b', 'both \' and "', 'back\\slash'),
+     'flags': [True, False, None],
+     1: {(2, 3): -0.0}},
+    {'packet_record': [['a", "b'], ["'"]],
+     'current_iteration': 10**20}]
+
+
+
+def _evalOutput(fileName):
+
+  # the reader before iterateOutput, which evaluated every value
+  config = configparser.ConfigParser(interpolation=None)
+  config.read(fileName)
+
+  return {eval(entry): {key: eval(value, {'nan': float('nan'),
+                                          'inf': float('inf')})
+                        for key, value in config[entry].items()}
+          for entry in config if entry != 'DEFAULT'}
+
+
+
+def test_literals_round_trip(tmp_path):
+
+  nodeNames = ['node_1', 'node_2']
+  networkNames = ['network_1', 'network_2']
+  record = (3,
+            [[37, 12], [0, 5]],
+            [[34, 12], [0, 5]],
+            [[0.75, 0.25], [float('nan'), 1.0]],
+            STRATEGY_INFOS,
+            [{'cost': 1 / 3, 'speed': 2 / 3}, {'cost': 0.5, 'labels': ['a", "b']}],
+            [{'capacity': 92.5, 'reliability': float('inf')},
+             {'capacity': (1, 2), 'reliability': [0.5, [0.25]]}])
+
+  outFile = tmp_path / 'literals.out'
+  outFile.write_text(Simulation._formatStep(record, nodeNames, networkNames))
+
+  expected = {}
+  for nodeName, values in zip(nodeNames, zip(*record[1:6])):
+    for field, value in zip(ProcessOutput.NODE_FIELDS, values):
+      expected['{}-{}'.format(nodeName, field)] = value
+  expected.update(zip(networkNames, record[6]))
+
+  # repr tells nan, tuples and lists apart, where == does not
+  read = ProcessOutput.processOutput(str(outFile))
+  assert list(read) == [3]
+  assert {key: repr(value) for key, value in read[3].items()} == \
+         {key: repr(value) for key, value in expected.items()}
+  assert {key: repr(value) for key, value in _evalOutput(str(outFile))[3].items()} == \
+         {key: repr(value) for key, value in read[3].items()}
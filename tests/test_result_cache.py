@@ -0,0 +1,51 @@
+import ParseFile
+import ResultCache
+from conftest import EXAMPLE_CONFIG
+
+
+# example.conf with numbers, spacing and comments written differently
+REFORMATTED = """
+[parameters]
+netParameters = [ 'capacity', 'reliability', 'cost', 'speed' ]
+nodeParameters = ['cost','speed']
+
+# the same two nodes
+[node_1]
+strategy = final
+parameters = 75.0   5
+weights = [1.0, 1, 1.00]
+
+[node_2]
+strategy = final
+parameters =   75 5.0
+weights = [1, 1, 1]
+
+[network_1]
+metricParameters = [(92.0, 12), (0.940, 0.0), (1, 0.060), (1.0, 0.02)]
+metrics = testMetric
+
+[network_2]
+metricParameters = [ (92,12), (0.88,0), (2.0,0.03), (2,0.070) ]
+metrics = testMetric
+"""
+
+
+
+def test_equivalent_configs_share_a_key(tmp_path):
+
+  reformatted = tmp_path / 'reformatted.conf'
+  reformatted.write_text(REFORMATTED)
+
+  original = ParseFile.readConfig(EXAMPLE_CONFIG)
+  assert original != ParseFile.readConfig(str(reformatted))
+  assert ResultCache.runKey(original, seed=1) == \
+         ResultCache.runKey(ParseFile.readConfig(str(reformatted)), seed=1)
+
+  # a different configuration or run gets a different key
+  changed = ParseFile.readConfig(str(reformatted))
+  changed['network_2']['metricparameters'] = \
+      '[(92,12), (0.5,0), (2.0,0.03), (2,0.070)]'
+  assert ResultCache.runKey(changed, seed=1) != \
+         ResultCache.runKey(original, seed=1)
+  assert ResultCache.runKey(original, seed=2) != \
+         ResultCache.runKey(original, seed=1)
@@ -0,0 +1,83 @@
+import math
+import numpy as np
+import pytest
+import ParseFile
+import Simulation
+import SourceNode
+import VectorSimulation
+from conftest import EXAMPLE_CONFIG
+
+
+LOAD_BALANCE = [0.15, 0.3, 0.05, 0.5]
+DRAWS = 20000
+
+
+def _expectedTraffic(loadBalance,
+                     numPackets):
+
+  # the whole packets of the load balance, and the leftover packets spread
+  # by it
+  floored = [math.floor(load * numPackets) for load in loadBalance]
+  leftover = numPackets - sum(floored)
+  return np.array(floored) + leftover * np.array(loadBalance)
+
+
+
+@pytest.mark.parametrize('numPackets', [0, 1, 7, 93])
+def test_multinomial_split_keeps_totals_and_load_balance(numPackets):
+
+  rng = np.random.default_rng(5)
+  splits = np.array([SourceNode._splitTraffic_multinomial(LOAD_BALANCE,
+                                                          numPackets,
+                                                          rng)
+                     for draw in range(DRAWS)])
+
+  assert np.all(splits >= 0)
+  assert np.all(splits.sum(axis=1) == numPackets)
+
+  # within 5 standard errors of the expected split
+  standardError = splits.std(axis=0) / math.sqrt(DRAWS)
+  assert np.all(np.abs(splits.mean(axis=0) - \
+                       _expectedTraffic(LOAD_BALANCE, numPackets)) <= \
+                5 * standardError + 1e-12)
+
+
+
+def test_multinomial_split_matches_sequential_in_expectation():
+
+  rng = np.random.default_rng(6)
+  splits = {split: np.array([SourceNode._SPLITS[split](LOAD_BALANCE, 7, rng)
+                             for draw in range(DRAWS)])
+            for split in SourceNode._SPLITS}
+
+  standardError = np.sqrt((splits['sequential'].var(axis=0) + \
+                           splits['multinomial'].var(axis=0)) / DRAWS)
+  assert np.all(np.abs(splits['sequential'].mean(axis=0) - \
+                       splits['multinomial'].mean(axis=0)) <= \
+                5 * standardError + 1e-12)
+
+
+
+@pytest.mark.parametrize('split', sorted(SourceNode._SPLITS))
+def test_seeded_engines_split_the_same_way(tmp_path, split):
+
+  outputs = []
+  for engine in [Simulation.executeSimulation,
+                 VectorSimulation.executeSimulation]:
+    nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=4)
+    outFile = str(tmp_path / 'split.out')
+    engine(30, nodes, networks, outFile, split=split)
+    with open(outFile) as f:
+      outputs.append(f.read())
+
+  assert outputs[0] == outputs[1]
+
+
+
+def test_unknown_split_is_rejected():
+
+  nodes, networks = ParseFile.parseInput(EXAMPLE_CONFIG, seed=4)
+  for engine in [Simulation.executeSimulation,
+                 VectorSimulation.executeSimulation]:
+    with pytest.raises(ValueError):
+      engine(1, nodes, networks, None, split='uniform')